@@ -0,0 +1,44 @@
+import json
+import time
+
+from cosmo.clients.netbox_session import NetboxSessionPool
+
+
+class FakeResponse:
+    def __init__(self, obj, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(obj)
+        self.content = self.text.encode()
+        self.obj = obj
+
+    def json(self):
+        return self.obj
+
+
+class LatencySessionPool(NetboxSessionPool):
+    # stands in for a Netbox instance answering every request
+    # with empty data after a fixed latency
+    def __init__(self, latency: float):
+        super().__init__("benchmark")
+        self.latency = latency
+
+    def get(self, url, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse({"next": None, "results": []})
+
+    def post(self, url, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse({"data": {"device_list": [], "interface_list": []}})
+
+
+def device_config(n_devices: int) -> dict:
+    return {
+        "router": [f"router{i}" for i in range(n_devices // 2)],
+        "switch": [f"switch{i}" for i in range(n_devices - n_devices // 2)],
+    }
+
+
+def timed(f, *args, **kwargs) -> tuple[float, object]:
+    start_time = time.perf_counter()
+    result = f(*args, **kwargs)
+    return time.perf_counter() - start_time, result
@@ -0,0 +1,92 @@
+# Measures how fast Netbox data is converted to cosmo's Netbox types, how
+# much memory the converted data takes, with dict or compact stores, and how
+# fast ancestors are looked up in it.
+# usage: python -m benchmarks.conversion [n_interfaces] [rounds] [dict|compact]
+import resource
+import sys
+import tracemalloc
+
+from benchmarks.common import timed
+from cosmo.compact_types import enable_compact_types
+from cosmo.netbox_types import DeviceType, InterfaceType
+
+
+def synthetic_device(n_interfaces: int) -> dict:
+    def tag(i):
+        return {"__typename": "TagType", "id": str(i), "name": f"tag{i}"}
+
+    def vlan(i):
+        return {"__typename": "VLANType", "id": str(i), "name": f"vlan{i}", "vid": i}
+
+    return {
+        "__typename": "DeviceType",
+        "id": "1",
+        "name": "router1",
+        "interfaces": [
+            {
+                "__typename": "InterfaceType",
+                "id": str(i),
+                "name": f"et-0/0/{i}",
+                "enabled": True,
+                "ip_addresses": [
+                    {"__typename": "IPAddressType", "address": f"10.0.{i % 256}.1/24"}
+                ],
+                "tags": [tag(i % 10), tag(i % 7)],
+                "untagged_vlan": vlan(i % 4094 + 1),
+                "tagged_vlans": [vlan((i + j) % 4094 + 1) for j in range(3)],
+                "custom_fields": {},
+            }
+            for i in range(n_interfaces)
+        ],
+    }
+
+
+def lookup_ancestors(device: DeviceType) -> int:
+    # like the visitors do, from the nodes below the interfaces
+    lookups = 0
+    for interface in device["interfaces"]:
+        for o in [*interface["ip_addresses"], *interface["tagged_vlans"]]:
+            o.getParent(InterfaceType)
+            o.getParent(DeviceType)
+            lookups += 2
+    return lookups
+
+
+def main() -> int:
+    n_interfaces = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    store = sys.argv[3] if len(sys.argv) > 3 else "dict"
+    if store == "compact":
+        enable_compact_types()
+    device = synthetic_device(n_interfaces)
+    # the interface, its IP address, 2 tags and 4 VLANs
+    n_nodes = 1 + n_interfaces * 8
+
+    best = min(timed(DeviceType, device)[0] for _ in range(rounds))
+    tracemalloc.start()
+    converted = DeviceType(device)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # peak RSS of the whole process, run each store in its own process
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    lookup_time, lookups = min(
+        timed(lookup_ancestors, converted) for _ in range(rounds)
+    )
+
+    print(
+        f"{store} stores, {n_nodes} typed nodes ({len(converted['interfaces'])} interfaces)"
+    )
+    print(
+        f"{'conversion':>10}: {best:8.3f} s (best of {rounds}), {n_nodes / best:.0f} nodes/s"
+    )
+    print(
+        f"{'getParent':>10}: {lookup_time:8.3f} s (best of {rounds}), "
+        f"{lookups / lookup_time:.0f} lookups/s"
+    )
+    print(f"{'retained':>10}: {retained / 2**20:8.1f} MiB")
+    print(f"{'peak RSS':>10}: {peak_rss / 2**10:8.1f} MiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
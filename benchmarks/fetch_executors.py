@@ -0,0 +1,31 @@
+# Compares the fetch executor backends against a simulated Netbox.
+# usage: python -m benchmarks.fetch_executors [n_devices] [latency_seconds]
+import sys
+
+from benchmarks.common import LatencySessionPool, device_config, timed
+from cosmo.clients.fetch_executor import FetchExecutorFactory
+from cosmo.clients.netbox_v4 import NetboxV4Strategy
+
+
+def main() -> int:
+    n_devices = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    feature_flags = {"routing": True, "ippools": True, "tobago": True}
+
+    print(f"{n_devices} devices, {latency * 1000:.0f} ms simulated latency")
+    for name in FetchExecutorFactory.getAllExecutorNames():
+        strategy = NetboxV4Strategy(
+            "https://netbox.example.com",
+            LatencySessionPool(latency),
+            multiple_mac_addresses=True,
+            netbox_43_query_syntax=True,
+            feature_flags=feature_flags,
+            fetch_executor=name,
+        )
+        elapsed, _ = timed(strategy.get_data, device_config(n_devices))
+        print(f"{name:>10}: {elapsed:8.3f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+# Times fetching and serialization separately, from a snapshot recorded
+# with `cosmo --record SNAPSHOT`, so no Netbox is needed.
+# usage: python -m benchmarks.snapshot SNAPSHOT [CFGFILE]
+import sys
+
+from benchmarks.common import timed
+from cosmo.clients.netbox import NetboxClient
+from cosmo.common import DeviceSerializationError
+from cosmo.config.cosmo_config import CosmoConfig
+from cosmo.features import features
+from cosmo.serializer import RouterSerializer, SwitchSerializer
+
+
+def serialize_all(cosmo_data: dict, cosmo_configuration: CosmoConfig) -> int:
+    devices = cosmo_configuration["devices"]
+    serialized = 0
+    for device in cosmo_data["device_list"]:
+        try:
+            if device["name"] in devices["router"]:
+                RouterSerializer(
+                    device,
+                    cosmo_data["l2vpn_list"],
+                    cosmo_data["loopbacks"],
+                    cosmo_configuration,
+                ).serialize()
+            elif device["name"] in devices["switch"]:
+                SwitchSerializer(device, cosmo_configuration).serialize()
+            serialized += 1
+        except DeviceSerializationError:
+            pass
+    return serialized
+
+
+def main() -> int:
+    if len(sys.argv) < 2:
+        print(f"usage: python -m benchmarks.snapshot SNAPSHOT [CFGFILE]")
+        return 1
+    snapshot = sys.argv[1]
+    cosmo_configuration = CosmoConfig(sys.argv[2] if len(sys.argv) > 2 else "cosmo.yml")
+    features.setFeaturesFromConfig(cosmo_configuration.toDict())
+
+    nc = NetboxClient(None, None, replay=snapshot)
+    fetch_time, cosmo_data = timed(nc.get_data, cosmo_configuration["devices"])
+    serialize_time, serialized = timed(serialize_all, cosmo_data, cosmo_configuration)
+
+    print(f"{'fetch':>10}: {fetch_time:8.3f} s")
+    print(f"{'serialize':>10}: {serialize_time:8.3f} s ({serialized} devices)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
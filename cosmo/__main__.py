@@ -1,13 +1,18 @@
-import json
 import os
 import sys
-import pathlib
 
 import yaml
 import argparse
 
+from cosmo.clients.cache import DiskResponseCache, MemoryResponseCache
+from cosmo.clients.fetch_executor import FetchExecutorFactory
 from cosmo.clients.netbox import NetboxClient
+from cosmo.clients.netbox_client import NetboxAPIClient
+from cosmo.clients.netbox_session import NetboxSessionPool
+from cosmo.compact_types import enable_compact_types
 from cosmo.config.cosmo_config import CosmoConfig
+from cosmo.daemon import CosmoDaemon, request_generation
+from cosmo.webhook import ChangeDebouncer, WebhookRegenerator
 from cosmo.features import features
 from cosmo.log import (
     info,
@@ -16,7 +21,12 @@ from cosmo.log import (
     error,
     HumanReadableLoggingStrategy,
 )
-from cosmo.serializer import RouterSerializer, SwitchSerializer
+from cosmo.generator import (
+    get_device_fqdn,
+    is_device_allowed,
+    serialize_device,
+    write_device_output,
+)
 from cosmo.common import DeviceSerializationError, APP_NAME
 
 
@@ -44,6 +54,81 @@ def main() -> int:
         "--json", "-j", action="store_true", help="Toggle machine readable output on"
     )
     parser.add_argument("--debug", action="store_true", help="Toggle debug logging on")
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        metavar="DIR",
+        help="Persist Netbox responses in DIR and reuse them while Netbox data is unchanged",
+    )
+    parser.add_argument(
+        "--incremental-state",
+        default=None,
+        metavar="FILE",
+        help="Only refetch devices changed in Netbox since the run which wrote FILE",
+    )
+    snapshot_group = parser.add_mutually_exclusive_group()
+    snapshot_group.add_argument(
+        "--record",
+        default=None,
+        metavar="SNAPSHOT",
+        help="Record every exchange with Netbox to the SNAPSHOT archive (.tar.gz)",
+    )
+    snapshot_group.add_argument(
+        "--replay",
+        default=None,
+        metavar="SNAPSHOT",
+        help="Answer every Netbox request from the SNAPSHOT archive, Netbox is not contacted",
+    )
+    parser.add_argument(
+        "--compact-types",
+        action="store_true",
+        help="Keep converted Netbox data in compact slot-based objects, saves memory on large runs",
+    )
+    parser.add_argument(
+        "--fetch-report",
+        default=None,
+        metavar="FILE",
+        help="Write per-query fetch metrics (requests, latency, bytes, cache hits) to FILE as JSON",
+    )
+    parser.add_argument(
+        "--fetch-executor",
+        default=None,
+        choices=FetchExecutorFactory.getAllExecutorNames(),
+        help="Concurrency backend used to fetch data from Netbox (default: thread)",
+    )
+    daemon_group = parser.add_mutually_exclusive_group()
+    daemon_group.add_argument(
+        "--serve",
+        default=None,
+        metavar="SOCKET",
+        help="Keep Netbox data in memory and generate devices on requests sent to the unix SOCKET",
+    )
+    daemon_group.add_argument(
+        "--server",
+        default=None,
+        metavar="SOCKET",
+        help="Have the daemon serving on the unix SOCKET generate the devices",
+    )
+    daemon_group.add_argument(
+        "--webhook-listen",
+        default=None,
+        metavar="[HOST:]PORT",
+        help="Regenerate the devices affected by changes Netbox reports to webhooks on [HOST:]PORT",
+    )
+    parser.add_argument(
+        "--webhook-quiet-period",
+        default=ChangeDebouncer.DEFAULT_QUIET_PERIOD,
+        type=float,
+        metavar="SECONDS",
+        help="Regenerate once no webhook came in for SECONDS (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--refresh-interval",
+        default=CosmoDaemon.DEFAULT_REFRESH_INTERVAL,
+        type=float,
+        metavar="SECONDS",
+        help="How often the daemon refetches Netbox data (default: %(default)s)",
+    )
     parser.add_argument(
         "--disable-feature",
         default=[],
@@ -77,6 +162,9 @@ def main() -> int:
             )
         )
 
+    if args.compact_types:
+        enable_compact_types()
+
     if len(args.limit) > 1:
         allowed_hosts = args.limit
     elif len(args.limit) == 1 and args.limit[0] != "ci":
@@ -84,63 +172,120 @@ def main() -> int:
     else:
         allowed_hosts = None
 
+    def noop(*args, **kwargs):
+        pass
+
+    # Note: There is no better way of doing this.
+    yaml.emitter.Emitter.process_tag = noop  # type: ignore
+
+    if args.server:
+        # config and Netbox are the daemon's business
+        response = request_generation(
+            args.server,
+            {
+                "limit": allowed_hosts,
+                "features": getattr(args, "feature_toggles", None) or {},
+            },
+        )
+        for e in response["errors"]:
+            error(f"Device will not be generated, {e} was encountered.", None)
+        for device_fqdn, content in response["devices"].items():
+            info(f"generating...", device_fqdn)
+            write_device_output(device_fqdn, content, response["output_format"])
+        logger.flush()
+        return 0
+
     cosmo_configuration = CosmoConfig(args.config)
     features.setFeaturesFromConfig(cosmo_configuration.toDict())
     info(f"Feature toggles for {APP_NAME}: {features}")
-    info(f"Fetching information from Netbox, make sure VPN is enabled on your system.")
+    if args.replay:
+        info(f"Replaying Netbox data from {args.replay}.")
+    else:
+        info(
+            f"Fetching information from Netbox, make sure VPN is enabled on your system."
+        )
 
     netbox_url = os.environ.get("NETBOX_URL")
     netbox_api_token = os.environ.get("NETBOX_API_TOKEN")
 
-    if netbox_url is None:
+    if netbox_url is None and not args.replay:
         raise Exception("NETBOX_URL is empty.")
-    if netbox_api_token is None:
+    if netbox_api_token is None and not args.replay:
         raise Exception("NETBOX_API_TOKEN is empty.")
 
+    http_configuration = cosmo_configuration.get("http", {})
+    cache_configuration = cosmo_configuration.get("cache", {})
     nc = NetboxClient(
         url=netbox_url,
         token=netbox_api_token,
         verify_certs=cosmo_configuration.get("verify_certs", True),
+        pool_size=http_configuration.get(
+            "pool_size", NetboxSessionPool.DEFAULT_POOL_SIZE
+        ),
+        keep_alive=http_configuration.get("keep_alive", True),
+        timeout=http_configuration.get("timeout"),
+        concurrency=http_configuration.get("concurrency"),
+        rate_limit=http_configuration.get("rate_limit"),
+        page_sizes=http_configuration.get("page_sizes"),
+        max_inflight_pages=http_configuration.get(
+            "max_inflight_pages", NetboxAPIClient.DEFAULT_MAX_INFLIGHT_PAGES
+        ),
+        fetch_executor=(
+            args.fetch_executor
+            if args.fetch_executor
+            else cosmo_configuration.get("fetch_executor")
+        ),
+        device_batch=cosmo_configuration.get("device_batch"),
+        cache_dir=(
+            args.cache_dir if args.cache_dir else cache_configuration.get("dir")
+        ),
+        cache_ttl=cache_configuration.get("ttl", DiskResponseCache.DEFAULT_TTL),
+        cache_max_bytes=cache_configuration.get(
+            "max_bytes", DiskResponseCache.DEFAULT_MAX_BYTES
+        ),
+        memory_cache_max_bytes=cache_configuration.get(
+            "memory_max_bytes", MemoryResponseCache.DEFAULT_MAX_BYTES
+        ),
+        # webhook runs only fetch the changed devices, which must not end up
+        # as the whole state
+        incremental_state=(
+            None
+            if args.webhook_listen
+            else (
+                args.incremental_state
+                if args.incremental_state
+                else cosmo_configuration.get("incremental_state")
+            )
+        ),
+        record=args.record,
+        replay=args.replay,
+        fetch_report=args.fetch_report,
     )
-    cosmo_data = nc.get_data(cosmo_configuration["devices"])
 
-    def noop(*args, **kwargs):
-        pass
+    if args.serve:
+        CosmoDaemon(nc, cosmo_configuration, args.refresh_interval).serve(args.serve)
+        return 0
+    if args.webhook_listen:
+        host, _, port = args.webhook_listen.rpartition(":")
+        WebhookRegenerator(
+            nc,
+            cosmo_configuration,
+            allowed_hosts=allowed_hosts,
+            secret=os.environ.get("NETBOX_WEBHOOK_SECRET"),
+            quiet_period=args.webhook_quiet_period,
+        ).listen(host if host else "localhost", int(port))
+        return 0
 
-    # Note: There is no better way of doing this.
-    yaml.emitter.Emitter.process_tag = noop  # type: ignore
-
-    for device in cosmo_data["device_list"]:
-
-        if cosmo_configuration.get("fqdnSuffix"):
-            device_fqdn = (
-                f"{str(device['name']).lower()}.{cosmo_configuration['fqdnSuffix']}"
-            )
-        else:
-            device_fqdn = f"{str(device['name']).lower()}"
-
-        if (
-            allowed_hosts
-            and device["name"] not in allowed_hosts
-            and device_fqdn not in allowed_hosts
-        ):
+    # devices are generated while the other ones are still being fetched
+    for device, cosmo_data in nc.iter_data(cosmo_configuration["devices"]):
+        device_fqdn = get_device_fqdn(device, cosmo_configuration)
+        if not is_device_allowed(device, device_fqdn, allowed_hosts):
             continue
 
         info(f"generating...", device_fqdn)
 
-        content = None
         try:
-            if device["name"] in cosmo_configuration["devices"]["router"]:
-                router_serializer = RouterSerializer(
-                    device,
-                    cosmo_data["l2vpn_list"],
-                    cosmo_data["loopbacks"],
-                    cosmo_configuration,
-                )
-                content = router_serializer.serialize()
-            elif device["name"] in cosmo_configuration["devices"]["switch"]:
-                switch_serializer = SwitchSerializer(device, cosmo_configuration)
-                content = switch_serializer.serialize()
+            content = serialize_device(device, cosmo_data, cosmo_configuration)
         except DeviceSerializationError as dse:
             error(
                 f"Device will not be generated, {type(dse).__name__}"
@@ -149,39 +294,7 @@ def main() -> int:
             )
             continue
 
-        match cosmo_configuration["output_format"]:
-            case "ansible":
-                pathlib.Path(f"./host_vars/{device_fqdn}").mkdir(
-                    parents=True, exist_ok=True
-                )
-
-                if device["name"] in cosmo_configuration["devices"]["router"]:
-                    with open(
-                        f"./host_vars/{device_fqdn}/generated-cosmo.yml", "w"
-                    ) as yaml_file:
-                        yaml.dump(content, yaml_file, default_flow_style=False)
-                else:
-                    with open(
-                        f"./host_vars/{device_fqdn}/generated-cosmo.yml", "w"
-                    ) as yaml_file:
-                        yaml.dump(content, yaml_file, default_flow_style=False)
-            case "nix":
-                pathlib.Path(f"./machines/{device_fqdn}").mkdir(
-                    parents=True, exist_ok=True
-                )
-
-                if device["name"] in cosmo_configuration["devices"]["router"]:
-                    with open(
-                        f"./machines/{device_fqdn}/generated-cosmo.json", "w"
-                    ) as json_file:
-                        json.dump(content, json_file, indent=4)
-                else:
-                    with open(
-                        f"./machines/{device_fqdn}/generated-cosmo.json", "w"
-                    ) as json_file:
-                        json.dump(content, json_file, indent=4)
-            case other:
-                raise Exception(f"unsupported output format {other}")
+        write_device_output(device_fqdn, content, cosmo_configuration["output_format"])
 
     logger.flush()
     return 0
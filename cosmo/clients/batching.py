@@ -0,0 +1,80 @@
+import threading
+from typing import Self
+
+from cosmo.common import clip
+
+
+def chunked(l: list, size: int) -> list[list]:
+    return [l[i : i + size] for i in range(0, len(l), max(size, 1))]
+
+
+class AdaptiveBatchSizer:
+    # picks how many objects to put in a single request, so that responses
+    # stay under a byte and a latency budget. costs per object are learned
+    # from the responses seen so far (exponentially weighted).
+    DEFAULT_SIZE = 10
+    DEFAULT_MAX_SIZE = 100
+    DEFAULT_RESPONSE_BUDGET_BYTES = 4_000_000
+    DEFAULT_LATENCY_BUDGET = 5.0
+    SMOOTHING = 0.5
+
+    def __init__(
+        self,
+        size: int = DEFAULT_SIZE,
+        max_size: int = DEFAULT_MAX_SIZE,
+        response_budget_bytes: int = DEFAULT_RESPONSE_BUDGET_BYTES,
+        latency_budget: float = DEFAULT_LATENCY_BUDGET,
+        auto_tune: bool = True,
+    ):
+        self.size = size
+        self.max_size = max(max_size, size)
+        self.response_budget_bytes = response_budget_bytes
+        self.latency_budget = latency_budget
+        self.auto_tune = auto_tune
+        self._lock = threading.Lock()
+        self._bytes_per_object: float | None = None
+        self._seconds_per_object: float | None = None
+
+    @classmethod
+    def fromConfig(cls, config: dict | None) -> Self:
+        config = config if config else dict()
+        return cls(
+            size=config.get("size", cls.DEFAULT_SIZE),
+            max_size=config.get("max_size", cls.DEFAULT_MAX_SIZE),
+            response_budget_bytes=config.get(
+                "response_budget_bytes", cls.DEFAULT_RESPONSE_BUDGET_BYTES
+            ),
+            latency_budget=config.get("latency_budget", cls.DEFAULT_LATENCY_BUDGET),
+            auto_tune=config.get("auto_tune", True),
+        )
+
+    def _smooth(self, previous: float | None, observed: float) -> float:
+        if previous is None:
+            return observed
+        return self.SMOOTHING * observed + (1 - self.SMOOTHING) * previous
+
+    def record(self, n_objects: int, response_bytes: int, latency: float):
+        if n_objects <= 0:
+            return
+        with self._lock:
+            self._bytes_per_object = self._smooth(
+                self._bytes_per_object, response_bytes / n_objects
+            )
+            self._seconds_per_object = self._smooth(
+                self._seconds_per_object, latency / n_objects
+            )
+
+    def nextSize(self) -> int:
+        if not self.auto_tune:
+            return self.size
+        with self._lock:
+            bytes_per_object = self._bytes_per_object
+            seconds_per_object = self._seconds_per_object
+        if bytes_per_object is None or seconds_per_object is None:
+            return self.size
+        candidates = [self.max_size]
+        if bytes_per_object > 0:
+            candidates.append(int(self.response_budget_bytes / bytes_per_object))
+        if seconds_per_object > 0:
+            candidates.append(int(self.latency_budget / seconds_per_object))
+        return clip(min(candidates), 1, self.max_size)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit
+
+from cosmo import log
+
+
+class CachedResponse:
+    # the subset of requests.Response the clients use, built from cached bytes
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def normalize_url(url: str) -> str:
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    return urlunsplit(
+        (scheme, netloc, path, urlencode(sorted(parse_qsl(query))), fragment)
+    )
+
+
+class MemoryResponseCache:
+    # raw response bodies of the current run, decoded only by whoever reads
+    # them (see CachedResponse). least recently used entries are dropped
+    # once max_bytes is exceeded.
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return  # would evict everything else and itself
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[key] = body
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def logStatistics(self):
+        log.debug(
+            f"Memory cache: {self.hits} hit(s), {self.misses} miss(es), "
+            f"{len(self)} entries using {self.bytes} bytes, {self.evictions} evicted"
+        )
+
+
+class DiskResponseCache:
+    # response bodies persisted across runs. entries expire after ttl seconds
+    # and are only served while the Netbox fingerprint (see revalidate())
+    # is the same as when they were stored.
+    DEFAULT_TTL = 24 * 3600
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(
+        self,
+        cache_dir: str | os.PathLike,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.fingerprint: str | None = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes: int | None = None
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(
+            hashlib.sha256(key.encode()).hexdigest() + ".json"
+        )
+
+    def revalidate(self, fingerprint: str | None):
+        # entries stored under another fingerprint are stale from now on.
+        # without fingerprint nothing can be revalidated, so nothing is served.
+        self.fingerprint = fingerprint
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "r") as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+        if self.fingerprint is None:
+            self._count(hit=False)
+            return None
+        if (
+            entry.get("key") != key
+            or entry.get("fingerprint") != self.fingerprint
+            or time.time() - entry.get("stored_at", 0) > self.ttl
+        ):
+            path.unlink(missing_ok=True)
+            self._count(hit=False)
+            return None
+        os.utime(path)  # eviction is least recently used first
+        self._count(hit=True)
+        return entry["body"].encode()
+
+    def put(self, key: str, body: bytes):
+        if self.fingerprint is None:
+            return
+        entry = {
+            "key": key,
+            "fingerprint": self.fingerprint,
+            "stored_at": time.time(),
+            "body": body.decode("utf-8"),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(entry, tmp_file)
+        written = os.path.getsize(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += written
+            over_budget = (
+                self._total_bytes is None or self._total_bytes > self.max_bytes
+            )
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        # scans the cache directory, so it only runs when the running total
+        # says we are over budget (or on first use, to learn that total).
+        with self._lock:
+            entries = []
+            total = 0
+            for path in self.cache_dir.glob("*.json"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                path.unlink(missing_ok=True)
+                total -= size
+            self._total_bytes = total
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def logStatistics(self):
+        log.debug(
+            f"Disk cache {self.cache_dir}: {self.hits} hit(s), {self.misses} miss(es)"
+        )
@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Self
+
+from cosmo import log
+from cosmo.common import clip
+
+
+class TokenBucket:
+    # caps the request rate at rate requests per second, allowing bursts
+    # of up to burst requests
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDConcurrencyController:
+    # limits how many requests are in flight at the same time. the limit
+    # grows by one per window of successful requests (additive increase) and
+    # is halved when Netbox signals overload (multiplicative decrease): 429
+    # and 5xx gateway responses, timeouts, or answers slower than
+    # latency_target.
+    DEFAULT_INITIAL = 4
+    DEFAULT_MINIMUM = 1
+    DEFAULT_MAXIMUM = 32
+    DEFAULT_LATENCY_TARGET = 10.0
+    DECREASE_FACTOR = 0.5
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_INITIAL,
+        minimum: int = DEFAULT_MINIMUM,
+        maximum: int = DEFAULT_MAXIMUM,
+        latency_target: float | None = DEFAULT_LATENCY_TARGET,
+    ):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.latency_target = latency_target
+        self.limit = float(clip(initial, self.minimum, self.maximum))
+        self.max_in_flight = 0
+        self.decreases = 0
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def fromConfig(cls, config: dict | None) -> Self:
+        config = config if config else dict()
+        return cls(
+            initial=config.get("initial", cls.DEFAULT_INITIAL),
+            minimum=config.get("min", cls.DEFAULT_MINIMUM),
+            maximum=config.get("max", cls.DEFAULT_MAXIMUM),
+            latency_target=config.get("latency_target", cls.DEFAULT_LATENCY_TARGET),
+        )
+
+    def acquire(self) -> float:
+        # blocks until a request may be sent, returns its start time
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            return time.monotonic()
+
+    def release(self, started: float, overloaded: bool):
+        latency = time.monotonic() - started
+        congested = overloaded or (
+            self.latency_target is not None and latency > self.latency_target
+        )
+        with self._condition:
+            self._in_flight -= 1
+            if congested:
+                # requests sent before the last decrease saw the old limit,
+                # they must not shrink it again
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.DECREASE_FACTOR)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def logStatistics(self):
+        log.debug(
+            f"Concurrency: limit {int(self.limit)} (max {self.maximum}), "
+            f"{self.max_in_flight} request(s) in flight at most, "
+            f"{self.decreases} decrease(s)"
+        )
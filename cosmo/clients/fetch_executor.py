@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NoReturn, Self
+
+from cosmo.clients.metrics import record
+
+
+class FetchPromise:
+    # same contract as multiprocessing's AsyncResult, which is what
+    # ParallelQuery.merge_into used to consume.
+    def __init__(self, fn: Callable, args: tuple = ()):
+        self._fn = fn
+        self._args = args
+        # runs in the context it was submitted from, see metrics.query_scope()
+        self._context = contextvars.copy_context()
+        self._submitted = time.perf_counter()
+        self._claim_lock = threading.Lock()
+        self._claimed = False
+        self._done = threading.Event()
+        self._result: Any = None
+        self._exception: BaseException | None = None
+        self._callbacks_lock = threading.Lock()
+        self._callbacks: list[Callable[[Self], Any]] = list()
+
+    def claim(self) -> bool:
+        # whoever claims the promise first executes it. this lets a caller
+        # waiting on a promise nobody started yet run it itself, so nested
+        # fetches (queries submitting queries) cannot starve a bounded pool.
+        with self._claim_lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def _timedCall(self):
+        started = time.perf_counter()
+        try:
+            return self._fn(*self._args)
+        finally:
+            record(
+                tasks=1,
+                queued_time=started - self._submitted,
+                in_flight_time=time.perf_counter() - started,
+            )
+
+    def execute(self):
+        try:
+            self._result = self._context.run(self._timedCall)
+        except BaseException as e:
+            self._exception = e
+        finally:
+            with self._callbacks_lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, list()
+            for callback in callbacks:
+                callback(self)
+
+    def run(self):
+        if self.claim():
+            self.execute()
+
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def add_done_callback(self, callback: Callable[[Self], Any]):
+        # called by the thread completing the promise, or right away if it
+        # already is. callbacks must not block.
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def get(self, timeout: float | None = None):
+        self.run()
+        if not self._done.wait(timeout):
+            raise TimeoutError("fetch did not complete in time")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class AbstractFetchExecutor(ABC):
+    def __init__(self, workers: int):
+        self.workers = workers
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def apply_async(self, fn: Callable, args: tuple = ()) -> FetchPromise:
+        promise = FetchPromise(fn, args)
+        self._submit(promise)
+        return promise
+
+    @abstractmethod
+    def _submit(self, promise: FetchPromise):
+        pass
+
+    def close(self):
+        pass
+
+
+class InlineFetchExecutor(AbstractFetchExecutor):
+    # no concurrency at all, useful for tiny runs and for debugging
+    def _submit(self, promise: FetchPromise):
+        promise.run()
+
+
+class ThreadPoolFetchExecutor(AbstractFetchExecutor):
+    def __init__(self, workers: int):
+        super().__init__(workers)
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="cosmo-fetch"
+        )
+
+    def _submit(self, promise: FetchPromise):
+        self._pool.submit(promise.run)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class AsyncioFetchExecutor(AbstractFetchExecutor):
+    # event loop running in a background thread. requests is blocking, so
+    # fetches are still handed to threads, but admission is done by the
+    # loop through a semaphore of size workers.
+    def __init__(self, workers: int):
+        super().__init__(workers)
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cosmo-fetch")
+        )
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="cosmo-fetch-loop", daemon=True
+        )
+        self._thread.start()
+        self._semaphore = asyncio.run_coroutine_threadsafe(
+            self._makeSemaphore(workers), self._loop
+        ).result()
+        self._tasks_lock = threading.Lock()
+        self._tasks: list = list()
+
+    @staticmethod
+    async def _makeSemaphore(workers: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(workers)
+
+    async def _run(self, promise: FetchPromise):
+        async with self._semaphore:
+            if promise.claim():
+                await self._loop.run_in_executor(None, promise.execute)
+
+    def _submit(self, promise: FetchPromise):
+        task = asyncio.run_coroutine_threadsafe(self._run(promise), self._loop)
+        with self._tasks_lock:
+            self._tasks.append(task)
+
+    def close(self):
+        with self._tasks_lock:
+            tasks = list(self._tasks)
+            self._tasks.clear()
+        for task in tasks:
+            task.result()
+        asyncio.run_coroutine_threadsafe(
+            self._loop.shutdown_default_executor(), self._loop
+        ).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class FetchExecutorFactory:
+    DEFAULT = "thread"
+    _name_to_class: dict[str, type[AbstractFetchExecutor]] = {
+        "thread": ThreadPoolFetchExecutor,
+        "asyncio": AsyncioFetchExecutor,
+        "inline": InlineFetchExecutor,
+    }
+
+    def __init__(self, name: str | None = None):
+        self.name = name if name else self.DEFAULT
+
+    @classmethod
+    def getAllExecutorNames(cls) -> list[str]:
+        return list(cls._name_to_class.keys())
+
+    def get(self) -> type[AbstractFetchExecutor] | NoReturn:
+        if self.name not in self._name_to_class:
+            raise Exception(
+                f"unknown fetch executor {self.name}, "
+                f"choose one of {', '.join(self.getAllExecutorNames())}"
+            )
+        return self._name_to_class[self.name]
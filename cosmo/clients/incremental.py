@@ -0,0 +1,294 @@
+import json
+import os
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlencode, urljoin
+
+from cosmo import log
+from cosmo.clients.netbox_client import NetboxAPIClient
+
+
+class ChangeImpactResolver:
+    # maps changed Netbox objects to the names of the devices whose fetched
+    # data contains them (or depends on them, for L2VPNs).
+    MODEL_TO_TYPENAME = {
+        "dcim.device": "DeviceType",
+        "dcim.interface": "InterfaceType",
+        "ipam.ipaddress": "IPAddressType",
+        "ipam.vlan": "VLANType",
+        "ipam.vrf": "VRFType",
+        "extras.tag": "TagType",
+        "vpn.l2vpn": "L2VPNType",
+        "vpn.l2vpntermination": "L2VPNTerminationType",
+    }
+    # shared objects which are fetched without their id, we cannot
+    # tell which devices use them.
+    UNRESOLVABLE_MODELS = [
+        "dcim.devicetype",
+        "dcim.platform",
+        "dcim.manufacturer",
+        "ipam.routetarget",
+    ]
+    # objects cosmo does not fetch, changing them affects no device. any
+    # other model, e.g. cables and circuits which end up in the connected
+    # endpoints of devices far away, is assumed to be unresolvable.
+    UNUSED_MODELS = [
+        "dcim.region",
+        "dcim.sitegroup",
+        "dcim.site",
+        "dcim.location",
+        "dcim.rackrole",
+        "dcim.rack",
+        "dcim.rackreservation",
+        "dcim.powerpanel",
+        "dcim.powerfeed",
+        "tenancy.tenantgroup",
+        "tenancy.tenant",
+        "tenancy.contact",
+        "tenancy.contactassignment",
+        "extras.journalentry",
+    ]
+    # objects fetched without (or apart from) the device data, they carry a
+    # reference to their device or interface.
+    REFERENCING_MODELS = ["dcim.macaddress", "netbox_plugin_ip_pools.ippool"]
+    DEVICE_SCOPED_PLUGINS = ["netbox_plugin_routing"]
+    # webhooks only name the model, not its app. webhooks of other models
+    # (cables, circuits, ...) regenerate every device.
+    WEBHOOK_MODELS = {
+        m.split(".")[1]: m
+        for m in [
+            *MODEL_TO_TYPENAME.keys(),
+            *UNRESOLVABLE_MODELS,
+            *UNUSED_MODELS,
+            *REFERENCING_MODELS,
+        ]
+    } | {
+        "staticroute": "netbox_plugin_routing.staticroute",
+        "line": "netbox_plugin_tobago.line",
+        "linemember": "netbox_plugin_tobago.linemember",
+    }
+
+    def __init__(self, data: dict):
+        self._index: dict[tuple[str, str], set[str]] = defaultdict(set)
+        self._device_names_by_id: dict[str, str] = dict()
+        for device in data.get("device_list", []):
+            self._device_names_by_id[str(device.get("id"))] = device["name"]
+            self._indexObject(device, device["name"])
+        for l2vpn in data.get("l2vpn_list", []):
+            terminating_devices = set(
+                self._device_names_by_id[str(device_id)]
+                for device_id in self._terminatingDeviceIDs(l2vpn)
+                if str(device_id) in self._device_names_by_id
+            )
+            for device_name in terminating_devices:
+                self._indexObject(l2vpn, device_name)
+
+    def _indexObject(self, o, device_name: str):
+        if isinstance(o, dict):
+            if "__typename" in o and o.get("id") is not None:
+                self._index[(o["__typename"], str(o["id"]))].add(device_name)
+            if o.get("__typename") == "DeviceType" and o.get("name"):
+                self._index[("DeviceType:name", str(o["name"]))].add(device_name)
+            for v in o.values():
+                self._indexObject(v, device_name)
+        elif isinstance(o, list):
+            for e in o:
+                self._indexObject(e, device_name)
+
+    @classmethod
+    def _terminatingDeviceIDs(cls, o) -> list:
+        ids = []
+        if isinstance(o, dict):
+            if o.get("__typename") == "InterfaceType" and o.get("device"):
+                ids.append(o["device"].get("id"))
+            for v in o.values():
+                ids.extend(cls._terminatingDeviceIDs(v))
+        elif isinstance(o, list):
+            for e in o:
+                ids.extend(cls._terminatingDeviceIDs(e))
+        return ids
+
+    def _lookup(self, model: str | None, object_id) -> set[str]:
+        typename = self.MODEL_TO_TYPENAME.get(str(model))
+        if typename is None or object_id is None:
+            return set()
+        return self._index.get((typename, str(object_id)), set())
+
+    def affectedDevices(
+        self, model: str, object_id, object_data: list[dict | None]
+    ) -> set[str] | None:
+        # returns None when the impact of the change cannot be determined
+        if model in self.UNUSED_MODELS:
+            return set()
+        if model in self.UNRESOLVABLE_MODELS or (
+            model not in self.MODEL_TO_TYPENAME
+            and model not in self.REFERENCING_MODELS
+            and model.split(".")[0] not in self.DEVICE_SCOPED_PLUGINS
+        ):
+            return None
+
+        affected = set(self._lookup(model, object_id))
+        for snapshot in filter(None, object_data):
+            # references held by the object before and after the change,
+            # needed for creations and for objects we fetch without id
+            if model == "dcim.device" and snapshot.get("name"):
+                affected |= self._index.get(
+                    ("DeviceType:name", str(snapshot["name"])), set()
+                )
+            for device_id in [snapshot.get("device"), *(snapshot.get("devices") or [])]:
+                if isinstance(device_id, dict):
+                    device_id = device_id.get("id")
+                if str(device_id) in self._device_names_by_id:
+                    affected.add(self._device_names_by_id[str(device_id)])
+            affected |= self._lookup(
+                snapshot.get("assigned_object_type"),
+                snapshot.get("assigned_object_id"),
+            )
+            affected |= self._lookup("dcim.interface", snapshot.get("interface"))
+        return affected
+
+    def affectedDevicesByChange(self, change: dict) -> set[str] | None:
+        affected = self.affectedDevices(
+            change["changed_object_type"],
+            change.get("changed_object_id"),
+            [change.get("prechange_data"), change.get("postchange_data")],
+        )
+        if affected is None:
+            return None
+        return affected | self._lookup(
+            change.get("related_object_type"), change.get("related_object_id")
+        )
+
+    def affectedDevicesByWebhook(self, payload: dict) -> set[str] | None:
+        # payload of a Netbox webhook on an object change
+        model = self.WEBHOOK_MODELS.get(str(payload.get("model")))
+        if model is None:
+            return None
+        data = payload.get("data") or {}
+        snapshots = payload.get("snapshots") or {}
+        return self.affectedDevices(
+            model,
+            data.get("id"),
+            [data, snapshots.get("prechange"), snapshots.get("postchange")],
+        )
+
+
+class IncrementalState:
+    # what the last successful run left behind: the changelog watermark and
+    # the fetched data, so unchanged devices can be reused as they are.
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+
+    def load(self) -> dict | None:
+        try:
+            with open(self.path, "r") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, watermark: int, signature: str, data: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(
+                {"watermark": watermark, "signature": signature, "data": data},
+                tmp_file,
+            )
+        os.replace(tmp_path, self.path)
+
+
+class IncrementalFetchPlanner:
+    # decides, from Netbox's object change log, which devices need to be
+    # fetched again and which ones can be taken from the previous run
+    MAX_CHANGES = 5000
+
+    def __init__(self, client: NetboxAPIClient, changelog_path: str):
+        self.client = client
+        self.changelog_path = changelog_path
+
+    def _changelogPage(self, queries: dict) -> dict:
+        r = self.client.sessions.get(
+            urljoin(self.client.url, self.changelog_path) + "?" + urlencode(queries)
+        )
+        if r.status_code != 200:
+            raise Exception("Error querying api: " + r.text)
+        return r.json()
+
+    def latestChangeID(self) -> int:
+        results = self._changelogPage({"ordering": "-id", "limit": 1}).get("results")
+        return int(results[0]["id"]) if results else 0
+
+    def isTruncated(self, watermark: int) -> bool:
+        # the change we stopped at has been pruned since: we cannot know
+        # what happened in between.
+        if watermark == 0:
+            return True
+        return not self._changelogPage({"id": watermark, "limit": 1}).get("results")
+
+    def changedDevices(
+        self, previous_data: dict, watermark: int, new_watermark: int
+    ) -> set[str] | None:
+        resolver = ChangeImpactResolver(previous_data)
+        changed: set[str] = set()
+        if new_watermark == watermark:
+            return changed
+        first_page = self._changelogPage(
+            {"id__gt": watermark, "id__lte": new_watermark, "limit": 1}
+        )
+        if int(first_page.get("count", 0)) > self.MAX_CHANGES:
+            log.info("Too many changes since last run, doing a full fetch.")
+            return None
+        changes = self.client.query_rest(
+            self.changelog_path,
+            {"id__gt": watermark, "id__lte": new_watermark, "ordering": "id"},
+        )
+        for change in changes:
+            affected = resolver.affectedDevicesByChange(change)
+            if affected is None:
+                log.info(
+                    f"Cannot tell which devices depend on changed "
+                    f"{change['changed_object_type']}, doing a full fetch."
+                )
+                return None
+            changed |= affected
+        return changed
+
+    def plan(
+        self, state: dict | None, signature: str, device_list: list[str]
+    ) -> tuple[list[str], list[dict], int]:
+        # returns the devices to fetch, the device data to reuse and the
+        # watermark to store once this run succeeded
+        new_watermark = self.latestChangeID()
+        if state is None or state.get("signature") != signature:
+            log.info("No usable incremental state, doing a full fetch.")
+            return device_list, [], new_watermark
+        watermark = int(state.get("watermark", 0))
+        if self.isTruncated(watermark):
+            log.info("Change log was truncated since last run, doing a full fetch.")
+            return device_list, [], new_watermark
+        previous_data = state.get("data", {})
+        changed = self.changedDevices(previous_data, watermark, new_watermark)
+        if changed is None:
+            return device_list, [], new_watermark
+
+        # device names are matched case-insensitively, like the device query does
+        changed = {c.lower() for c in changed}
+        previous_devices = {
+            d["name"].lower(): d for d in previous_data.get("device_list", [])
+        }
+        to_fetch = [
+            d
+            for d in device_list
+            if d.lower() in changed or d.lower() not in previous_devices
+        ]
+        reused = [
+            previous_devices[d.lower()]
+            for d in device_list
+            if d not in to_fetch and d.lower() in previous_devices
+        ]
+        log.info(
+            f"Incremental fetch: {len(to_fetch)} device(s) changed, "
+            f"{len(reused)} reused from last run."
+        )
+        return to_fetch, reused, new_watermark
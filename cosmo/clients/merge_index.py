@@ -0,0 +1,34 @@
+from collections import defaultdict
+from typing import Any, Callable, Hashable, Iterable
+
+
+class ResultIndex:
+    # objects of a query result grouped by key. it is built once per result,
+    # so merges look objects up instead of scanning the result for each
+    # device or interface. with multi, key returns all the keys an object is
+    # grouped under (e.g. every device an IP pool is assigned to).
+    def __init__(
+        self,
+        objects: Iterable[dict],
+        key: Callable[[dict], Any],
+        multi: bool = False,
+    ):
+        self._groups: dict[Hashable, list[dict]] = defaultdict(list)
+        for o in objects:
+            keys = dict.fromkeys(key(o)) if multi else [key(o)]
+            for k in keys:
+                self._groups[k].append(o)
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def all(self, key: Hashable) -> list[dict]:
+        return list(self._groups.get(key, []))
+
+    def first(self, key: Hashable) -> dict | None:
+        group = self._groups.get(key)
+        return group[0] if group else None
+
+    def last(self, key: Hashable) -> dict | None:
+        group = self._groups.get(key)
+        return group[-1] if group else None
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Iterator
+
+from cosmo import log
+
+
+@dataclass
+class QueryMetrics:
+    # tasks are the fetch executor tasks run on behalf of a query, they wait
+    # queued_time for a worker and run for in_flight_time. requests are the
+    # HTTP requests actually sent to Netbox.
+    tasks: int = 0
+    queued_time: float = 0.0
+    in_flight_time: float = 0.0
+    requests: int = 0
+    latency: float = 0.0
+    max_latency: float = 0.0
+    response_bytes: int = 0
+    pages: int = 0
+    retries: int = 0
+    memory_cache_hits: int = 0
+    disk_cache_hits: int = 0
+
+    def add(self, **counters):
+        for name, value in counters.items():
+            if name == "max_latency":
+                self.max_latency = max(self.max_latency, value)
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+
+class FetchMetrics:
+    # fetch metrics of a run, per query class. whatever is fetched is
+    # attributed to the query scope (see query_scope()) it runs in.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries: dict[str, QueryMetrics] = dict()
+
+    def add(self, query_name: str, **counters):
+        with self._lock:
+            self._queries.setdefault(query_name, QueryMetrics()).add(**counters)
+
+    def toDict(self) -> dict:
+        with self._lock:
+            queries = {name: asdict(m) for name, m in sorted(self._queries.items())}
+        total = QueryMetrics()
+        for m in queries.values():
+            total.add(**m)
+        return {"total": asdict(total), "queries": queries}
+
+    def write(self, path: str | os.PathLike):
+        with open(path, "w") as report_file:
+            json.dump(self.toDict(), report_file, indent=4)
+        log.info(f"Fetch report written to {path}")
+
+    def logStatistics(self):
+        for name, m in self.toDict()["queries"].items():
+            log.debug(
+                f"{name}: {m['requests']} request(s), {m['pages']} page(s), "
+                f"{m['response_bytes']} bytes, {round(m['latency'], 2)} s latency, "
+                f"{m['memory_cache_hits'] + m['disk_cache_hits']} cache hit(s)"
+            )
+
+
+_current_scope: ContextVar[tuple[FetchMetrics, str] | None] = ContextVar(
+    "cosmo_fetch_metrics_scope", default=None
+)
+
+
+@contextmanager
+def query_scope(metrics: FetchMetrics | None, query_name: str) -> Iterator[None]:
+    # fetch executor tasks submitted in the scope carry it to their worker
+    if metrics is None:
+        yield
+        return
+    token = _current_scope.set((metrics, query_name))
+    try:
+        yield
+    finally:
+        _current_scope.reset(token)
+
+
+def record(**counters):
+    # adds counters to the metrics of the current query scope, if any
+    scope = _current_scope.get()
+    if scope is not None:
+        metrics, query_name = scope
+        metrics.add(query_name, **counters)
@@ -2,52 +2,147 @@ import re
 import time
 from urllib.parse import urljoin
 
-import requests
 from packaging.version import Version
 
 from cosmo import log
+from cosmo.clients.cache import DiskResponseCache, MemoryResponseCache
+from cosmo.clients.concurrency import AIMDConcurrencyController, TokenBucket
+from cosmo.clients.incremental import IncrementalState
+from cosmo.clients.netbox_client import NetboxAPIClient
+from cosmo.clients.netbox_session import NetboxSessionPool
 from cosmo.clients.netbox_v4 import NetboxV4Strategy
+from cosmo.clients.snapshot import RecordingSessionPool, ReplaySessionPool
 
 
 class NetboxClient:
-    def __init__(self, url, token, verify_certs=True):
+    def __init__(
+        self,
+        url,
+        token,
+        verify_certs=True,
+        pool_size=NetboxSessionPool.DEFAULT_POOL_SIZE,
+        keep_alive=True,
+        timeout=None,
+        concurrency=None,
+        rate_limit=None,
+        fetch_executor=None,
+        device_batch=None,
+        cache_dir=None,
+        cache_ttl=DiskResponseCache.DEFAULT_TTL,
+        cache_max_bytes=DiskResponseCache.DEFAULT_MAX_BYTES,
+        incremental_state=None,
+        page_sizes=None,
+        max_inflight_pages=NetboxAPIClient.DEFAULT_MAX_INFLIGHT_PAGES,
+        memory_cache_max_bytes=MemoryResponseCache.DEFAULT_MAX_BYTES,
+        record=None,
+        replay=None,
+        fetch_report=None,
+    ):
         self.url = url
         self.token = token
         self.verify_certs = verify_certs
+        self.fetch_executor = fetch_executor
+        self.page_sizes = page_sizes
+        self.max_inflight_pages = max_inflight_pages
+        self.memory_cache_max_bytes = memory_cache_max_bytes
+        self.record = record
+        self.fetch_report = fetch_report
+        if record or replay:
+            # snapshots have to hold every exchange of a complete fetch, and
+            # batches must not depend on the latencies seen while recording
+            cache_dir, incremental_state = None, None
+            device_batch = {**(device_batch or {}), "auto_tune": False}
+        self.device_batch = device_batch
+        self.incremental_state = (
+            IncrementalState(incremental_state) if incremental_state else None
+        )
+        self.persistent_cache = (
+            DiskResponseCache(cache_dir, ttl=cache_ttl, max_bytes=cache_max_bytes)
+            if cache_dir
+            else None
+        )
+        session_args = dict(
+            verify_certs=verify_certs,
+            pool_size=pool_size,
+            keep_alive=keep_alive,
+            timeout=timeout,
+            concurrency=AIMDConcurrencyController.fromConfig(concurrency),
+            rate_limit=(
+                TokenBucket(rate_limit["rate"], rate_limit.get("burst", 1))
+                if rate_limit
+                else None
+            ),
+        )
+        self.sessions: NetboxSessionPool
+        if replay:
+            self.sessions = ReplaySessionPool(replay, **session_args)
+            self.url = url if url else self.sessions.url
+        elif record:
+            self.sessions = RecordingSessionPool(url, token, **session_args)
+        else:
+            self.sessions = NetboxSessionPool(token, **session_args)
+        url = self.url
 
         version, feature_flags = self.query_version()
         base_version_match = re.search(r"[\d.]+", version)
         self.base_version = Version(base_version_match.group(0))
+        # the change log moved from extras to core in Netbox 4.1
+        self.changelog_path = (
+            "api/core/object-changes/"
+            if self.base_version >= Version("4.1.0")
+            else "api/extras/object-changes/"
+        )
 
         if self.base_version > Version("4.3.0"):
             log.info("Using version 4.3.x strategy...")
             self.child_client = NetboxV4Strategy(
                 url,
-                token,
+                self.sessions,
                 multiple_mac_addresses=True,
                 netbox_43_query_syntax=True,
                 feature_flags=feature_flags,
-                verify_certs=self.verify_certs,
+                fetch_executor=self.fetch_executor,
+                device_batch=self.device_batch,
+                persistent_cache=self.persistent_cache,
+                incremental_state=self.incremental_state,
+                changelog_path=self.changelog_path,
+                page_sizes=self.page_sizes,
+                max_inflight_pages=self.max_inflight_pages,
+                memory_cache_max_bytes=self.memory_cache_max_bytes,
             )
         elif self.base_version > Version("4.2.0"):
             log.info("Using version 4.2.x strategy...")
             self.child_client = NetboxV4Strategy(
                 url,
-                token,
+                self.sessions,
                 multiple_mac_addresses=True,
                 netbox_43_query_syntax=False,
                 feature_flags=feature_flags,
-                verify_certs=self.verify_certs,
+                fetch_executor=self.fetch_executor,
+                device_batch=self.device_batch,
+                persistent_cache=self.persistent_cache,
+                incremental_state=self.incremental_state,
+                changelog_path=self.changelog_path,
+                page_sizes=self.page_sizes,
+                max_inflight_pages=self.max_inflight_pages,
+                memory_cache_max_bytes=self.memory_cache_max_bytes,
             )
         elif self.base_version > Version("4.0.0"):
             log.info("Using version 4.0.x strategy...")
             self.child_client = NetboxV4Strategy(
                 url,
-                token,
+                self.sessions,
                 multiple_mac_addresses=False,
                 netbox_43_query_syntax=False,
                 feature_flags=feature_flags,
-                verify_certs=self.verify_certs,
+                fetch_executor=self.fetch_executor,
+                device_batch=self.device_batch,
+                persistent_cache=self.persistent_cache,
+                incremental_state=self.incremental_state,
+                changelog_path=self.changelog_path,
+                page_sizes=self.page_sizes,
+                max_inflight_pages=self.max_inflight_pages,
+                memory_cache_max_bytes=self.memory_cache_max_bytes,
             )
         else:
             raise Exception("Unknown Version")
@@ -56,15 +151,7 @@ class NetboxClient:
             log.info(f"Netbox feature {f}: {e}")
 
     def query_version(self):
-        r = requests.get(
-            urljoin(self.url, "/api/status/"),
-            headers={
-                "Authorization": f"Token {self.token}",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-            },
-            verify=self.verify_certs,
-        )
+        r = self.sessions.get(urljoin(self.url, "/api/status/"))
         if r.status_code != 200:
             raise Exception("Error querying api: " + r.text)
 
@@ -79,11 +166,33 @@ class NetboxClient:
 
         return version, feature_flags
 
+    def _logFetchStatistics(self, fetch_time: float):
+        merge_time = self.child_client.merge_time
+        log.info(
+            f"Data fetching took {round(fetch_time, 2)} s, "
+            f"{round(merge_time, 2)} s of it merging..."
+        )
+        self.sessions.logReuseStatistics()
+        if isinstance(self.sessions, RecordingSessionPool):
+            self.sessions.save(self.record)
+        if self.fetch_report is not None:
+            self.child_client.metrics.write(self.fetch_report)
+
     def get_data(self, device_config):
         start_time = time.perf_counter()
         data = self.child_client.get_data(device_config)
-        end_time = time.perf_counter()
-        diff_time = end_time - start_time
-        log.info(f"Data fetching took {round(diff_time, 2)} s...")
-
+        self._logFetchStatistics(time.perf_counter() - start_time)
         return data
+
+    def iter_data(self, device_config):
+        # yields (device, shared data) as soon as a device is complete, see
+        # NetboxV4Strategy.iter_data. time spent by the consumer between
+        # two devices is not fetching time.
+        fetch_time = 0.0
+        start_time = time.perf_counter()
+        for device, shared in self.child_client.iter_data(device_config):
+            fetch_time += time.perf_counter() - start_time
+            yield device, shared
+            start_time = time.perf_counter()
+        fetch_time += time.perf_counter() - start_time
+        self._logFetchStatistics(fetch_time)
@@ -1,34 +1,103 @@
+import hashlib
 import time
+from collections import deque
 from urllib.parse import urlencode, urljoin
-from multiprocessing.managers import DictProxy
-
-import requests
 
 from cosmo import log
+from cosmo.clients.cache import (
+    CachedResponse,
+    DiskResponseCache,
+    MemoryResponseCache,
+    normalize_query,
+    normalize_url,
+)
+from cosmo.clients.metrics import FetchMetrics, record
+from cosmo.clients.netbox_session import NetboxSessionPool
 
 
 class NetboxAPIClient:
+    DEFAULT_MAX_INFLIGHT_PAGES = 4
+
     def __init__(
-        self, url, token, interprocess_shared_cache: DictProxy, verify_certs=True
+        self,
+        url,
+        sessions: NetboxSessionPool,
+        memory_cache: MemoryResponseCache,
+        persistent_cache: DiskResponseCache | None = None,
+        page_sizes: dict[str, int] | None = None,
+        max_inflight_pages: int = DEFAULT_MAX_INFLIGHT_PAGES,
+        metrics: FetchMetrics | None = None,
     ):
         self.url = url
-        self.token = token
-        self.cache = interprocess_shared_cache
-        self.verify_certs = verify_certs
+        # queries attribute what they fetch to their class, see query_scope()
+        self.metrics = metrics
+        self.sessions = sessions
+        self.cache = memory_cache
+        self.persistent_cache = persistent_cache
+        self.page_sizes = {
+            path.strip("/"): size for path, size in (page_sizes or {}).items()
+        }
+        self.max_inflight_pages = max(max_inflight_pages, 1)
+
+    def getCached(self, key: str) -> bytes | None:
+        if self.persistent_cache is None:
+            return None
+        cached = self.persistent_cache.get(key)
+        if cached is not None:
+            record(disk_cache_hits=1)
+        return cached
+
+    def putCached(self, key: str, body: bytes):
+        if self.persistent_cache is not None:
+            self.persistent_cache.put(key, body)
+
+    def fingerprint(self, paths: list[str], pool) -> str | None:
+        # summarizes the state of the given collections by their object count
+        # (catches deletions) and latest last_updated (catches everything else)
+        def collection_state(path):
+            r = self.sessions.get(
+                urljoin(self.url, path)
+                + "?"
+                + urlencode(
+                    {"limit": 1, "ordering": "-last_updated", "fields": "last_updated"}
+                )
+            )
+            if r.status_code == 404:
+                # not there in this Netbox version (e.g. virtual circuits)
+                return [path, None, None]
+            if r.status_code != 200:
+                return None
+            data = r.json()
+            results = data.get("results") or [{}]
+            return [path, data.get("count"), results[0].get("last_updated")]
+
+        promises = [pool.apply_async(collection_state, args=(p,)) for p in paths]
+        states = [p.get() for p in promises]
+        if any(state is None for state in states):
+            log.warn("Cannot revalidate the response cache, it will be bypassed.", None)
+            return None
+        return hashlib.sha256(str(states).encode()).hexdigest()
 
     def query(self, query, query_name=None):
+        json, _, _ = self.timed_query(query, query_name)
+        return json
+
+    def timed_query(
+        self, query, query_name=None, use_cache=True
+    ) -> tuple[dict, int, float]:
+        # returns the decoded response, its size in bytes and the time it took
+
+        cache_key = f"graphql:{normalize_query(query)}"
+        if use_cache:
+            cached = self.getCached(cache_key)
+            if cached is not None:
+                return CachedResponse(cached).json(), len(cached), 0.0
 
         start_time = time.perf_counter()
 
-        r = requests.post(
+        r = self.sessions.post(
             urljoin(self.url, "/graphql/"),
             json={"query": query},
-            headers={
-                "Authorization": f"Token {self.token}",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-            },
-            verify=self.verify_certs,
         )
         if r.status_code != 200:
             raise Exception("Error querying api: " + r.text)
@@ -38,38 +107,97 @@ class NetboxAPIClient:
         if "errors" in json:
             for e in json["errors"]:
                 print(e)
+        elif use_cache:
+            self.putCached(cache_key, r.content)
 
         end_time = time.perf_counter()
         diff_time = end_time - start_time
         log.debug(f"Fetching {query_name} took {round(diff_time, 2)} s...")
 
-        return json
+        return json, len(r.content), diff_time
+
+    def _cached_get(self, url):
+        cache_key = f"rest:{normalize_url(url)}"
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            record(memory_cache_hits=1)
+            return CachedResponse(cached)
+
+        cached = self.getCached(cache_key)
+        if cached is not None:
+            self.cache.put(cache_key, cached)
+            return CachedResponse(cached)
 
-    def _cached_get(self, url, headers):
-        if url not in self.cache:
-            self.cache[url] = requests.get(
-                url, headers=headers, verify=self.verify_certs
+        r = self.sessions.get(url)
+        if r.status_code == 200:
+            self.cache.put(cache_key, r.content)
+            self.putCached(cache_key, r.content)
+        return r
+
+    def pageSize(self, path) -> int | None:
+        return self.page_sizes.get(path.strip("/"))
+
+    def _get_page(self, base_url, queries) -> dict:
+        record(pages=1)
+        r = self._cached_get(base_url + "?" + urlencode(queries, doseq=True))
+
+        if r.status_code != 200:
+            raise Exception("Error querying api: " + r.text)
+
+        return r.json()
+
+    def _get_pages(self, base_url, queries, limit, offsets, pool) -> list[dict]:
+        # pages are requested concurrently, but at most max_inflight_pages at
+        # a time, and are returned in offset order
+        def get_page(offset):
+            return self._get_page(
+                base_url, {**queries, "limit": limit, "offset": offset}
             )
-        return self.cache.get(url)
 
-    def query_rest(self, path, queries):
-        q = urlencode(queries, doseq=True)
-        base_url = urljoin(self.url, path) + f"?{q}"
-        url = base_url
+        if pool is None:
+            return [get_page(o) for o in offsets]
+
+        pages = list()
+        in_flight: deque = deque()
+        for o in offsets:
+            if len(in_flight) >= self.max_inflight_pages:
+                pages.append(in_flight.popleft().get())
+            in_flight.append(pool.apply_async(get_page, args=(o,)))
+        while in_flight:
+            pages.append(in_flight.popleft().get())
+        return pages
+
+    def query_rest(self, path, queries, pool=None):
+        base_url = urljoin(self.url, path)
+        queries = dict(queries)
+        page_size = self.pageSize(path)
+        if page_size is not None and "limit" not in queries:
+            queries["limit"] = page_size
 
         start_time = time.perf_counter()
 
-        return_array = list()
+        data = self._get_page(base_url, queries)
+        if type(data.get("results")) != list:
+            return data
 
-        while url is not None:
-            r = self._cached_get(
-                url,
-                headers={
-                    "Authorization": f"Token {self.token}",
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                },
+        return_array = list(data.get("results"))
+        url = data.get("next")
+
+        # the first page tells how many objects there are and how many Netbox
+        # puts on a page, so the other pages can be requested all at once.
+        limit = len(return_array)
+        if url is not None and data.get("count") is not None and limit > 0:
+            pages = self._get_pages(
+                base_url, queries, limit, range(limit, data["count"], limit), pool
             )
+            for page in pages:
+                return_array.extend(page.get("results"))
+            url = pages[-1].get("next") if pages else None
+
+        # objects created while paging (or a Netbox that does not count)
+        while url is not None:
+            record(pages=1)
+            r = self._cached_get(url)
 
             if r.status_code != 200:
                 raise Exception("Error querying api: " + r.text)
@@ -77,10 +205,7 @@ class NetboxAPIClient:
             data = r.json()
 
             url = data.get("next")
-            if type(data.get("results")) == list:
-                return_array.extend(data.get("results"))
-            else:
-                return data
+            return_array.extend(data.get("results"))
 
         end_time = time.perf_counter()
         diff_time = end_time - start_time
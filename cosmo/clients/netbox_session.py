@@ -0,0 +1,165 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cosmo import log
+from cosmo.clients.concurrency import AIMDConcurrencyController, TokenBucket
+from cosmo.clients.metrics import record
+
+
+class NetboxSessionPool:
+    # one keep-alive requests.Session per thread sending requests, so that
+    # the TCP+TLS handshake is paid once per connection instead of once per
+    # request. with the thread and asyncio fetch executors these are their
+    # worker threads, with the inline one the calling thread. executors live
+    # for a single fetch, sessions of their finished threads are closed once
+    # the next fetch opens new ones (or by close()).
+    DEFAULT_POOL_SIZE = 16
+    # responses telling us Netbox (or its proxy) is overloaded, worth a retry
+    RETRY_STATUS_CODES = [429, 502, 503, 504]
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+
+    def __init__(
+        self,
+        token,
+        verify_certs=True,
+        pool_size=DEFAULT_POOL_SIZE,
+        keep_alive=True,
+        timeout: float | None = None,
+        concurrency: AIMDConcurrencyController | None = None,
+        rate_limit: TokenBucket | None = None,
+    ):
+        self.token = token
+        self.verify_certs = verify_certs
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.concurrency = concurrency if concurrency else AIMDConcurrencyController()
+        self.rate_limit = rate_limit
+        self.retries = 0
+        self._local = threading.local()
+        self._sessions_lock = threading.Lock()
+        self._sessions: list[requests.Session] = list()
+        self._session_threads: list[threading.Thread] = list()
+
+    def getHeaders(self) -> dict[str, str]:
+        return {
+            "Authorization": f"Token {self.token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Connection": "keep-alive" if self.keep_alive else "close",
+        }
+
+    def _newSession(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.getHeaders())
+        session.verify = self.verify_certs
+        return session
+
+    def getSession(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._newSession()
+            self._local.session = session
+            with self._sessions_lock:
+                self._closeFinishedSessions()
+                self._sessions.append(session)
+                self._session_threads.append(threading.current_thread())
+        return session
+
+    def _closeFinishedSessions(self):
+        # called with _sessions_lock held
+        alive = []
+        for session, thread in zip(self._sessions, self._session_threads):
+            if thread.is_alive():
+                alive.append((session, thread))
+            else:
+                session.close()
+        self._sessions = [session for session, _ in alive]
+        self._session_threads = [thread for _, thread in alive]
+
+    def _retryDelay(self, attempt: int, r) -> float:
+        retry_after = getattr(r, "headers", {}).get("Retry-After") if r else None
+        if retry_after is not None and str(retry_after).isdigit():
+            return float(retry_after)
+        return self.RETRY_BACKOFF * 2**attempt
+
+    def _request(self, method: str, url, **kwargs):
+        for attempt in range(self.MAX_RETRIES + 1):
+            if self.rate_limit is not None:
+                self.rate_limit.acquire()
+            started = self.concurrency.acquire()
+            request_start = time.perf_counter()
+            r = None
+            overloaded = True
+            try:
+                r = getattr(self.getSession(), method)(
+                    url, verify=self.verify_certs, timeout=self.timeout, **kwargs
+                )
+                overloaded = r.status_code in self.RETRY_STATUS_CODES
+            except requests.Timeout:
+                if attempt == self.MAX_RETRIES:
+                    raise
+            finally:
+                self.concurrency.release(started, overloaded)
+                latency = time.perf_counter() - request_start
+                record(
+                    requests=1,
+                    latency=latency,
+                    max_latency=latency,
+                    response_bytes=len(r.content) if r is not None else 0,
+                )
+            if not overloaded or attempt == self.MAX_RETRIES:
+                return r
+            with self._sessions_lock:
+                self.retries += 1
+            record(retries=1)
+            time.sleep(self._retryDelay(attempt, r))
+
+    def get(self, url, **kwargs):
+        return self._request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._request("post", url, **kwargs)
+
+    def getReuseStatistics(self) -> tuple[int, int]:
+        # returns (number of requests, number of opened connections)
+        n_requests, n_connections = 0, 0
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            for adapter in session.adapters.values():
+                pool_manager = getattr(adapter, "poolmanager", None)
+                if pool_manager is None:
+                    continue
+                for key in pool_manager.pools.keys():
+                    pool = pool_manager.pools[key]
+                    n_requests += pool.num_requests
+                    n_connections += pool.num_connections
+        return n_requests, n_connections
+
+    def logReuseStatistics(self):
+        n_requests, n_connections = self.getReuseStatistics()
+        reused = max(n_requests - n_connections, 0)
+        log.debug(
+            f"HTTP sessions: {len(self._sessions)} session(s), {n_requests} request(s) "
+            f"over {n_connections} connection(s), {reused} reused, "
+            f"{self.retries} retried"
+        )
+        self.concurrency.logStatistics()
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+            self._session_threads.clear()
+        self._local = threading.local()
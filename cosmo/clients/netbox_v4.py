@@ -1,30 +1,67 @@
+import hashlib
 import json
+import queue
+import time
 from abc import ABC, abstractmethod
 from builtins import map
-from multiprocessing import Manager
+from collections import defaultdict
+from functools import partial
+from itertools import chain
 from os import PathLike
 from pathlib import Path
-
-from cosmo.clients import get_client_mp_context
+from typing import Any, Callable, Iterator
+
+from cosmo import log
+from cosmo.clients.batching import AdaptiveBatchSizer, chunked
+from cosmo.clients.cache import (
+    DiskResponseCache,
+    MemoryResponseCache,
+    normalize_query,
+)
+from cosmo.clients.fetch_executor import FetchExecutorFactory
+from cosmo.clients.incremental import IncrementalFetchPlanner, IncrementalState
 from cosmo.clients.netbox_client import NetboxAPIClient
-from cosmo.common import FileTemplate, clip
+from cosmo.clients.merge_index import ResultIndex
+from cosmo.clients.metrics import FetchMetrics, query_scope
+from cosmo.clients.netbox_session import NetboxSessionPool
+from cosmo.clients.query_builder import (
+    DEVICE_FIELDS,
+    ROUTER,
+    SWITCH,
+    SelectionSetBuilder,
+)
+from cosmo.common import FileTemplate
 from cosmo.features import features
 
 
+def device_ids(devices: list[dict]) -> list[str]:
+    # device scoped data is looked up by the ids of the fetched devices, the
+    # configured names may differ in case from the ones in Netbox
+    return sorted(set(str(d["id"]) for d in devices), key=int)
+
+
 class ParallelQuery(ABC):
 
     def __init__(self, client: NetboxAPIClient, **kwargs):
         self.client = client
 
         self.data_promise = None
+        self.merge_time = 0.0
         self.kwargs = kwargs
+        self._indexed_result = None
+        self._indexed = None
 
     @staticmethod
     def file_template(relpath: str | PathLike):
         return FileTemplate(Path(__file__).parent.joinpath(Path(relpath)))
 
     def fetch_data(self, pool):
-        return pool.apply_async(self._fetch_data, args=(self.kwargs, pool))
+        # queries depending on another query's data wait on its data_promise
+        with query_scope(self.client.metrics, type(self).__name__):
+            self.data_promise = pool.apply_async(
+                self._fetch_data, args=(self.kwargs, pool)
+            )
+        return self.data_promise
 
     @abstractmethod
     def _fetch_data(self, kwargs, pool):
@@ -32,7 +69,19 @@ class ParallelQuery(ABC):
 
     def merge_into(self, data_promise, data: dict):
         query_data = data_promise.get()
-        return self._merge_into(data, query_data)
+        # time spent merging, apart from waiting for the data
+        start_time = time.perf_counter()
+        # results are merged into every batch of devices, they are only
+        # indexed once
+        if self._indexed_result is not query_data:
+            self._indexed = self._index(query_data)
+            self._indexed_result = query_data
+        data = self._merge_into(data, self._indexed)
+        self.merge_time += time.perf_counter() - start_time
+        return data
+
+    def _index(self, query_result):
+        return query_result
 
     @abstractmethod
     def _merge_into(self, data: dict, query_result):
@@ -40,43 +89,59 @@ class ParallelQuery(ABC):
 
 
 class ConnectedDevicesDataQuery(ParallelQuery):
+    # bgp_cpe tagged interfaces of a batch of fetched devices, looked up in
+    # chunks of devices
+    BATCH_SIZE = 50
+
     def __init__(self, *args, netbox_43_query_syntax=False, **kwargs):
         super().__init__(*args, **kwargs)
         self.netbox_43_query_syntax = netbox_43_query_syntax
 
-    def _fetch_data(self, kwargs, pool):
+    def _fetch_batch(self, devices: list[str]) -> list[dict]:
         tag_filter = (
             'tags: { name: { exact: "bgp_cpe" }}'
             if self.netbox_43_query_syntax
             else 'tag: "bgp_cpe"'
         )
+        device_filter = (
+            f"device: {{ id: {{ in_list: {json.dumps(devices)} }} }}"
+            if self.netbox_43_query_syntax
+            else f"device_id: {json.dumps(devices)}"
+        )
         query_template = self.file_template("queries/connected_devices.graphql")
 
         return self.client.query(
-            query_template.substitute(tag_filter=tag_filter), "connected_devices_query"
-        )["data"]
+            query_template.substitute(
+                tag_filter=tag_filter, device_filter=device_filter
+            ),
+            f"connected_devices_query_{devices[0]}+{len(devices) - 1}",
+        )["data"]["interface_list"]
 
-    def _merge_into(self, data: dict, query_data):
+    def _fetch_data(self, kwargs, pool):
+        batch_promises = [
+            pool.apply_async(self._fetch_batch, args=(batch,))
+            for batch in chunked(
+                device_ids(kwargs.get("device_list", [])), self.BATCH_SIZE
+            )
+        ]
+        return {
+            "interface_list": list(chain.from_iterable(p.get() for p in batch_promises))
+        }
 
+    def _index(self, query_result):
+        return ResultIndex(query_result["interface_list"], key=lambda i: str(i["id"]))
+
+    def _merge_into(self, data: dict, cd_interfaces: ResultIndex):
         for d in data["device_list"]:
+            device_interfaces = ResultIndex(d["interfaces"], key=lambda i: str(i["id"]))
             for interface in d["interfaces"]:
-                cd_interface = next(
-                    filter(
-                        lambda i: i["id"] == interface["id"],
-                        query_data["interface_list"],
-                    ),
-                    None,
-                )
+                cd_interface = cd_interfaces.first(str(interface["id"]))
 
                 if not cd_interface:
                     continue
 
-                parent_interface = next(
-                    filter(
-                        lambda i: i["id"] == cd_interface["parent"]["id"],
-                        d["interfaces"],
-                    ),
-                    None,
+                parent_interface = device_interfaces.first(
+                    str(cd_interface["parent"]["id"])
                 )
 
                 if not parent_interface:
@@ -90,53 +155,198 @@ class ConnectedDevicesDataQuery(ParallelQuery):
 
 
 class LoopbackDataQuery(ParallelQuery):
-    def _fetch_data(self, kwargs, pool):
-        # Note: This does not use the device list, because we can have other participating devices
-        # which are not in the same repository and thus are not appearing in device list.
+    # loopbacks are needed for the configured devices and for the remote ends
+    # of their L2VPNs, which may not be configured in this repository. so the
+    # L2VPN data is awaited first, then loopbacks of these devices are fetched
+    # in batches.
+    BATCH_SIZE = 50
 
+    def __init__(
+        self,
+        *args,
+        l2vpn_query: "L2VPNDataQuery",
+        netbox_43_query_syntax=False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.l2vpn_query = l2vpn_query
+        self.netbox_43_query_syntax = netbox_43_query_syntax
+
+    @staticmethod
+    def _terminatingDevices(l2vpn: dict) -> dict[str, str]:
+        # names of the terminating devices by their id
+        devices: dict[str, str] = dict()
+        for termination in l2vpn.get("terminations") or []:
+            o = termination.get("assigned_object") or {}
+            interfaces = (
+                (o.get("interfaces_as_tagged") or [])
+                + (o.get("interfaces_as_untagged") or [])
+                if o.get("__typename") == "VLANType"
+                else [o]
+            )
+            for i in interfaces:
+                if i.get("device"):
+                    devices[str(i["device"]["id"])] = i["device"]["name"]
+        return devices
+
+    @classmethod
+    def referencedDevices(cls, devices: list[dict], l2vpn_data: dict) -> list[str]:
+        # devices are matched by id and named as in Netbox, the configured
+        # names may differ in case
+        device_names = {str(d["id"]): d["name"] for d in devices}
+        referenced = set(device_names.values())
+        for l2vpn in l2vpn_data.get("l2vpn_list", []):
+            terminating_devices = cls._terminatingDevices(l2vpn)
+            if terminating_devices.keys() & device_names.keys():
+                referenced |= set(terminating_devices.values())
+        return sorted(referenced)
+
+    def _fetch_batch(self, devices: list[str]) -> list[dict]:
+        device_filter = (
+            f"device: {{ name: {{ in_list: {json.dumps(devices)} }} }}"
+            if self.netbox_43_query_syntax
+            else f"device: {json.dumps(devices)}"
+        )
         query_template = self.file_template("queries/loopback.graphql")
 
-        return self.client.query(query_template.substitute(), "loopback_query")["data"]
+        return self.client.query(
+            query_template.substitute(device_filter=device_filter),
+            f"loopback_query_{devices[0]}+{len(devices) - 1}",
+        )["data"]["interface_list"]
+
+    def _fetch_data(self, kwargs, pool):
+        l2vpn_data = self.l2vpn_query.data_promise.get()
+        devices = self.referencedDevices(self.l2vpn_query.fetchedDevices(), l2vpn_data)
+        batch_promises = [
+            pool.apply_async(self._fetch_batch, args=(batch,))
+            for batch in chunked(devices, self.BATCH_SIZE)
+        ]
+        return {
+            "interface_list": list(chain.from_iterable(p.get() for p in batch_promises))
+        }
+
+    @staticmethod
+    def _loopbackOf(interface: dict) -> dict | None:
+        child_interface = next(
+            filter(lambda i: i["vrf"] is None, interface["child_interfaces"]), None
+        )
+        if not child_interface:
+            return None
+        device_name = interface["device"]["name"]
+
+        l_ipv4 = next(
+            filter(
+                lambda l: l["family"]["value"] == 4, child_interface["ip_addresses"]
+            ),
+            None,
+        )
+        l_ipv6 = next(
+            filter(
+                lambda l: l["family"]["value"] == 6, child_interface["ip_addresses"]
+            ),
+            None,
+        )
+        return {
+            "ipv4": l_ipv4["address"] if l_ipv4 else None,
+            "ipv6": l_ipv6["address"] if l_ipv6 else None,
+            "__typename": "CosmoLoopbackType",
+            "device": device_name,
+        }
 
     def _merge_into(self, data: dict, query_data):
 
         loopbacks: dict[str, dict] = dict()
 
         for interface in query_data["interface_list"]:
-            child_interface = next(
-                filter(lambda i: i["vrf"] is None, interface["child_interfaces"]), None
-            )
-            if not child_interface:
-                continue
-            device_name = interface["device"]["name"]
-
-            l_ipv4 = next(
-                filter(
-                    lambda l: l["family"]["value"] == 4, child_interface["ip_addresses"]
-                ),
-                None,
-            )
-            l_ipv6 = next(
-                filter(
-                    lambda l: l["family"]["value"] == 6, child_interface["ip_addresses"]
-                ),
-                None,
-            )
-            loopbacks[device_name] = {
-                "ipv4": l_ipv4["address"] if l_ipv4 else None,
-                "ipv6": l_ipv6["address"] if l_ipv6 else None,
-                "__typename": "CosmoLoopbackType",
-                "device": device_name,
-            }
+            loopback = self._loopbackOf(interface)
+            if loopback:
+                loopbacks[loopback["device"]] = loopback
 
         return {**data, "loopbacks": loopbacks}
 
 
 class L2VPNDataQuery(ParallelQuery):
-    def _fetch_data(self, kwargs, pool):
+    # only L2VPNs terminating on devices of this run are fetched. their ids
+    # are looked up on the termination side first: terminations on interfaces
+    # of the devices, and on VLANs configured on these interfaces (known once
+    # the device data is there).
+    BATCH_SIZE = 100
+    TERMINATIONS_PATH = "api/vpn/l2vpn-terminations/"
+
+    def __init__(
+        self,
+        *args,
+        device_queries: list["DeviceDataQuery"] | None = None,
+        reused_devices: list[dict] | None = None,
+        netbox_43_query_syntax=False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.device_queries = device_queries if device_queries else []
+        self.reused_devices = reused_devices if reused_devices else []
+        self.netbox_43_query_syntax = netbox_43_query_syntax
+
+    @staticmethod
+    def _vlanIDs(devices: list[dict]) -> list[str]:
+        vlan_ids = set()
+        for d in devices:
+            for i in d.get("interfaces", []):
+                for vlan in [i.get("untagged_vlan")] + (i.get("tagged_vlans") or []):
+                    if vlan:
+                        vlan_ids.add(str(vlan["id"]))
+        return sorted(vlan_ids)
+
+    def _terminatedL2VPNIDs(
+        self, device_ids: list[str], vlan_ids: list[str], pool
+    ) -> list[str]:
+        # empty filters would match every termination, so they are left out
+        filters = [{"device_id": b} for b in chunked(device_ids, self.BATCH_SIZE)]
+        filters += [{"vlan_id": b} for b in chunked(vlan_ids, self.BATCH_SIZE)]
+        termination_promises = [
+            pool.apply_async(
+                self.client.query_rest, args=(self.TERMINATIONS_PATH, f, pool)
+            )
+            for f in filters
+        ]
+        return sorted(
+            set(
+                str(t["l2vpn"]["id"])
+                for t in chain.from_iterable(p.get() for p in termination_promises)
+            ),
+            key=int,
+        )
+
+    def _fetch_batch(self, l2vpn_ids: list[str]) -> list[dict]:
+        id_filter = (
+            f"id: {{ in_list: {json.dumps(l2vpn_ids)} }}"
+            if self.netbox_43_query_syntax
+            else f"id: {json.dumps(l2vpn_ids)}"
+        )
         query_template = self.file_template("queries/l2vpn.graphql")
 
-        return self.client.query(query_template.substitute(), "l2vpn_query")["data"]
+        return self.client.query(
+            query_template.substitute(id_filter=id_filter),
+            f"l2vpn_query_{l2vpn_ids[0]}+{len(l2vpn_ids) - 1}",
+        )["data"]["l2vpn_list"]
+
+    def fetchedDevices(self):
+        devices = list(self.reused_devices)
+        for q in self.device_queries:
+            devices.extend(q.data_promise.get()["device_list"])
+        return devices
+
+    def _fetch_data(self, kwargs, pool):
+        devices = self.fetchedDevices()
+        l2vpn_ids = self._terminatedL2VPNIDs(
+            device_ids(devices), self._vlanIDs(devices), pool
+        )
+        batch_promises = [
+            pool.apply_async(self._fetch_batch, args=(batch,))
+            for batch in chunked(l2vpn_ids, self.BATCH_SIZE)
+        ]
+        return {
+            "l2vpn_list": list(chain.from_iterable(p.get() for p in batch_promises))
+        }
 
     def _merge_into(self, data: dict, query_data):
         return {
@@ -149,16 +359,18 @@ class StaticRouteQuery(ParallelQuery):
 
     def _fetch_data(self, kwargs, pool):
         device_list = kwargs.get("device_list")
+        if not device_list:
+            return []  # an empty device filter would match every route
         return self.client.query_rest(
-            "api/plugins/routing/staticroutes/", {"device": device_list}
+            "api/plugins/routing/staticroutes/", {"device": device_list}, pool
         )
 
-    def _merge_into(self, data: dict, query_data):
+    def _index(self, query_result):
+        return ResultIndex(query_result, key=lambda sr: str(sr["device"]["id"]))
+
+    def _merge_into(self, data: dict, static_routes: ResultIndex):
         for d in data["device_list"]:
-            device_static_routes = list(
-                filter(lambda sr: str(sr["device"]["id"]) == d["id"], query_data)
-            )
-            d["staticroute_set"] = device_static_routes
+            d["staticroute_set"] = static_routes.all(str(d["id"]))
             for e in d["staticroute_set"]:
                 e["__typename"] = "CosmoStaticRouteType"
 
@@ -181,19 +393,24 @@ class IPPoolDataQuery(ParallelQuery):
     def _fetch_data(self, kwargs, pool):
         # Filters for ippools are fucked.
         # Also, pagination is broken, so we just raise the limit and hope, it works.
-        return self.client.query_rest("api/plugins/ip-pools/ippools/", {"limit": 1000})
+        return self.client.query_rest(
+            "api/plugins/ip-pools/ippools/", {"limit": 1000}, pool
+        )
 
-    def _merge_into(self, data: dict, query_data):
+    def _index(self, query_result):
+        return ResultIndex(
+            query_result,
+            key=lambda pool: [str(pd["id"]) for pd in pool["devices"]],
+            multi=True,
+        )
 
+    def _merge_into(self, data: dict, pools: ResultIndex):
         for d in data["device_list"]:
             if "pool_set" not in d:
                 d["pool_set"] = []
 
-            for pool in query_data:
-                if next(
-                    filter(lambda pd: str(pd["id"]) == d["id"], pool["devices"]), None
-                ):
-                    d["pool_set"].append({**pool, "__typename": "CosmoIPPoolType"})
+            for pool in pools.all(str(d["id"])):
+                d["pool_set"].append({**pool, "__typename": "CosmoIPPoolType"})
 
         return data
 
@@ -209,26 +426,34 @@ class IPPoolDataDummyQuery(ParallelQuery):
 
 
 class TobagoLineMembersDataQuery(ParallelQuery):
+    # find-by-object only takes a single object, so the whole collection is
+    # fetched (its pages concurrently) instead of once per device. members
+    # of other devices are left out by the merge.
+    LINE_MEMBERS_PATH = "api/plugins/tobago/line-members/"
+
     def _fetch_data(self, kwargs, pool):
-        device = kwargs.get("device")
-        line_members = self.client.query_rest(
-            "api/plugins/tobago/line-members/find-by-object/",
-            {"content_type": "dcim.device", "object_name": device},
+        if not kwargs.get("device_list"):
+            return []
+        return self.client.query_rest(self.LINE_MEMBERS_PATH, {}, pool)
+
+    def _index(self, query_result):
+        # lines also end on circuit terminations, ports, ... whose ids
+        # are not interface ids
+        return ResultIndex(
+            query_result,
+            key=lambda lm: [
+                (str(t["termination"]["device"]["id"]), str(t["termination"]["id"]))
+                for t in lm["terminations"]
+                if t.get("termination_type") == "dcim.interface"
+            ],
+            multi=True,
         )
-        return line_members
 
-    def _merge_into(self, data: dict, query_result):
-        query_device_name = self.kwargs.get("device")
-        for d in filter(
-            lambda device: device["name"] == query_device_name, data["device_list"]
-        ):
+    def _merge_into(self, data: dict, line_members: ResultIndex):
+        for d in data["device_list"]:
             for i in d["interfaces"]:
 
-                attached_tobago_line = None
-                for lm in query_result:
-                    for termination in lm["terminations"]:
-                        if int(termination["termination"]["id"]) == int(i["id"]):
-                            attached_tobago_line = lm
+                attached_tobago_line = line_members.last((str(d["id"]), str(i["id"])))
 
                 i["attached_tobago_line"] = (
                     {
@@ -255,24 +480,42 @@ class TobagoLineMemberDataDummyQuery(ParallelQuery):
 # Note:
 # Netbox v4.2 broke mac addresses in the GraphQL queries. Therefore, we just fetch them via the REST API and add them.
 class DeviceMACQuery(ParallelQuery):
+    # MACs of a batch of fetched devices. chunks of devices keep the URLs
+    # bounded, only the fields needed for the merge are requested.
+    BATCH_SIZE = 50
+    FIELDS = "id,device,primary_mac_address"
+
     def _fetch_data(self, kwargs, pool):
-        device_list = kwargs.get("device_list")
-        return self.client.query_rest(
-            "api/dcim/interfaces",
-            {"primary_mac_address__n": "null", "device": device_list},
+        # no devices yield no batch: an empty device filter would match every
+        # interface
+        batch_promises = [
+            pool.apply_async(
+                self.client.query_rest,
+                args=(
+                    "api/dcim/interfaces",
+                    {
+                        "primary_mac_address__n": "null",
+                        "device_id": batch,
+                        "fields": self.FIELDS,
+                    },
+                    pool,
+                ),
+            )
+            for batch in chunked(
+                device_ids(kwargs.get("device_list", [])), self.BATCH_SIZE
+            )
+        ]
+        return list(chain.from_iterable(p.get() for p in batch_promises))
+
+    def _index(self, query_result):
+        return ResultIndex(
+            query_result, key=lambda mi: (str(mi["device"]["id"]), str(mi["id"]))
         )
 
-    def _merge_into(self, data: dict, query_data):
+    def _merge_into(self, data: dict, mac_interfaces: ResultIndex):
         for d in data["device_list"]:
             for i in d["interfaces"]:
-                mq = next(
-                    filter(
-                        lambda mi: str(mi["device"]["id"]) == d["id"]
-                        and str(mi["id"]) == i["id"],
-                        query_data,
-                    ),
-                    None,
-                )
+                mq = mac_interfaces.first((str(d["id"]), str(i["id"])))
                 # Field must be set at any time, it's not requested in the GraphQL query anymore.
                 i["mac_address"] = (
                     mq["primary_mac_address"]["mac_address"] if mq else None
@@ -281,30 +524,101 @@ class DeviceMACQuery(ParallelQuery):
 
 
 class DeviceDataQuery(ParallelQuery):
+    # devices are fetched in batches. every device of a batch is an aliased
+    # sub-query (d0, d1, ...) sharing the DeviceFields fragment, so that the
+    # result can be split back per device. the fragment only selects the
+    # fields needed for the role of the devices (see query_builder).
 
-    def __init__(self, *args, multiple_mac_addresses=False, **kwargs):
+    def __init__(
+        self,
+        *args,
+        multiple_mac_addresses=False,
+        batch_sizer: AdaptiveBatchSizer | None = None,
+        on_batch: Callable[[list[dict]], Any] | None = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.multiple_mac_addresses = multiple_mac_addresses
+        self.batch_sizer = batch_sizer if batch_sizer else AdaptiveBatchSizer()
+        # called with the devices of every batch as soon as it is fetched
+        self.on_batch = on_batch
+
+    def _batchDone(self, device_data: list[list[dict]]):
+        if self.on_batch is not None:
+            self.on_batch(list(chain.from_iterable(device_data)))
+
+    @classmethod
+    def buildQuery(cls, devices: list[str], role: str = ROUTER) -> str:
+        alias_template = cls.file_template("queries/device_alias.graphql")
+        device_queries = "".join(
+            alias_template.substitute(alias=f"d{i}", device=json.dumps(device))
+            for i, device in enumerate(devices)
+        )
 
-    def _fetch_data(self, kwargs, pool):
-        device = kwargs.get("device")
-        if features.featureIsEnabled("interface-auto-descriptions"):
-            autodesc_query_extension_template = self.file_template(
-                "queries/device_autodesc_query.graphql"
-            )
-        else:
-            autodesc_query_extension_template = self.file_template(
-                "queries/device_no_autodesc_query.graphql"
-            )
+        query_template = cls.file_template("queries/device.graphql")
+        return query_template.substitute(
+            device_queries=device_queries.rstrip("\n"),
+            device_fields=SelectionSetBuilder(DEVICE_FIELDS).build(role),
+        )
 
-        query_template = self.file_template("queries/device.graphql")
-        query = query_template.substitute(
-            device=json.dumps(device),
-            autodesc_query_extension=autodesc_query_extension_template.substitute(),
+    @staticmethod
+    def cacheKey(query_shape: str, device: str) -> str:
+        return f"device:{device}:{query_shape}"
+
+    def _fetch_batch(
+        self, devices: list[str], query_shape: str, role: str
+    ) -> list[list[dict]]:
+        query_result, response_bytes, latency = self.client.timed_query(
+            self.buildQuery(devices, role),
+            f"device_query_{devices[0]}+{len(devices) - 1}",
+            use_cache=False,
         )
+        self.batch_sizer.record(len(devices), response_bytes, latency)
+        data = query_result["data"]
+        per_device = [data.get(f"d{i}") or [] for i in range(len(devices))]
+        if "errors" not in query_result:
+            # batches differ from run to run, so results are cached per device
+            for device, device_data in zip(devices, per_device):
+                self.client.putCached(
+                    self.cacheKey(query_shape, device),
+                    json.dumps(device_data).encode(),
+                )
+        self._batchDone(per_device)
+        return per_device
 
-        query_result = self.client.query(query, f"device_query_{device}")
-        return query_result["data"]
+    def _fetch_data(self, kwargs, pool):
+        devices = list(kwargs.get("device_list", []))
+        role = kwargs.get("role", ROUTER)
+        query_shape = normalize_query(self.buildQuery([], role))
+
+        fetched: dict[str, list[dict]] = dict()
+        missing = []
+        for device in devices:
+            cached = self.client.getCached(self.cacheKey(query_shape, device))
+            if cached is not None:
+                fetched[device] = json.loads(cached)
+            else:
+                missing.append(device)
+        if fetched:
+            self._batchDone(list(fetched.values()))
+
+        if missing:
+            # the first batch is fetched alone to learn response sizes and latencies,
+            # the remaining batches are sized accordingly and fetched concurrently.
+            first_batch = missing[: self.batch_sizer.nextSize()]
+            fetched.update(
+                zip(first_batch, self._fetch_batch(first_batch, query_shape, role))
+            )
+            batches = chunked(missing[len(first_batch) :], self.batch_sizer.nextSize())
+            batch_promises = [
+                pool.apply_async(self._fetch_batch, args=(batch, query_shape, role))
+                for batch in batches
+            ]
+            for batch, batch_promise in zip(batches, batch_promises):
+                fetched.update(zip(batch, batch_promise.get()))
+
+        device_list = list(chain.from_iterable(fetched[d] for d in devices))
+        return {"device_list": device_list}
 
     def _merge_into(self, data: dict, query_data):
         if "device_list" not in data:
@@ -316,100 +630,349 @@ class DeviceDataQuery(ParallelQuery):
 
 
 class NetboxV4Strategy:
-    MAGIC_MIN_INFLIGHT = 1
-    MAGIC_MAX_INFLIGHT = 15
+    MIN_WORKERS = 1
+    # collections the fetched data is derived from. their fingerprint
+    # decides whether cached responses are still valid; it covers them
+    # all, so any change drops every cached response.
+    REVALIDATION_PATHS = [
+        "api/dcim/devices/",
+        "api/dcim/device-types/",
+        "api/dcim/platforms/",
+        "api/dcim/manufacturers/",
+        "api/dcim/interfaces/",
+        "api/dcim/mac-addresses/",
+        "api/dcim/front-ports/",
+        "api/dcim/rear-ports/",
+        "api/dcim/console-ports/",
+        "api/dcim/console-server-ports/",
+        "api/dcim/cables/",
+        "api/circuits/providers/",
+        "api/circuits/provider-networks/",
+        "api/circuits/circuits/",
+        "api/circuits/circuit-terminations/",
+        "api/circuits/virtual-circuit-terminations/",
+        "api/ipam/ip-addresses/",
+        "api/ipam/vlans/",
+        "api/ipam/vrfs/",
+        "api/ipam/route-targets/",
+        "api/extras/tags/",
+        "api/vpn/l2vpns/",
+        "api/vpn/l2vpn-terminations/",
+    ]
+    PLUGIN_REVALIDATION_PATHS = {
+        "routing": ["api/plugins/routing/staticroutes/"],
+        "ippools": ["api/plugins/ip-pools/ippools/"],
+        "tobago": ["api/plugins/tobago/lines/", "api/plugins/tobago/line-members/"],
+    }
 
     def __init__(
         self,
         url,
-        token,
+        sessions: NetboxSessionPool,
         multiple_mac_addresses,
         netbox_43_query_syntax,
         feature_flags,
-        verify_certs=True,
+        fetch_executor: str | None = None,
+        device_batch: dict | None = None,
+        persistent_cache: DiskResponseCache | None = None,
+        incremental_state: IncrementalState | None = None,
+        changelog_path: str = "api/core/object-changes/",
+        page_sizes: dict[str, int] | None = None,
+        max_inflight_pages: int = NetboxAPIClient.DEFAULT_MAX_INFLIGHT_PAGES,
+        memory_cache_max_bytes: int = MemoryResponseCache.DEFAULT_MAX_BYTES,
     ):
         self.url = url
-        self.token = token
+        self.sessions = sessions
         self.multiple_mac_addresses = multiple_mac_addresses
         self.netbox_43_query_syntax = netbox_43_query_syntax
         self.feature_flags = feature_flags
-        self.verify_certs = verify_certs
+        self.fetch_executor_class = FetchExecutorFactory(fetch_executor).get()
+        self.device_batch = device_batch
+        self.persistent_cache = persistent_cache
+        self.incremental_state = incremental_state
+        self.changelog_path = changelog_path
+        self.page_sizes = page_sizes
+        self.max_inflight_pages = max_inflight_pages
+        self.memory_cache_max_bytes = memory_cache_max_bytes
+        self.merge_time = 0.0
+        self.shared_data: dict = dict()
+        self.metrics = FetchMetrics()
 
     def worker_amount(self, n_queries: int):
-        return clip(n_queries, self.MAGIC_MIN_INFLIGHT, self.MAGIC_MAX_INFLIGHT)
-
-    def get_data(self, device_config):
-        device_list = device_config["router"] + device_config["switch"]
-
-        queries = list()
-
-        # https://superfastpython.com/multiprocessing-pool-share-with-workers/
-        # pool object is used through manager's proxy multiprocess object,
-        # this way, subprocesses can spawn more processes as if it was done
-        # from the main thread. by default this is not possible, see
-        # https://stackoverflow.com/questions/72411392/can-you-do-nested-parallelization-using-multiprocessing-in-python
-        # this avoids having to re-architecture completely using worker/task/queue model.
-        with get_client_mp_context().Manager() as manager:
-            client = NetboxAPIClient(
-                self.url, self.token, manager.dict(), verify_certs=self.verify_certs
+        # the task of every query may block, waiting on its batches or on the
+        # data of another query. on top of those, enough workers to keep as
+        # many requests in flight as the session pool allows.
+        return max(self.MIN_WORKERS, n_queries + self.sessions.concurrency.maximum)
+
+    def revalidation_paths(self) -> list[str]:
+        return self.REVALIDATION_PATHS + [
+            path
+            for flag, paths in self.PLUGIN_REVALIDATION_PATHS.items()
+            if self.feature_flags.get(flag)
+            for path in paths
+        ]
+
+    def signature(self) -> str:
+        # data stored by an incremental run can only be reused by runs
+        # asking for the same shape of data
+        return hashlib.sha256(
+            (
+                normalize_query(DeviceDataQuery.buildQuery([], ROUTER))
+                + normalize_query(DeviceDataQuery.buildQuery([], SWITCH))
+                + str(self.feature_flags)
+                + str(features)
+            ).encode()
+        ).hexdigest()
+
+    def _buildQueries(
+        self,
+        client: NetboxAPIClient,
+        device_config: dict,
+        device_list: list[str],
+        reused_devices: list[dict],
+        on_batch: Callable[[str, list[dict]], Any],
+    ) -> tuple[dict[str, "DeviceDataQuery"], list[ParallelQuery], list[ParallelQuery]]:
+        # returns the device queries per role, the queries merged into every
+        # device (see also _batchQueries()) and the queries of data shared by
+        # all devices
+        switches = set(device_config["switch"])
+        device_queries = {
+            role: DeviceDataQuery(
+                client,
+                device_list=role_devices,
+                role=role,
+                multiple_mac_addresses=self.multiple_mac_addresses,
+                batch_sizer=AdaptiveBatchSizer.fromConfig(self.device_batch),
+                on_batch=partial(on_batch, role),
             )
+            for role, role_devices in [
+                (ROUTER, [d for d in device_list if d not in switches]),
+                (SWITCH, [d for d in device_list if d in switches]),
+            ]
+        }
 
-            for d in device_list:
-                queries.extend(
-                    [
-                        DeviceDataQuery(
-                            client,
-                            device=d,
-                            multiple_mac_addresses=self.multiple_mac_addresses,
-                        ),
-                        (
-                            TobagoLineMembersDataQuery(client, device=d)
-                            if self.feature_flags["tobago"]
-                            and (
-                                features.featureIsEnabled("interface-auto-descriptions")
-                                or features.featureIsEnabled("new-bgp-cpe-group-naming")
-                            )
-                            else TobagoLineMemberDataDummyQuery(client, device=d)
-                        ),
-                    ]
+        device_scoped_queries: list[ParallelQuery] = [
+            (
+                TobagoLineMembersDataQuery(client, device_list=device_list)
+                if self.feature_flags["tobago"]
+                and (
+                    features.featureIsEnabled("interface-auto-descriptions")
+                    or features.featureIsEnabled("new-bgp-cpe-group-naming")
                 )
+                else TobagoLineMemberDataDummyQuery(client, device_list=device_list)
+            ),
+            (
+                IPPoolDataQuery(client, device_list=device_list)
+                if self.feature_flags["ippools"]
+                else IPPoolDataDummyQuery(client, device_list=device_list)
+            ),
+        ]
+
+        # L2VPNs are only used by routers
+        l2vpn_query = L2VPNDataQuery(
+            client,
+            device_queries=[device_queries[ROUTER]],
+            reused_devices=[d for d in reused_devices if d["name"] not in switches],
+            netbox_43_query_syntax=self.netbox_43_query_syntax,
+        )
+        shared_queries: list[ParallelQuery] = [
+            l2vpn_query,
+            LoopbackDataQuery(
+                client,
+                l2vpn_query=l2vpn_query,
+                netbox_43_query_syntax=self.netbox_43_query_syntax,
+            ),
+        ]
+        return device_queries, device_scoped_queries, shared_queries
+
+    def _batchQueries(
+        self, client: NetboxAPIClient, devices: list[dict]
+    ) -> list[ParallelQuery]:
+        # queries merged into a batch of fetched devices, sent as soon as the
+        # batch is there
+        device_names = [d["name"] for d in devices]
+        return [
+            (
+                StaticRouteQuery(client, device_list=device_names)
+                if self.feature_flags["routing"]
+                else StaticRouteDummyQuery(client, device_list=device_names)
+            ),
+            DeviceMACQuery(client, device_list=devices),
+            ConnectedDevicesDataQuery(
+                client,
+                device_list=devices,
+                netbox_43_query_syntax=self.netbox_43_query_syntax,
+            ),
+        ]
 
-            queries.extend(
-                [
-                    L2VPNDataQuery(client, device_list=device_list),
-                    (
-                        StaticRouteQuery(client, device_list=device_list)
-                        if self.feature_flags["routing"]
-                        else StaticRouteDummyQuery(client, device_list=device_list)
-                    ),
-                    DeviceMACQuery(client, device_list=device_list),
-                    ConnectedDevicesDataQuery(
-                        client,
-                        device_list=device_list,
-                        netbox_43_query_syntax=self.netbox_43_query_syntax,
-                    ),
-                    LoopbackDataQuery(client, device_list=device_list),
-                    (
-                        IPPoolDataQuery(client, device_list=device_list)
-                        if self.feature_flags["ippools"]
-                        else IPPoolDataDummyQuery(client, device_list=device_list)
-                    ),
-                ]
-            )
+    @staticmethod
+    def _mergeDeviceScoped(
+        devices: list[dict], device_scoped_queries: list[ParallelQuery]
+    ) -> list[dict]:
+        data = {"device_list": devices}
+        for q in device_scoped_queries:
+            data = q.merge_into(q.data_promise, data)
+        return data["device_list"]
+
+    def iter_data(self, device_config) -> Iterator[tuple[dict, dict]]:
+        # yields every device with the data shared by all devices as soon as
+        # both are complete, while the other devices are still being fetched.
+        # switches do not use the shared data, so they don't wait for it.
+        all_devices = device_config["router"] + device_config["switch"]
+        device_list = all_devices
+        switches = set(device_config["switch"])
+
+        self.metrics = FetchMetrics()
+        memory_cache = MemoryResponseCache(self.memory_cache_max_bytes)
+        client = NetboxAPIClient(
+            self.url,
+            self.sessions,
+            memory_cache,
+            persistent_cache=self.persistent_cache,
+            page_sizes=self.page_sizes,
+            max_inflight_pages=self.max_inflight_pages,
+            metrics=self.metrics,
+        )
 
-            # manager.Pool normally takes the amount of CPU cores for the amount of processes it spawns.
-            # Since our processes are mostly waiting, I would like to increase this to the amount of queries,
-            # we are going to send.
-            # Note: This will most likely screw the measured times, because Netbox cannot process too many requests at once
-            # and will stall them eventually. So, if you are measuring times, reduce this to a reasonable amounts of 8 or something.
-            worker_amount = self.worker_amount(len(queries))
-            with manager.Pool(worker_amount) as pool:
-                data_promises = list(map(lambda x: x.fetch_data(pool), queries))
+        reused_devices: list[dict] = []
+        if self.incremental_state is not None:
+            planner = IncrementalFetchPlanner(client, self.changelog_path)
+            with query_scope(self.metrics, type(planner).__name__):
+                device_list, reused_devices, watermark = planner.plan(
+                    self.incremental_state.load(), self.signature(), all_devices
+                )
 
-                data = dict()
+        # filled from the fetching threads, drained by this one
+        events: queue.Queue = queue.Queue()
+        device_queries, device_scoped_queries, shared_queries = self._buildQueries(
+            client,
+            device_config,
+            device_list,
+            reused_devices,
+            on_batch=lambda role, devices: events.put((role, devices)),
+        )
+        queries = [*device_queries.values(), *device_scoped_queries, *shared_queries]
+
+        # Our fetches are I/O-bound, so the executor gets a worker per request allowed in flight.
+        # How many requests actually reach Netbox at once is decided by the
+        # session pool's concurrency controller, which backs off when Netbox is overloaded.
+        worker_amount = self.worker_amount(len(queries))
+        completed: list[dict] = list()
+        shared: dict = dict()
+        with self.fetch_executor_class(worker_amount) as pool:
+            if self.persistent_cache is not None:
+                with query_scope(self.metrics, "CacheRevalidation"):
+                    fingerprint = client.fingerprint(self.revalidation_paths(), pool)
+                self.persistent_cache.revalidate(fingerprint)
+
+            promises = {id(q): q.fetch_data(pool) for q in queries}
+            device_promises = [promises[id(q)] for q in device_queries.values()]
+            shared_promises = [promises[id(q)] for q in shared_queries]
+            scoped_promises = [promises[id(q)] for q in device_scoped_queries]
+            for q in queries:
+                promises[id(q)].add_done_callback(events.put)
+
+            shared_ready = False
+            waiting_routers: list[dict] = list()
+            merge_times: dict[str, float] = defaultdict(float)
+
+            def mergeShared():
+                nonlocal shared, shared_ready
+                for q in shared_queries:
+                    shared = q.merge_into(q.data_promise, shared)
+                shared_ready = True
+
+            # fetched device batches waiting for the data merged into them
+            pending_batches: list[tuple[list[dict], list[ParallelQuery], list]] = list()
+
+            def mergeReadyBatches() -> list[dict]:
+                nonlocal pending_batches
+                merged, still_pending = list(), list()
+                for devices, batch_queries, batch_promises in pending_batches:
+                    if not all(p.ready() for p in scoped_promises + batch_promises):
+                        still_pending.append((devices, batch_queries, batch_promises))
+                        continue
+                    merged += self._mergeDeviceScoped(
+                        devices, [*device_scoped_queries, *batch_queries]
+                    )
+                    for q in batch_queries:
+                        merge_times[type(q).__name__] += q.merge_time
+                pending_batches = still_pending
+                return merged
+
+            # reused devices already went through the device scoped merges last time
+            ready_devices = list(reused_devices)
+            pending_device_promises = list(device_promises)
+            while True:
+                for d in ready_devices:
+                    completed.append(d)
+                    if d["name"] in switches or shared_ready:
+                        yield d, shared
+                    else:
+                        waiting_routers.append(d)
+                ready_devices = list()
+
+                if not shared_ready and all(p.ready() for p in shared_promises):
+                    mergeShared()
+                    for d in waiting_routers:
+                        yield d, shared
+                    waiting_routers = list()
+
+                if not pending_device_promises and not pending_batches:
+                    break
+                event = events.get()
+                if isinstance(event, tuple):
+                    _, devices = event
+                    batch_queries = self._batchQueries(client, devices)
+                    batch_promises = [q.fetch_data(pool) for q in batch_queries]
+                    for p in batch_promises:
+                        p.add_done_callback(events.put)
+                    pending_batches.append((devices, batch_queries, batch_promises))
+                else:
+                    pending_device_promises = [
+                        p for p in pending_device_promises if p is not event
+                    ]
+                    event.get()  # raises if fetching failed
+                ready_devices = mergeReadyBatches()
+
+            if not shared_ready:
+                mergeShared()
+                for d in waiting_routers:
+                    yield d, shared
+
+        for q in queries:
+            merge_times[type(q).__name__] += q.merge_time
+        for name, merge_time in merge_times.items():
+            log.debug(f"Merging {name} took {round(merge_time, 3)} s...")
+        self.merge_time = sum(merge_times.values())
+
+        memory_cache.logStatistics()
+        self.metrics.logStatistics()
+        if self.persistent_cache is not None:
+            self.persistent_cache.logStatistics()
+
+        self.shared_data = shared
+        if self.incremental_state is not None:
+            self.incremental_state.save(
+                watermark,
+                self.signature(),
+                {
+                    **shared,
+                    "device_list": self.sortedLikeConfig(completed, all_devices),
+                },
+            )
 
-                for i, q in enumerate(queries):
-                    dp = data_promises[i]
-                    data = q.merge_into(dp, data)
+    @staticmethod
+    def sortedLikeConfig(devices: list[dict], device_names: list[str]) -> list[dict]:
+        device_order = {d.lower(): i for i, d in enumerate(device_names)}
+        return sorted(
+            devices, key=lambda d: device_order.get(str(d["name"]).lower(), 0)
+        )
 
-        return data
+    def get_data(self, device_config):
+        devices = [d for d, _ in self.iter_data(device_config)]
+        all_devices = device_config["router"] + device_config["switch"]
+        return {
+            **self.shared_data,
+            "device_list": self.sortedLikeConfig(devices, all_devices),
+        }
@@ -0,0 +1,244 @@
+from cosmo.features import features
+
+
+class Field:
+    # a field of a GraphQL selection set, with its own selection set if it
+    # is an object. roles and required_features restrict it to queries for
+    # these device roles, and to runs with all these features enabled.
+    # typename is the GraphQL type of an object, if it is not a union.
+    def __init__(
+        self,
+        name: str,
+        selections: list["Field"] | None = None,
+        roles: set[str] | None = None,
+        required_features: set[str] | None = None,
+        typename: str | None = None,
+    ):
+        self.name = name
+        self.selections = selections
+        self.roles = roles
+        self.required_features = required_features
+        self.typename = typename
+
+    def isSelected(self, role: str) -> bool:
+        if self.roles is not None and role not in self.roles:
+            return False
+        return all(features.featureIsEnabled(f) for f in self.required_features or [])
+
+
+class InlineFragment(Field):
+    def __init__(self, type_condition: str, selections: list[Field], **kwargs):
+        super().__init__(
+            f"... on {type_condition}", selections, typename=type_condition, **kwargs
+        )
+
+
+class SelectionSetBuilder:
+    # composes the selection set a role needs out of a field registry.
+    # fields registered more than once (e.g. once per feature) are merged.
+    INDENT = "    "
+
+    def __init__(self, fields: list[Field]):
+        self.fields = fields
+
+    def _render(self, fields: list[Field], role: str, depth: int) -> str:
+        merged: dict[str, list[Field] | None] = dict()
+        for f in filter(lambda f: f.isSelected(role), fields):
+            if f.selections is None:
+                merged.setdefault(f.name, None)
+            else:
+                merged[f.name] = (merged.get(f.name) or []) + f.selections
+
+        indent = self.INDENT * depth
+        lines = []
+        for name, selections in merged.items():
+            if selections is None:
+                lines.append(f"{indent}{name}")
+                continue
+            selection_set = self._render(selections, role, depth + 1)
+            if selection_set:  # objects without any selected field are left out
+                lines.append(f"{indent}{name} {{\n{selection_set}\n{indent}}}")
+        return "\n".join(lines)
+
+    def build(self, role: str) -> str:
+        return "{\n" + self._render(self.fields, role, 1) + "\n}"
+
+
+def fields_by_typename(
+    fields: list[Field], typename: str | None, found: dict[str, set[str]] | None = None
+) -> dict[str, set[str]]:
+    # every field selected on objects of each type, for any role and feature
+    found = found if found is not None else dict()
+    for f in fields:
+        if isinstance(f, InlineFragment):
+            fields_by_typename(f.selections or [], f.typename, found)
+            continue
+        if typename is not None:
+            found.setdefault(typename, set()).add(f.name)
+        if f.selections is not None:
+            fields_by_typename(f.selections, f.typename, found)
+    return found
+
+
+def _typename_and(*selections: Field) -> list[Field]:
+    return [Field("__typename"), *selections]
+
+
+def _named_with_device(type_condition: str, **kwargs) -> InlineFragment:
+    return InlineFragment(
+        type_condition,
+        _typename_and(
+            Field("id"),
+            Field("name"),
+            Field(
+                "device",
+                _typename_and(Field("id"), Field("name")),
+                typename="DeviceType",
+            ),
+        ),
+        **kwargs,
+    )
+
+
+def _displayed(type_condition: str, **kwargs) -> InlineFragment:
+    return InlineFragment(type_condition, _typename_and(Field("display")), **kwargs)
+
+
+def _manufactured(name: str, typename: str) -> Field:
+    return Field(
+        name,
+        _typename_and(
+            Field(
+                "manufacturer",
+                _typename_and(Field("slug")),
+                typename="ManufacturerType",
+            ),
+            Field("slug"),
+        ),
+        typename=typename,
+    )
+
+
+ROUTER = "router"
+SWITCH = "switch"
+AUTODESC = "interface-auto-descriptions"
+
+DEVICE_FIELDS = _typename_and(
+    Field("id"),
+    Field("name"),
+    # ISIS system id and ASN
+    Field("custom_fields", roles={ROUTER}),
+    _manufactured("device_type", "DeviceTypeType"),
+    _manufactured("platform", "PlatformType"),
+    # CPE address detection
+    Field(
+        "primary_ip4",
+        _typename_and(Field("address")),
+        roles={ROUTER},
+        typename="IPAddressType",
+    ),
+    Field(
+        "interfaces",
+        _typename_and(
+            Field("id"),
+            Field("name"),
+            Field("enabled"),
+            Field("type"),
+            Field("mode"),
+            Field("mtu"),
+            Field("description"),
+            # BGP CPE sessions
+            Field(
+                "connected_endpoints",
+                [_named_with_device("InterfaceType")],
+                roles={ROUTER},
+            ),
+            Field(
+                "connected_endpoints",
+                [
+                    _named_with_device("InterfaceType"),
+                    _displayed("ProviderNetworkType"),
+                    _displayed("CircuitTerminationType"),
+                    _displayed("VirtualCircuitTerminationType"),
+                    _named_with_device("FrontPortType"),
+                    _named_with_device("RearPortType"),
+                    _named_with_device("ConsolePortType"),
+                    _named_with_device("ConsoleServerPortType"),
+                ],
+                required_features={AUTODESC},
+            ),
+            Field(
+                "link_peers",
+                [
+                    _displayed("CircuitTerminationType"),
+                    _named_with_device("FrontPortType"),
+                    _named_with_device("RearPortType"),
+                    _named_with_device("ConsolePortType"),
+                    _named_with_device("ConsoleServerPortType"),
+                    _named_with_device("InterfaceType"),
+                ],
+                required_features={AUTODESC},
+            ),
+            Field(
+                "vrf",
+                _typename_and(
+                    Field("id"),
+                    Field("name"),
+                    Field("description"),
+                    Field("rd"),
+                    Field(
+                        "export_targets",
+                        _typename_and(Field("name")),
+                        typename="RouteTargetType",
+                    ),
+                    Field(
+                        "import_targets",
+                        _typename_and(Field("name")),
+                        typename="RouteTargetType",
+                    ),
+                ),
+                roles={ROUTER},
+                typename="VRFType",
+            ),
+            Field(
+                "lag",
+                _typename_and(Field("id"), Field("name")),
+                typename="InterfaceType",
+            ),
+            Field(
+                "ip_addresses",
+                _typename_and(Field("address"), Field("role")),
+                typename="IPAddressType",
+            ),
+            Field(
+                "untagged_vlan",
+                _typename_and(Field("id"), Field("name"), Field("vid")),
+                typename="VLANType",
+            ),
+            Field(
+                "tagged_vlans",
+                _typename_and(Field("id"), Field("name"), Field("vid")),
+                typename="VLANType",
+            ),
+            Field(
+                "tags",
+                _typename_and(Field("id"), Field("name"), Field("slug")),
+                typename="TagType",
+            ),
+            Field(
+                "parent",
+                _typename_and(Field("id"), Field("mtu"), Field("name")),
+                typename="InterfaceType",
+            ),
+            # outer_tag for VLANs, ipv6_ra for routers
+            Field("custom_fields"),
+        ),
+        typename="InterfaceType",
+    ),
+)
+
+# fields the device scoped queries of the Netbox client merge into devices
+MERGED_FIELDS = {
+    "DeviceType": {"staticroute_set", "pool_set", "l2vpn_list"},
+    "InterfaceType": {"mac_address", "attached_tobago_line", "connected_endpoints"},
+}
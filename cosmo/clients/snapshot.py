@@ -0,0 +1,101 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from cosmo import log
+from cosmo.clients.cache import CachedResponse, normalize_query, normalize_url
+from cosmo.clients.netbox_session import NetboxSessionPool
+
+
+def exchange_key(method: str, url: str, query: str | None = None) -> str:
+    # the Netbox host is left out, a snapshot can be replayed under any URL
+    _, _, path, q, _ = urlsplit(normalize_url(url))
+    key = f"{method} {path}?{q}"
+    if query is not None:
+        key += f" {normalize_query(query)}"
+    return key
+
+
+class RecordingSessionPool(NetboxSessionPool):
+    # talks to Netbox like its parent, and keeps every exchange so it can be
+    # written to a snapshot archive afterward
+    def __init__(self, url, token, **kwargs):
+        super().__init__(token, **kwargs)
+        self.url = url
+        self._exchanges_lock = threading.Lock()
+        self._exchanges: dict[str, dict] = dict()
+
+    def _record(self, key: str, r):
+        with self._exchanges_lock:
+            self._exchanges[key] = {
+                "key": key,
+                "status_code": r.status_code,
+                "body": r.content.decode("utf-8"),
+            }
+
+    def get(self, url, **kwargs):
+        r = super().get(url, **kwargs)
+        self._record(exchange_key("GET", url), r)
+        return r
+
+    def post(self, url, **kwargs):
+        r = super().post(url, **kwargs)
+        self._record(exchange_key("POST", url, kwargs.get("json", {}).get("query")), r)
+        return r
+
+    def save(self, path: str | os.PathLike):
+        with self._exchanges_lock:
+            exchanges = list(self._exchanges.values())
+        with tarfile.open(path, "w:gz") as archive:
+            members = [("meta.json", {"url": self.url, "recorded_at": time.time()})]
+            members += [
+                (
+                    f"exchanges/{hashlib.sha256(e['key'].encode()).hexdigest()}.json",
+                    e,
+                )
+                for e in exchanges
+            ]
+            for name, content in members:
+                data = json.dumps(content).encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        log.info(f"Recorded {len(exchanges)} Netbox exchange(s) to {path}")
+
+
+class ReplaySessionPool(NetboxSessionPool):
+    # answers every request from a snapshot archive, Netbox is never contacted
+    def __init__(self, path: str | os.PathLike, token="replay", **kwargs):
+        super().__init__(token, **kwargs)
+        self._exchanges: dict[str, dict] = dict()
+        self.url = None
+        with tarfile.open(path, "r:gz") as archive:
+            for member in archive.getmembers():
+                f = archive.extractfile(member)
+                if f is None:
+                    continue
+                content = json.load(f)
+                if member.name == "meta.json":
+                    self.url = content.get("url")
+                else:
+                    self._exchanges[content["key"]] = content
+        log.info(f"Replaying {len(self._exchanges)} Netbox exchange(s) from {path}")
+
+    def _replay(self, key: str) -> CachedResponse:
+        exchange = self._exchanges.get(key)
+        if exchange is None:
+            raise Exception(f"Request not found in snapshot: {key}")
+        return CachedResponse(exchange["body"].encode(), exchange["status_code"])
+
+    def get(self, url, **kwargs):
+        return self._replay(exchange_key("GET", url))
+
+    def post(self, url, **kwargs):
+        return self._replay(
+            exchange_key("POST", url, kwargs.get("json", {}).get("query"))
+        )
@@ -0,0 +1,139 @@
+import sys
+from typing import Any, Iterator
+
+from cosmo.clients.query_builder import DEVICE_FIELDS, MERGED_FIELDS, fields_by_typename
+from cosmo.netbox_types import AbstractNetboxType
+
+
+class CompactStore:
+    # drop-in for the dict AbstractNetboxType keeps its fields in. fields
+    # known from the GraphQL selection sets live in slots, the other ones in
+    # an overflow dict. insertion order is kept, as with a dict, in a key
+    # tuple shared by all stores which got the same keys in the same order.
+    __slots__ = ("_keys", "_overflow")
+    SLOTS: dict[str, str] = {}
+    # types with a small vocabulary (tags, platforms, ...) intern all their
+    # strings, the other ones only their typename
+    INTERN_VALUES = False
+    _key_orders: dict[tuple, tuple] = {}
+
+    def __init__(self, *args, **kwargs):
+        self._keys: tuple = ()
+        self._overflow: dict | None = None
+        self.update(*args, **kwargs)
+
+    def _set(self, key: str, value: Any):
+        if isinstance(value, str) and (self.INTERN_VALUES or key == "__typename"):
+            value = sys.intern(value)
+        slot = self.SLOTS.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        else:
+            if self._overflow is None:
+                self._overflow = dict()
+            self._overflow[key] = value
+
+    def _addKeys(self, new_keys: tuple):
+        keys = self._keys + new_keys
+        self._keys = self._key_orders.setdefault(keys, keys)
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self._keys:
+            self._addKeys((key,))
+        self._set(key, value)
+
+    def __getitem__(self, key: str) -> Any:
+        slot = self.SLOTS.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._overflow is None:
+            raise KeyError(key)
+        return self._overflow[key]
+
+    def __delitem__(self, key: str):
+        if key not in self._keys:
+            raise KeyError(key)
+        keys = tuple(k for k in self._keys if k != key)
+        self._keys = self._key_orders.setdefault(keys, keys)
+        slot = self.SLOTS.get(key)
+        if slot is not None:
+            delattr(self, slot)
+        elif self._overflow is not None:
+            del self._overflow[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self._keys else default
+
+    def keys(self) -> tuple:
+        return self._keys
+
+    def values(self) -> list:
+        return [self[k] for k in self._keys]
+
+    def items(self) -> list[tuple[str, Any]]:
+        return [(k, self[k]) for k in self._keys]
+
+    def update(self, *args, **kwargs):
+        for other in [*args, kwargs]:
+            new_keys = []
+            for k, v in other.items() if hasattr(other, "items") else other:
+                if k not in self._keys and k not in new_keys:
+                    new_keys.append(k)
+                self._set(k, v)
+            if new_keys:
+                self._addKeys(tuple(new_keys))
+
+
+INTERNED_TYPES = [
+    "TagType",
+    "ManufacturerType",
+    "PlatformType",
+    "DeviceTypeType",
+    "RouteTargetType",
+]
+
+
+def compact_store_classes(
+    fields: dict[str, set[str]],
+) -> dict[str, type[CompactStore]]:
+    # one store class per typename, with a slot per field
+    store_classes = dict()
+    for typename, field_names in fields.items():
+        # slots of "__parent" and "parent" must not collide
+        slots = {f: f"_f_{f}" for f in sorted(field_names | {"__parent"})}
+        store_classes[typename] = type(
+            f"Compact{typename}Store",
+            (CompactStore,),
+            {
+                "__slots__": tuple(slots.values()),
+                "SLOTS": slots,
+                "INTERN_VALUES": typename in INTERNED_TYPES,
+                "_key_orders": dict(),
+            },
+        )
+    return store_classes
+
+
+def enable_compact_types():
+    # the device data the Netbox client fetches is converted to compact
+    # stores from now on
+    fields = fields_by_typename(DEVICE_FIELDS, "DeviceType")
+    for typename, merged in MERGED_FIELDS.items():
+        fields[typename] = fields.get(typename, set()) | merged
+    AbstractNetboxType.useStoreClasses(compact_store_classes(fields))
+
+
+def disable_compact_types():
+    AbstractNetboxType.useStoreClasses(None)
@@ -0,0 +1,135 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from cosmo import log
+from cosmo.clients.netbox import NetboxClient
+from cosmo.common import DeviceSerializationError
+from cosmo.features import features
+from cosmo.generator import get_device_fqdn, is_device_allowed, serialize_device
+
+
+class CosmoDaemon:
+    # keeps the Netbox data in memory, refreshes it in the background and
+    # generates devices from it on request (see request_generation()).
+    DEFAULT_REFRESH_INTERVAL = 300.0
+    # these features change what is fetched, a request cannot toggle them
+    # without a fetch of its own
+    FETCH_FEATURES = ["interface-auto-descriptions", "new-bgp-cpe-group-naming"]
+
+    def __init__(
+        self,
+        netbox_client: NetboxClient,
+        cosmo_configuration,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+    ):
+        self.netbox_client = netbox_client
+        self.cosmo_configuration = cosmo_configuration
+        self.refresh_interval = refresh_interval
+        self.data: dict | None = None
+        self.refreshed_at: float | None = None
+        self._data_lock = threading.Lock()
+        # features are global, requests toggling them are generated one at a time
+        self._generation_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server: socketserver.UnixStreamServer | None = None
+
+    def refresh(self):
+        data = self.netbox_client.get_data(self.cosmo_configuration["devices"])
+        with self._data_lock:
+            self.data = data
+            self.refreshed_at = time.time()
+
+    def _refreshLoop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # the previous data is still served
+                log.error(f"Refreshing Netbox data failed: {e}", None)
+
+    def generate(self, request: dict) -> dict:
+        toggles = request.get("features", {})
+        for f in set(toggles.keys()) & set(self.FETCH_FEATURES):
+            if features.featureIsEnabled(f) != bool(toggles[f]):
+                return {"error": f"feature {f} cannot be toggled per request"}
+        with self._data_lock:
+            data, refreshed_at = self.data, self.refreshed_at
+        if data is None:
+            return {"error": "no Netbox data fetched yet"}
+
+        allowed_hosts = request.get("limit")
+        devices: dict = dict()
+        errors: list[str] = list()
+        with self._generation_lock:
+            previous_state = {f: features.featureIsEnabled(f) for f in toggles}
+            features.setFeatures({f: bool(t) for f, t in toggles.items()})
+            try:
+                for device in data["device_list"]:
+                    device_fqdn = get_device_fqdn(device, self.cosmo_configuration)
+                    if not is_device_allowed(device, device_fqdn, allowed_hosts):
+                        continue
+                    try:
+                        # serializers write into the device, the cached one stays as is
+                        devices[device_fqdn] = serialize_device(
+                            dict(device), data, self.cosmo_configuration
+                        )
+                    except DeviceSerializationError as dse:
+                        errors.append(f'{device_fqdn}: {type(dse).__name__}("{dse}")')
+            finally:
+                features.setFeatures(previous_state)
+        return {
+            "output_format": self.cosmo_configuration["output_format"],
+            "refreshed_at": refreshed_at,
+            "devices": devices,
+            "errors": errors,
+        }
+
+    def serve(self, socket_path: str | os.PathLike):
+        self.refresh()
+        refresher = threading.Thread(
+            target=self._refreshLoop, name="cosmo-refresh", daemon=True
+        )
+        refresher.start()
+
+        daemon = self
+
+        class GenerationRequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    response = daemon.generate(json.loads(self.rfile.readline()))
+                except Exception as e:
+                    response = {"error": str(e)}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # left behind by a previous daemon
+        self._server = socketserver.ThreadingUnixStreamServer(
+            str(socket_path), GenerationRequestHandler
+        )
+        log.info(f"Serving generation requests on {socket_path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+            os.unlink(socket_path)
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def request_generation(socket_path: str | os.PathLike, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(str(socket_path))
+        s.sendall(json.dumps(request).encode() + b"\n")
+        with s.makefile("rb") as response_file:
+            response = json.loads(response_file.readline())
+    if "error" in response:
+        raise Exception(f"cosmo daemon: {response['error']}")
+    return response
@@ -68,11 +68,21 @@ class FeatureToggle:
                 values: str | Sequence[Any] | None,
                 option_string: Optional[str] = None,
             ):
+                toggled = values if type(values) is list else [values]
                 if type(values) is list:
                     [feature_toggle_instance.setFeature(v, toggle_to) for v in values]
                 elif type(values) is str:
                     feature_toggle_instance.setFeature(values, toggle_to)
                 setattr(namespace, self.dest, values)
+                # every toggle of the command line, e.g. to forward them to a daemon
+                setattr(
+                    namespace,
+                    "feature_toggles",
+                    {
+                        **(getattr(namespace, "feature_toggles", None) or {}),
+                        **{v: toggle_to for v in toggled if type(v) is str},
+                    },
+                )
 
         return ToggleFeatureAction
 
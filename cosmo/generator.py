@@ -0,0 +1,71 @@
+import json
+import pathlib
+
+import yaml
+
+from cosmo.common import CosmoOutputType
+from cosmo.l2vpns import L2VPNGraph
+from cosmo.serializer import RouterSerializer, SwitchSerializer
+
+
+def get_device_fqdn(device: dict, cosmo_configuration) -> str:
+    if cosmo_configuration.get("fqdnSuffix"):
+        return f"{str(device['name']).lower()}.{cosmo_configuration['fqdnSuffix']}"
+    return f"{str(device['name']).lower()}"
+
+
+def is_device_allowed(device: dict, device_fqdn: str, allowed_hosts) -> bool:
+    return (
+        not allowed_hosts
+        or device["name"] in allowed_hosts
+        or device_fqdn in allowed_hosts
+    )
+
+
+# the L2VPN graph of the latest Netbox data, with the list it was built from
+_l2vpn_graph: tuple[list, L2VPNGraph] | None = None
+
+
+def get_l2vpn_graph(cosmo_data: dict) -> L2VPNGraph:
+    # the L2VPNs are converted once for all routers generated from cosmo_data
+    global _l2vpn_graph
+    l2vpn_list = cosmo_data["l2vpn_list"]
+    if _l2vpn_graph is None or _l2vpn_graph[0] is not l2vpn_list:
+        _l2vpn_graph = (l2vpn_list, L2VPNGraph(l2vpn_list))
+    return _l2vpn_graph[1]
+
+
+def serialize_device(
+    device: dict, cosmo_data: dict, cosmo_configuration
+) -> CosmoOutputType | None:
+    # raises DeviceSerializationError if the device cannot be generated
+    if device["name"] in cosmo_configuration["devices"]["router"]:
+        return RouterSerializer(
+            device,
+            get_l2vpn_graph(cosmo_data),
+            cosmo_data["loopbacks"],
+            cosmo_configuration,
+        ).serialize()
+    elif device["name"] in cosmo_configuration["devices"]["switch"]:
+        return SwitchSerializer(device, cosmo_configuration).serialize()
+    return None
+
+
+def write_device_output(device_fqdn: str, content, output_format: str):
+    match output_format:
+        case "ansible":
+            pathlib.Path(f"./host_vars/{device_fqdn}").mkdir(
+                parents=True, exist_ok=True
+            )
+            with open(
+                f"./host_vars/{device_fqdn}/generated-cosmo.yml", "w"
+            ) as yaml_file:
+                yaml.dump(content, yaml_file, default_flow_style=False)
+        case "nix":
+            pathlib.Path(f"./machines/{device_fqdn}").mkdir(parents=True, exist_ok=True)
+            with open(
+                f"./machines/{device_fqdn}/generated-cosmo.json", "w"
+            ) as json_file:
+                json.dump(content, json_file, indent=4)
+        case other:
+            raise Exception(f"unsupported output format {other}")
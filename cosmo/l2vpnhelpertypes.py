@@ -47,12 +47,7 @@ class EthernetCccEncapCapability(AbstractEncapCapability, metaclass=ABCMeta):
             if o.isSubInterface()
             else o.getName()
         )
-        sub_units = list(
-            filter(  # costlier check it is then
-                lambda i: i.getName().startswith(root_name) and i.isSubInterface(),
-                o.getParent(DeviceType).getInterfaces(),
-            )
-        )
+        sub_units = o.getParent(DeviceType).getSubInterfaces(root_name)
         if len(sub_units) == 1:
             return "ethernet-ccc"
 
@@ -0,0 +1,54 @@
+from collections import defaultdict
+from itertools import chain
+
+from cosmo.netbox_types import DeviceType, InterfaceType, L2VPNType, VLANType
+
+
+class L2VPNGraph:
+    # the L2VPNs of a run, converted once and shared by all routers. a router
+    # only gets the L2VPNs terminating on one of its interfaces (see
+    # viewFor()), and they are moved below it while it is serialized (see
+    # attachTo()). hence routers sharing a graph are serialized one at a time.
+    # L2VPNs which cannot be told to terminate on any interface are in every
+    # view, so that every router still validates them.
+    def __init__(self, l2vpn_list: list[dict]):
+        self.l2vpns = [L2VPNType(l2vpn) for l2vpn in l2vpn_list]
+        self._positions = {id(l2vpn): i for i, l2vpn in enumerate(self.l2vpns)}
+        self._by_interface_id: dict[str, list[L2VPNType]] = defaultdict(list)
+        self._unattributed: list[L2VPNType] = list()
+        for l2vpn in self.l2vpns:
+            interface_ids = self._terminatingInterfaceIDs(l2vpn)
+            if not interface_ids:
+                self._unattributed.append(l2vpn)
+            for interface_id in interface_ids:
+                self._by_interface_id[interface_id].append(l2vpn)
+
+    @staticmethod
+    def _terminatingInterfaceIDs(l2vpn: L2VPNType) -> set[str]:
+        interfaces = []
+        for termination in l2vpn.getTerminations():
+            if isinstance(termination, InterfaceType):
+                interfaces.append(termination)
+            elif isinstance(termination, VLANType):
+                interfaces.extend(
+                    chain(
+                        termination.getInterfacesAsTagged(),
+                        termination.getInterfacesAsUntagged(),
+                    )
+                )
+        return {str(i.getID()) for i in interfaces if i.getID() is not None}
+
+    def viewFor(self, device) -> list[L2VPNType]:
+        # device may be raw Netbox data or converted. L2VPNs keep their order.
+        found = {id(l2vpn): l2vpn for l2vpn in self._unattributed} | {
+            id(l2vpn): l2vpn
+            for interface in device.get("interfaces", [])
+            for l2vpn in self._by_interface_id.get(str(interface.get("id")), [])
+        }
+        return sorted(found.values(), key=lambda l: self._positions[id(l)])
+
+    @staticmethod
+    def attachTo(device: DeviceType):
+        # terminations find the device being serialized with getParent()
+        for l2vpn in device.get("l2vpn_list", []):
+            l2vpn["__parent"] = device
@@ -5,6 +5,7 @@ from enum import StrEnum
 from itertools import chain
 from urllib.parse import urljoin
 
+from collections import defaultdict
 from collections.abc import Iterable
 from abc import abstractmethod, ABCMeta
 from ipaddress import IPv4Interface, IPv6Interface
@@ -28,7 +29,6 @@ from typing import (
     Any,
     Union,
     Optional,
-    TypeGuard,
     Callable,
     Protocol,
 )
@@ -46,20 +46,50 @@ ConnectionTerminationType = TypeVar(
 
 
 class AbstractNetboxType(abc.ABC, Iterable):
+    # every type of the hierarchy, by its Netbox type name. filled when the
+    # classes are created, so conversion does not have to look for them.
+    _typename_to_class: dict[str, type["AbstractNetboxType"]] = {}
+    # classes of the stores fields are kept in, by typename (see
+    # compact_types). types without one use a dict.
+    _store_classes: dict[str, type] | None = None
+    # nodes created from Netbox data, and already converted nodes conversion
+    # came across again and reused (see conversionCounts())
+    _conversion_counts: dict[str, int] = {"materialized": 0, "reused": 0}
+    # nearest ancestor by type of the nodes below a node, shared by them (see
+    # getParent()). kept with the parent epoch they were computed in, which
+    # changes whenever a node is moved below another parent.
+    _children_ancestors: tuple[int, dict[type, Any]] | None = None
+    _parent_epoch = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        typename, c = cls.register()
+        AbstractNetboxType._typename_to_class[typename] = c
+
     def __init__(self, *args, **kwargs):
-        self._store = dict()
+        AbstractNetboxType._conversion_counts["materialized"] += 1
+        self._store = self._newStore()
         self._store.update(*args)
         self._store.update(**kwargs)
+        # converting a converted node again: its children are reused, and
+        # moved below the new node
+        source = head(args)
+        if not isinstance(source, AbstractNetboxType):
+            source = None
         for k, v in without_keys(self._store, "__parent").items():
-            self[k] = self.convert(v)
+            self[k] = self.convert(v, source)
 
     def __getitem__(self, key):
         return self._store[key]
 
     def __setitem__(self, key, item):
+        if key == "__parent":
+            AbstractNetboxType._parent_epoch += 1
         self._store[key] = item
 
     def __delitem__(self, key):
+        if key == "__parent":
+            AbstractNetboxType._parent_epoch += 1
         del self._store[key]
 
     def __len__(self):
@@ -114,15 +144,17 @@ class AbstractNetboxType(abc.ABC, Iterable):
     def get(self, *args, **kwargs):
         return self._store.get(*args, **kwargs)
 
-    def convert(self, item):
-        if isinstance(item, dict):
+    def convert(self, item, replaced: Optional["AbstractNetboxType"] = None):
+        if isinstance(item, AbstractNetboxType):
+            # converted already. only nodes below the node self replaces are
+            # moved, other ones are references kept below their own parent.
+            AbstractNetboxType._conversion_counts["reused"] += 1
+            if replaced is not None and item.get("__parent") is replaced:
+                item["__parent"] = self
+            return item
+        elif isinstance(item, dict):
             if "__typename" in item.keys():
-                c = {
-                    k: v
-                    for k, v in [
-                        c.register() for c in AbstractNetboxType.__subclasses__()
-                    ]
-                }[item["__typename"]]
+                c = self.typeByName(item["__typename"])
                 o = c()
                 o._store.update(
                     {k: o.convert(v) for k, v in without_keys(item, "__parent").items()}
@@ -135,7 +167,7 @@ class AbstractNetboxType(abc.ABC, Iterable):
             replacement = []
             for i in item:
                 #                  self descending in tree
-                replacement.append(self.convert(i))
+                replacement.append(self.convert(i, replaced))
             return replacement
         else:
             return item
@@ -150,6 +182,32 @@ class AbstractNetboxType(abc.ABC, Iterable):
     def register(cls) -> tuple:
         return cls.getNetboxType(), cls
 
+    @classmethod
+    def useStoreClasses(cls, store_classes: dict[str, type] | None):
+        AbstractNetboxType._store_classes = store_classes
+
+    def _newStore(self):
+        store_classes = AbstractNetboxType._store_classes
+        if store_classes is not None:
+            store_class = store_classes.get(self.getNetboxType())
+            if store_class is not None:
+                return store_class()
+        return dict()
+
+    @staticmethod
+    def conversionCounts() -> dict[str, int]:
+        return dict(AbstractNetboxType._conversion_counts)
+
+    @staticmethod
+    def typeByName(typename: str) -> type["AbstractNetboxType"] | NoReturn:
+        c = AbstractNetboxType._typename_to_class.get(typename)
+        if c is None:
+            raise Exception(
+                f"Cannot convert Netbox data of unknown type {typename}. "
+                f"It has to be implemented as a subclass of AbstractNetboxType."
+            )
+        return c
+
     def hasParentAboveWithType(self, target_type: type[T]) -> bool:
         instance = self["__parent"]
         return type(instance) == target_type
@@ -158,21 +216,32 @@ class AbstractNetboxType(abc.ABC, Iterable):
         return "__parent" not in self.keys()
 
     def getParent(self, target_type: type[T]) -> T | NoReturn:
-        ke = KeyError(
+        parent = self.get("__parent")
+        if isinstance(parent, AbstractNetboxType):
+            instance = parent._ancestorsOfChildren().get(target_type)
+            if instance is not None:
+                return instance
+        raise KeyError(
             f"Cannot find any object above {type(self).__name__} which is of type {target_type.__name__}. "
             f"It is likely you made wrong assumptions regarding the shape of the Netbox input data, or "
             f"forgot to use hasParentAboveWithType()."
         )
-        if "__parent" not in self.keys():
-            raise ke
-        else:
-            instance = self["__parent"]
-            while type(instance) != target_type:
-                if "__parent" not in instance.keys():
-                    raise ke
-                else:
-                    instance = instance["__parent"]
-            return instance
+
+    def _ancestorsOfChildren(self) -> dict[type, Any]:
+        # computed once per node with children, then looked up in O(1)
+        epoch = AbstractNetboxType._parent_epoch
+        if self._children_ancestors is not None:
+            computed_in, ancestors = self._children_ancestors
+            if computed_in == epoch:
+                return ancestors
+        parent = self.get("__parent")
+        ancestors = (
+            parent._ancestorsOfChildren()
+            if isinstance(parent, AbstractNetboxType)
+            else dict()
+        ) | {type(self): self}
+        self._children_ancestors = (epoch, ancestors)
+        return ancestors
 
     def isUnderKeyNameForParentAboveWithType(
         self, key: str, target_type: type[T]
@@ -281,6 +350,77 @@ class DeviceType(AbstractNetboxType):
     def getInterfaces(self) -> list["InterfaceType"]:
         return self.get("interfaces", [])
 
+    # indexes of the interfaces, kept with the list they were built from
+    _interface_indexes: tuple[list, dict[str, dict]] | None = None
+
+    def _interfaceIndexes(self) -> dict[str, dict]:
+        # built on first use, and again if the interfaces are replaced. they
+        # match like the linear scans they replace did: names by value,
+        # interfaces, LAGs and VRFs by id, the first interface wins.
+        interfaces = self.getInterfaces()
+        if (
+            self._interface_indexes is not None
+            and self._interface_indexes[0] is interfaces
+        ):
+            return self._interface_indexes[1]
+        by_name: dict = dict()
+        by_id: dict = dict()
+        by_parent_name: dict = defaultdict(list)
+        by_lag_id: dict = defaultdict(list)
+        loopback_units_by_vrf_id: dict = defaultdict(list)
+        for i in interfaces:
+            by_name.setdefault(i.getName(), i)
+            if i.getID():
+                by_id.setdefault(i.getID(), i)
+            if i.isLagMember() and i.getAssociatedLagInterface().getID():
+                by_lag_id[i.getAssociatedLagInterface().getID()].append(i)
+            if not isinstance(i.getName(), str):
+                continue
+            if not i.isSubInterface():
+                continue
+            by_parent_name[i.getSubInterfaceParentInterfaceName()].append(i)
+            vrf = i.getVRF()
+            if i.getName().startswith("lo") and (vrf is None or vrf.getID()):
+                key = None if vrf is None else vrf.getID()
+                loopback_units_by_vrf_id[key].append(i)
+        indexes = {
+            "by_name": by_name,
+            "by_id": by_id,
+            "by_parent_name": by_parent_name,
+            "by_lag_id": by_lag_id,
+            "loopback_units_by_vrf_id": loopback_units_by_vrf_id,
+        }
+        self._interface_indexes = (interfaces, indexes)
+        return indexes
+
+    def getInterfaceByName(self, name: str | None) -> Optional["InterfaceType"]:
+        return self._interfaceIndexes()["by_name"].get(name)
+
+    def getInterfaceByID(self, interface_id) -> Optional["InterfaceType"]:
+        if not interface_id:
+            return None
+        return self._interfaceIndexes()["by_id"].get(interface_id)
+
+    def hasInterface(self, interface: "InterfaceType") -> bool:
+        return self.getInterfaceByID(interface.getID()) is not None
+
+    def getSubInterfaces(self, parent_name: str | None) -> list["InterfaceType"]:
+        return list(self._interfaceIndexes()["by_parent_name"].get(parent_name, []))
+
+    def getLagMembers(self, lag: "InterfaceType") -> list["InterfaceType"]:
+        if not lag.getID():
+            return []
+        return list(self._interfaceIndexes()["by_lag_id"].get(lag.getID(), []))
+
+    def getLoopbackUnitsByVRF(self, vrf: Optional["VRFType"]) -> list["InterfaceType"]:
+        if vrf is not None and not vrf.getID():
+            return []
+        return list(
+            self._interfaceIndexes()["loopback_units_by_vrf_id"].get(
+                None if vrf is None else vrf.getID(), []
+            )
+        )
+
     def getISISIdentifier(self) -> str | None | Never:
         sys_id: Any | None = self.getCustomFields().get("isis_system_id")
         if sys_id and not re.match(r"\d{4}.\d{4}.\d{4}", str(sys_id)):
@@ -566,20 +706,12 @@ class InterfaceType(
             return True
         return False
 
-    def getAllLagMembers(self) -> list[Self] | Never:
-        def lagMemberFilter(i: Self) -> TypeGuard[Self]:
-            return i.isLagMember() and i.getAssociatedLagInterface() == self
-
+    def getAllLagMembers(self) -> list["InterfaceType"] | Never:
         if not self.isLagInterface():
             raise InterfaceSerializationError(
                 "cannot find lag members for non-lag interface", on=self
             )
-        return list(
-            filter(
-                lagMemberFilter,
-                self.getParent(DeviceType).getInterfaces(),
-            )
-        )
+        return self.getParent(DeviceType).getLagMembers(self)
 
     def isSubInterface(self):
         return "." in self.getName()
@@ -599,13 +731,8 @@ class InterfaceType(
     def getPhysicalInterfaceByFilter(self) -> Optional["InterfaceType"]:
         if not self.isSubInterface():
             return self
-        return head(
-            list(
-                filter(
-                    lambda i: i.getName() == self.getSubInterfaceParentInterfaceName(),
-                    self.getParent(DeviceType).getInterfaces(),
-                )
-            )
+        return self.getParent(DeviceType).getInterfaceByName(
+            self.getSubInterfaceParentInterfaceName()
         )
 
     def getVRF(self) -> VRFType | None:
@@ -678,13 +805,8 @@ class InterfaceType(
             return True
         elif self.isSubInterface():
             parent_interface_name = self.getSubInterfaceParentInterfaceName()
-            parent_interface = head(
-                list(
-                    filter(
-                        lambda i: i.getName() == parent_interface_name,
-                        self.getParent(DeviceType).getInterfaces(),
-                    )
-                )
+            parent_interface = self.getParent(DeviceType).getInterfaceByName(
+                parent_interface_name
             )
             if not parent_interface:
                 raise InterfaceSerializationError(
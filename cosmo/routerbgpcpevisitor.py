@@ -165,12 +165,15 @@ class AbstractBgpCpeExporter(metaclass=ABCMeta):
             )
             return
 
-        parent_interface = next(
-            filter(
-                lambda interface: interface == linked_interface["parent"],
-                o.getParent(DeviceType).getInterfaces(),
-            )
+        parent_interface = o.getParent(DeviceType).getInterfaceByID(
+            linked_interface["parent"].getID()
         )
+        if parent_interface is None:
+            raise InterfaceSerializationError(
+                f"Cannot find parent interface of {linked_interface.getName()}, please ensure it is defined and that "
+                f"parent-child association is correct in data source.",
+                on=linked_interface,
+            )
         cpe = head(parent_interface.getConnectedEndpoints())
         if not cpe:
             warn(
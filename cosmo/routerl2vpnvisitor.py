@@ -84,7 +84,7 @@ class RouterL2VPNExporterVisitor(AbstractL2VPNVisitor):
         l2vpn_type = self.getL2VpnTypeTerminationObjectFrom(o.getParent(L2VPNType))
         # guard: processed l2vpn should have at least 1 termination belonging
         # to current device.
-        if o in o.getParent(DeviceType).getInterfaces():
+        if o.getParent(DeviceType).hasInterface(o):
             return l2vpn_type.processInterfaceTypeTermination(o)
 
     @accept.register
@@ -93,8 +93,8 @@ class RouterL2VPNExporterVisitor(AbstractL2VPNVisitor):
         # guard: processed l2vpn should have at least 1 termination belonging
         # to current device. if no termination passes the test, then l2vpn
         # is not processed.
-        device_interfaces = o.getParent(DeviceType).getInterfaces()
-        if any(i in device_interfaces for i in o.getInterfacesAsUntagged()) or any(
-            i in device_interfaces for i in o.getInterfacesAsTagged()
+        device = o.getParent(DeviceType)
+        if any(device.hasInterface(i) for i in o.getInterfacesAsUntagged()) or any(
+            device.hasInterface(i) for i in o.getInterfacesAsTagged()
         ):
             return l2vpn_type.processVLANTypeTermination(o)
@@ -644,15 +644,16 @@ class RouterDeviceExporterVisitor(AbstractRouterExporterVisitor, TVRFHelpers):
         ).get()
 
         interface = o.getParent(InterfaceType)
-        parent_interface = head(
-            list(
-                filter(  # as in, netbox parent
-                    lambda i: i.getName()
-                    == interface.getSubInterfaceParentInterfaceName(),
-                    interface.getParent(DeviceType).getInterfaces(),
-                )
-            )
+        # as in, netbox parent
+        parent_interface = interface.getParent(DeviceType).getInterfaceByName(
+            interface.getSubInterfaceParentInterfaceName()
         )
+        if parent_interface is None:
+            raise InterfaceSerializationError(
+                f"Cannot find parent interface of {interface.getName()}, please ensure it is defined and that "
+                f"parent-child association is correct in data source.",
+                on=interface,
+            )
 
         # Note:
         # The following code was developed by the pseudo code:
@@ -758,26 +759,22 @@ class RouterDeviceExporterVisitor(AbstractRouterExporterVisitor, TVRFHelpers):
         # Therefore, there is a unnumbered0 Tag for backwards compat and a unnumbered tag.
         # This method handles both of them, for unnumbered0 prefer_unit0 is true.
 
-        def loopback_filter_function(i, parent_interface: InterfaceType):
+        def loopback_filter_function(i):
 
             if prefer_unit0:
-                is_correct_unit = i.getUnitNumber() == 0
+                return i.getUnitNumber() == 0
             else:
-                is_correct_unit = i.getUnitNumber() != 0
-
-            return (
-                i.getName().startswith("lo")
-                and i.isSubInterface()
-                and i.getVRF() == parent_interface.getVRF()
-                and is_correct_unit
-            )
+                return i.getUnitNumber() != 0
 
         parent_interface = o.getParent(InterfaceType)
+        # loopback units in the VRF of the interface
         loopback_interface = head(
             list(
                 filter(
-                    lambda i: loopback_filter_function(i, parent_interface),
-                    parent_interface.getParent(DeviceType).getInterfaces(),
+                    loopback_filter_function,
+                    parent_interface.getParent(DeviceType).getLoopbackUnitsByVRF(
+                        parent_interface.getVRF()
+                    ),
                 )
             )
         )
@@ -12,8 +12,9 @@ from cosmo.common import (
     CosmoOutputType,
 )
 from cosmo.features import features
-from cosmo.log import error
+from cosmo.log import debug, error
 from cosmo.netbox_types import DeviceType, CosmoLoopbackType, AbstractNetboxType
+from cosmo.l2vpns import L2VPNGraph
 from cosmo.loopbacks import LoopbackHelper
 from cosmo.netbox_types import DeviceType, CosmoLoopbackType
 from cosmo.switchvisitor import SwitchDeviceExporterVisitor
@@ -21,8 +22,18 @@ from cosmo.routervisitor import RouterDeviceExporterVisitor
 
 
 class AbstractSerializer(metaclass=ABCMeta):
-    def __init__(self, device):
-        self.device = DeviceType(device)
+    def __init__(self, device, **fields):
+        counts_before = AbstractNetboxType.conversionCounts()
+        self.device = DeviceType(device, **fields)
+        counts = {
+            k: v - counts_before[k]
+            for k, v in AbstractNetboxType.conversionCounts().items()
+        }
+        debug(
+            f"converted {counts['materialized']} Netbox objects, "
+            f"reused {counts['reused']} converted ones",
+            self.device,
+        )
 
     @staticmethod
     def getMerger():
@@ -70,10 +81,14 @@ class AbstractSerializer(metaclass=ABCMeta):
 
 class RouterSerializer(AbstractSerializer):
     def __init__(self, device, l2vpn_list, loopbacks, cosmo_config):
-        super().__init__(device)
-        self.l2vpn_list = l2vpn_list
-        self.device["l2vpn_list"] = self.l2vpn_list
-        self.device = DeviceType(self.device)
+        # l2vpn_list is a list of L2VPNs or an L2VPNGraph. routers of a run
+        # share one graph (see get_l2vpn_graph())
+        if not isinstance(l2vpn_list, L2VPNGraph):
+            l2vpn_list = L2VPNGraph(l2vpn_list)
+        self.l2vpn_graph = l2vpn_list
+        super().__init__(device, l2vpn_list=self.l2vpn_graph.viewFor(device))
+        self.l2vpn_graph.attachTo(self.device)
+        self.l2vpn_list = self.device["l2vpn_list"]
         self.loopbacks = loopbacks
         self.cosmo_config = cosmo_config
 
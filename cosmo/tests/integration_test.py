@@ -1,5 +1,7 @@
 import json
 import re
+import threading
+import time
 from sharedmock.mock import SharedMock  # type: ignore
 from unittest.mock import call, ANY
 
@@ -10,10 +12,23 @@ import os
 
 import cosmo.tests.utils as utils
 from cosmo.__main__ import main as cosmoMain
+from cosmo.clients.netbox import NetboxClient
+from cosmo.config.cosmo_config import CosmoConfig
+from cosmo.daemon import CosmoDaemon, request_generation
+from cosmo.webhook import WebhookRegenerator, send_webhook
 from cosmo.common import FileTemplate
 from cosmo.features import with_feature, features, without_feature
 
 
+def wait_until(condition, timeout=5.0):
+    # fails instead of hanging when the condition never comes true
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail(f"timed out after {timeout} s waiting for {condition}")
+        time.sleep(0.01)
+
+
 def test_missing_config(mocker):
     utils.CommonSetup(mocker, cfgFile=None)
     with pytest.raises(Exception):
@@ -85,7 +100,7 @@ def test_device_processing_error(mocker, capsys):
 
 @with_feature(features, "interface-auto-descriptions")
 def test_autodesc_enabled(mocker):
-    device_query_template = FileTemplate("cosmo/clients/queries/device.graphql")
+    device_alias_template = FileTemplate("cosmo/clients/queries/device_alias.graphql")
     testEnv = utils.CommonSetup(mocker, cfgFile="cosmo/tests/cosmo.devgen_ansible.yml")
     rrm = utils.RequestResponseMock()
     get_mock = mocker.patch.object(rrm, "get_callback", new=SharedMock())
@@ -99,25 +114,24 @@ def test_autodesc_enabled(mocker):
     assert get_mock.call_count  # must be at least called once
     assert post_mock.call_count  # same as above
     assert call("https://netbox.example.com/api/status/", ANY) in get_mock.mock_calls
+    device_queries = [
+        c[1][0] for c in post_mock.mock_calls if "DeviceFields" in c[1][0]
+    ]
+    assert len(device_queries) == 1
     assert (
-        call(
-            device_query_template.substitute(
-                device='"TEST0001"',
-                autodesc_query_extension=FileTemplate(
-                    "cosmo/clients/queries/device_autodesc_query.graphql"
-                ).substitute(),
-            ),
-            ANY,
-        )
-        in post_mock.mock_calls
+        device_alias_template.substitute(alias="d0", device='"TEST0001"').strip()
+        in device_queries[0]
     )
+    # fields only needed to describe interfaces automatically
+    assert "link_peers" in device_queries[0]
+    assert "... on CircuitTerminationType" in device_queries[0]
 
     testEnv.stop()
 
 
 @without_feature(features, "interface-auto-descriptions")
 def test_autodesc_disabled(mocker):
-    device_query_template = FileTemplate("cosmo/clients/queries/device.graphql")
+    device_alias_template = FileTemplate("cosmo/clients/queries/device_alias.graphql")
     testEnv = utils.CommonSetup(mocker, cfgFile="cosmo/tests/cosmo.devgen_ansible.yml")
     rrm = utils.RequestResponseMock()
     get_mock = mocker.patch.object(rrm, "get_callback", new=SharedMock())
@@ -131,18 +145,17 @@ def test_autodesc_disabled(mocker):
     assert get_mock.call_count  # must be at least called once
     assert post_mock.call_count  # same as above
     assert call("https://netbox.example.com/api/status/", ANY) in get_mock.mock_calls
+    device_queries = [
+        c[1][0] for c in post_mock.mock_calls if "DeviceFields" in c[1][0]
+    ]
+    assert len(device_queries) == 1
     assert (
-        call(
-            device_query_template.substitute(
-                device='"TEST0001"',
-                autodesc_query_extension=FileTemplate(
-                    "cosmo/clients/queries/device_no_autodesc_query.graphql"
-                ).substitute(),
-            ),
-            ANY,
-        )
-        in post_mock.mock_calls
+        device_alias_template.substitute(alias="d0", device='"TEST0001"').strip()
+        in device_queries[0]
     )
+    # fields only needed to describe interfaces automatically
+    assert "link_peers" not in device_queries[0]
+    assert "... on CircuitTerminationType" not in device_queries[0]
 
     testEnv.stop()
 
@@ -152,3 +165,88 @@ def test_invalid_config_file(mocker, capsys):
     with pytest.raises(jsonschema.exceptions.ValidationError):
         cosmoMain()
     testEnv.stop()
+
+
+def test_daemon_generates_from_warm_data(mocker, tmp_path):
+    with open(f"cosmo/tests/test_case_l3vpn.yml") as f:
+        test_data = yaml.safe_load(f)
+    [_, postMock] = utils.RequestResponseMock().patchNetboxClient(mocker, **test_data)
+    daemon = CosmoDaemon(
+        NetboxClient(utils.CommonSetup.TEST_URL, utils.CommonSetup.TEST_TOKEN),
+        CosmoConfig("cosmo/tests/cosmo.devgen_ansible.yml"),
+    )
+    socket_path = tmp_path.joinpath("cosmo.sock")
+    server = threading.Thread(target=daemon.serve, args=(socket_path,))
+    server.start()
+    try:
+        wait_until(socket_path.exists)
+        posts_after_fetch = postMock.call_count
+
+        response = request_generation(socket_path, {"limit": ["TEST0001"]})
+        assert list(response["devices"].keys()) == ["test0001"]
+        assert response["output_format"] == "ansible"
+        assert request_generation(socket_path, {"limit": None}) == response
+        assert postMock.call_count == posts_after_fetch  # served from memory
+
+        testEnv = utils.CommonSetup(
+            mocker,
+            args=[utils.CommonSetup.PROGNAME, "--server", str(socket_path)],
+        )
+        assert cosmoMain() == 0
+        testEnv.stop()
+        assert os.path.isfile("host_vars/test0001/generated-cosmo.yml")
+
+        with pytest.raises(Exception, match="cannot be toggled per request"):
+            request_generation(
+                socket_path, {"features": {"interface-auto-descriptions": False}}
+            )
+    finally:
+        daemon.shutdown()
+        server.join()
+    assert not socket_path.exists()
+
+
+def test_webhook_regenerates_affected_devices(mocker):
+    with open(f"cosmo/tests/test_case_l3vpn.yml") as f:
+        test_data = yaml.safe_load(f)
+    [_, postMock] = utils.RequestResponseMock().patchNetboxClient(mocker, **test_data)
+    regenerator = WebhookRegenerator(
+        NetboxClient(utils.CommonSetup.TEST_URL, utils.CommonSetup.TEST_TOKEN),
+        CosmoConfig("cosmo/tests/cosmo.devgen_ansible.yml"),
+        secret="s3cret",
+        quiet_period=0.05,
+    )
+    listener = threading.Thread(target=regenerator.listen, args=("localhost", 0))
+    listener.start()
+    try:
+        wait_until(lambda: regenerator.port is not None)
+        url = f"http://localhost:{regenerator.port}/"
+        assert os.path.isfile("host_vars/test0001/generated-cosmo.yml")
+        os.remove("host_vars/test0001/generated-cosmo.yml")
+        interface_id = test_data["device_list"][0]["interfaces"][0]["id"]
+
+        # changes to objects of other devices, or not fetched at all
+        send_webhook(url, {"model": "site", "data": {"id": 1}}, secret="s3cret")
+        with pytest.raises(Exception, match="403"):
+            send_webhook(url, {"model": "interface", "data": {"id": interface_id}})
+        for not_an_object in [[], "x"]:
+            with pytest.raises(Exception, match="400"):
+                send_webhook(url, not_an_object, secret="s3cret")
+        # a burst of changes is one regeneration
+        for _ in range(3):
+            send_webhook(
+                url,
+                {
+                    "event": "updated",
+                    "model": "interface",
+                    "data": {"id": interface_id},
+                },
+                secret="s3cret",
+            )
+        wait_until(lambda: regenerator.regenerations >= 2)
+        time.sleep(0.1)
+        assert regenerator.regenerations == 2
+        assert os.path.isfile("host_vars/test0001/generated-cosmo.yml")
+    finally:
+        regenerator.shutdown()
+        listener.join()
@@ -1,21 +1,40 @@
-from unittest.mock import patch
+import json
+import re
+import threading
+import time
+from itertools import chain
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 from packaging.version import Version
 
 import cosmo.tests.utils as utils
+from cosmo.clients.batching import AdaptiveBatchSizer, chunked
+from cosmo.clients.concurrency import AIMDConcurrencyController
+from cosmo.clients.cache import DiskResponseCache, MemoryResponseCache
+from cosmo.clients.fetch_executor import FetchExecutorFactory, ThreadPoolFetchExecutor
+from cosmo.clients.incremental import ChangeImpactResolver
 from cosmo.clients.netbox import NetboxClient
-from cosmo.tests.utils import override_get_client_mp_context
+from cosmo.clients.netbox_client import NetboxAPIClient
+from cosmo.clients.netbox_session import NetboxSessionPool
+from cosmo.clients.merge_index import ResultIndex
+from cosmo.clients.metrics import FetchMetrics, query_scope
+from cosmo.clients.netbox_v4 import (
+    ConnectedDevicesDataQuery,
+    DeviceDataQuery,
+    DeviceMACQuery,
+    IPPoolDataQuery,
+    ParallelQuery,
+    StaticRouteQuery,
+    TobagoLineMembersDataQuery,
+)
+from cosmo.features import features, with_feature, without_feature
 
 TEST_URL = "https://netbox.example.com"
 TEST_TOKEN = "token123"
 TEST_DEVICE_CFG = {"router": ["router1", "router2"], "switch": ["switch1", "switch2"]}
 
 
-@patch(
-    "cosmo.clients.netbox_v4.get_client_mp_context",
-    new=override_get_client_mp_context("fork"),
-)
 def test_case_get_data(mocker):
     mockAnswer = {
         "device_list": [],
@@ -35,3 +54,872 @@ def test_case_get_data(mocker):
     # assert getMock.call_count == 1
     # assert postMock.call_count == 0
     assert responseData == mockAnswer
+
+
+def test_session_pool_reuses_session_per_worker():
+    sessions = NetboxSessionPool(TEST_TOKEN, pool_size=4)
+    s1 = sessions.getSession()
+    assert s1 is sessions.getSession()
+    assert s1.headers["Authorization"] == f"Token {TEST_TOKEN}"
+    assert s1.headers["Connection"] == "keep-alive"
+
+    other_worker_session = []
+    t = threading.Thread(
+        target=lambda: other_worker_session.append(sessions.getSession())
+    )
+    t.start()
+    t.join()
+    assert other_worker_session[0] is not s1
+    assert sessions.getReuseStatistics() == (0, 0)
+
+    # the session of the finished thread is closed once another one is opened
+    t = threading.Thread(target=sessions.getSession)
+    t.start()
+    t.join()
+    assert other_worker_session[0] not in sessions._sessions
+    assert len(sessions._sessions) == 2
+    sessions.close()
+
+
+def test_session_pool_without_keep_alive():
+    sessions = NetboxSessionPool(TEST_TOKEN, keep_alive=False)
+    assert sessions.getSession().headers["Connection"] == "close"
+
+
+def test_concurrency_controller_aimd():
+    controller = AIMDConcurrencyController(initial=4, maximum=8, latency_target=None)
+    for _ in range(5):
+        controller.release(controller.acquire(), overloaded=False)
+    assert int(controller.limit) == 5  # about one more per window of successes
+
+    started = [controller.acquire() for _ in range(5)]
+    for s in started:
+        controller.release(s, overloaded=True)
+    assert int(controller.limit) == 2  # halved once, not once per request
+    assert controller.decreases == 1
+    assert controller.max_in_flight == 5
+
+
+def test_session_pool_retries_overloaded_netbox(mocker):
+    responses = [utils.ResponseMock(429, {}), utils.ResponseMock(200, {"ok": True})]
+    getMock = mocker.patch("requests.Session.get", side_effect=responses)
+    mocker.patch.object(NetboxSessionPool, "RETRY_BACKOFF", 0)
+    sessions = NetboxSessionPool(TEST_TOKEN)
+
+    assert sessions.get(TEST_URL).json() == {"ok": True}
+    assert getMock.call_count == 2
+    assert sessions.retries == 1
+    assert sessions.concurrency.decreases == 1
+
+    # retries of concurrent requests are all counted
+    getMock.side_effect = lambda url, **kwargs: utils.ResponseMock(
+        429 if url.endswith("/retry") else 200, {}
+    )
+    with ThreadPoolFetchExecutor(8) as pool:
+        promises = [
+            pool.apply_async(sessions.get, args=(f"{TEST_URL}/retry",))
+            for _ in range(8)
+        ]
+        [p.get() for p in promises]
+    assert sessions.retries == 1 + 8 * NetboxSessionPool.MAX_RETRIES
+
+
+@pytest.mark.parametrize("executor", FetchExecutorFactory.getAllExecutorNames())
+def test_case_get_data_with_executor(mocker, executor):
+    utils.RequestResponseMock().patchNetboxClient(mocker)
+    nc = NetboxClient(TEST_URL, TEST_TOKEN, fetch_executor=executor)
+    assert nc.get_data(TEST_DEVICE_CFG) == {
+        "device_list": [],
+        "l2vpn_list": [],
+        "loopbacks": {},
+    }
+
+
+@pytest.mark.parametrize("executor", FetchExecutorFactory.getAllExecutorNames())
+def test_fetch_executor_nested_submission(executor):
+    # a single worker waiting on work it submitted itself must not deadlock
+    with FetchExecutorFactory(executor).get()(1) as pool:
+
+        def outer():
+            inner = [pool.apply_async(lambda x: x * 2, args=(i,)) for i in range(4)]
+            return sum(p.get() for p in inner)
+
+        assert pool.apply_async(outer).get(timeout=10) == 12
+
+
+def test_fetch_executor_propagates_errors():
+    def failing():
+        raise ValueError("boom")
+
+    with FetchExecutorFactory("thread").get()(2) as pool:
+        with pytest.raises(ValueError, match="boom"):
+            pool.apply_async(failing).get()
+
+
+def test_unknown_fetch_executor():
+    with pytest.raises(Exception, match="unknown fetch executor"):
+        FetchExecutorFactory("process").get()
+
+
+def test_device_query_is_batched(mocker):
+    devices = [
+        {
+            "__typename": "DeviceType",
+            "id": str(i),
+            "name": f"router{i}",
+            "interfaces": [],
+        }
+        for i in range(5)
+    ]
+    [_, postMock] = utils.RequestResponseMock().patchNetboxClient(
+        mocker, device_list=devices
+    )
+    nc = NetboxClient(
+        TEST_URL,
+        TEST_TOKEN,
+        device_batch={"size": 2, "auto_tune": False},
+    )
+    responseData = nc.get_data({"router": [d["name"] for d in devices], "switch": []})
+
+    assert [d["name"] for d in responseData["device_list"]] == [
+        d["name"] for d in devices
+    ]
+    device_queries = [
+        c.kwargs["json"]["query"]
+        for c in postMock.mock_calls
+        if "DeviceFields" in c.kwargs["json"]["query"]
+    ]
+    assert len(device_queries) == 3
+
+
+class SlowDeviceQueryMock(utils.RequestResponseMock):
+    def post_callback(self, k: str, v: utils.ResponseMock):
+        if "DeviceFields" in k:
+            time.sleep(0.1)
+
+
+def test_device_batches_are_fetched_concurrently(mocker):
+    devices = [
+        {
+            "__typename": "DeviceType",
+            "id": str(i),
+            "name": f"router{i}",
+            "interfaces": [],
+        }
+        for i in range(200)
+    ]
+    SlowDeviceQueryMock().patchNetboxClient(mocker, device_list=devices)
+    fetch_data = mocker.spy(ParallelQuery, "fetch_data")
+    nc = NetboxClient(
+        TEST_URL,
+        TEST_TOKEN,
+        concurrency={"initial": 32, "max": 32},
+        device_batch={"size": 5, "auto_tune": False},
+    )
+    nc.get_data({"router": [d["name"] for d in devices], "switch": []})
+
+    # workers waiting on batches do not take the place of batch requests. the
+    # queries sent per fetched device batch do not wait on anything.
+    waiting_queries = [
+        c
+        for c in fetch_data.call_args_list
+        if not isinstance(
+            c.args[0], (StaticRouteQuery, DeviceMACQuery, ConnectedDevicesDataQuery)
+        )
+    ]
+    assert nc.sessions.concurrency.max_in_flight > len(waiting_queries)
+
+
+@without_feature(features, "interface-auto-descriptions")
+def test_device_query_selects_fields_per_role():
+    router_query = DeviceDataQuery.buildQuery(["router1"], "router")
+    switch_query = DeviceDataQuery.buildQuery(["switch1"], "switch")
+
+    for field in ["vrf {", "primary_ip4 {", "connected_endpoints {"]:
+        assert field in router_query
+        assert field not in switch_query
+    assert "link_peers" not in router_query
+    assert "untagged_vlan {" in switch_query
+    assert router_query.count("... on InterfaceType") == 1
+
+
+def test_loopbacks_are_fetched_for_referenced_devices(mocker):
+    def l2vpn(name, *devices):
+        return {
+            "__typename": "L2VPNType",
+            "name": name,
+            "terminations": [
+                {
+                    "assigned_object": {
+                        "__typename": "InterfaceType",
+                        "device": {"__typename": "DeviceType", "id": i, "name": d},
+                    }
+                }
+                for i, d in devices
+            ],
+        }
+
+    [_, postMock] = utils.RequestResponseMock().patchNetboxClient(
+        mocker,
+        device_list=[
+            {"__typename": "DeviceType", "id": "1", "name": "router1", "interfaces": []}
+        ],
+        l2vpn_list=[
+            l2vpn("WAN: a", ("1", "router1"), ("2", "remote1")),
+            l2vpn("WAN: b", ("3", "remote2")),
+        ],
+    )
+    # configured names are matched case-insensitively by the device query
+    NetboxClient(TEST_URL, TEST_TOKEN).get_data({"router": ["Router1"], "switch": []})
+
+    loopback_queries = [
+        c.kwargs["json"]["query"]
+        for c in postMock.mock_calls
+        if 'starts_with: "lo"' in c.kwargs["json"]["query"]
+    ]
+    assert len(loopback_queries) == 1
+    assert 'device: ["remote1", "router1"]' in loopback_queries[0]  # 4.1 syntax
+
+
+def test_l2vpns_are_filtered_by_terminations(mocker):
+    [getMock, postMock] = utils.RequestResponseMock().patchNetboxClient(
+        mocker,
+        device_list=[
+            {
+                "__typename": "DeviceType",
+                "id": "1",
+                "name": "router1",
+                "interfaces": [
+                    {
+                        "__typename": "InterfaceType",
+                        "id": "10",
+                        "untagged_vlan": {"__typename": "VLANType", "id": "7"},
+                        "tagged_vlans": [],
+                    }
+                ],
+            }
+        ],
+        l2vpn_list=[{"__typename": "L2VPNType", "id": "3", "terminations": []}],
+    )
+    data = NetboxClient(TEST_URL, TEST_TOKEN).get_data(
+        {"router": ["Router1"], "switch": ["switch1"]}
+    )
+
+    termination_urls = [
+        c.args[0] for c in getMock.mock_calls if "l2vpn-terminations" in c.args[0]
+    ]
+    assert sorted(urlsplit(u).query for u in termination_urls) == [
+        "device_id=1",
+        "vlan_id=7",
+    ]
+    l2vpn_queries = [
+        c.kwargs["json"]["query"]
+        for c in postMock.mock_calls
+        if "l2vpn_list" in c.kwargs["json"]["query"]
+    ]
+    assert len(l2vpn_queries) == 1
+    assert 'id: ["3"]' in l2vpn_queries[0]
+    assert [l["id"] for l in data["l2vpn_list"]] == ["3"]
+
+
+class StaggeredDeviceQueryMock(utils.RequestResponseMock):
+    # the later the devices of a batch, the slower its answer
+    def __init__(self):
+        self.answered_device_queries = 0
+
+    def post_callback(self, k: str, v: utils.ResponseMock):
+        if "DeviceFields" in k:
+            time.sleep(0.005 * min(int(n) for n in re.findall(r"switch(\d+)", k)))
+            self.answered_device_queries += 1
+
+
+def test_iter_data_streams_device_batches(mocker):
+    devices = [
+        {
+            "__typename": "DeviceType",
+            "id": str(i),
+            "name": f"switch{i}",
+            "interfaces": [],
+        }
+        for i in range(100)
+    ]
+    mock = StaggeredDeviceQueryMock()
+    mock.patchNetboxClient(mocker, device_list=devices)
+    nc = NetboxClient(
+        TEST_URL,
+        TEST_TOKEN,
+        concurrency={"initial": 32, "max": 32},
+        device_batch={"size": 5, "auto_tune": False},
+    )
+
+    stream = nc.iter_data({"router": [], "switch": [d["name"] for d in devices]})
+    device, _ = next(stream)
+    # the first batch is merged and handed out while the others are fetched
+    assert mock.answered_device_queries < 20
+    assert "staticroute_set" in device and "pool_set" in device
+    assert len([device, *(d for d, _ in stream)]) == 100
+
+
+def test_iter_data_yields_devices_with_shared_data(mocker):
+    devices = [
+        {"__typename": "DeviceType", "id": str(i), "name": name, "interfaces": []}
+        for i, name in enumerate(["router1", "router2", "switch1"])
+    ]
+    utils.RequestResponseMock().patchNetboxClient(
+        mocker,
+        device_list=devices,
+        l2vpn_list=[],
+    )
+    device_cfg = {"router": ["router1", "router2"], "switch": ["switch1"]}
+
+    yielded = list(NetboxClient(TEST_URL, TEST_TOKEN).iter_data(device_cfg))
+    assert sorted(d["name"] for d, _ in yielded) == ["router1", "router2", "switch1"]
+    for device, shared in yielded:
+        if device["name"] in device_cfg["router"]:
+            # routers are only handed out once the shared queries are merged
+            assert "l2vpn_list" in shared and "loopbacks" in shared
+        assert device["staticroute_set"] == []
+        assert device["pool_set"] == []
+
+    data = NetboxClient(TEST_URL, TEST_TOKEN).get_data(device_cfg)
+    assert [d["name"] for d in data["device_list"]] == [
+        "router1",
+        "router2",
+        "switch1",
+    ]
+    assert data["device_list"] == sorted(
+        [d for d, _ in yielded], key=lambda d: d["name"]
+    )
+
+
+def test_connected_devices_and_macs_are_fetched_per_device_batch(mocker):
+    devices = [
+        {
+            "__typename": "DeviceType",
+            "id": str(i),
+            "name": f"router{i}",
+            "interfaces": [],
+        }
+        for i in range(60)
+    ]
+    [getMock, postMock] = utils.RequestResponseMock().patchNetboxClient(
+        mocker, device_list=devices
+    )
+    # looked up by the ids of the fetched devices, whatever the configured case
+    NetboxClient(
+        TEST_URL, TEST_TOKEN, device_batch={"size": 30, "auto_tune": False}
+    ).get_data({"router": [d["name"].upper() for d in devices], "switch": []})
+    device_batches = [
+        sorted(str(i) for i in range(0, 30)),
+        sorted(str(i) for i in range(30, 60)),
+    ]
+
+    # one request per fetched device batch, scoped to the devices of that batch
+    cd_queries = [
+        c.kwargs["json"]["query"]
+        for c in postMock.mock_calls
+        if "bgp_cpe" in c.kwargs["json"]["query"]
+    ]
+    assert len(cd_queries) == 2
+    assert all("device_id: [" in q for q in cd_queries)
+    assert sorted(
+        sorted(json.loads(q.split("device_id: ")[1].split("]")[0] + "]"))
+        for q in cd_queries
+    ) == sorted(device_batches)
+
+    mac_queries = [
+        parse_qs(urlsplit(c.args[0]).query)
+        for c in getMock.mock_calls
+        if "/api/dcim/interfaces" in c.args[0]
+    ]
+    assert len(mac_queries) == 2
+    assert sorted(sorted(q["device_id"]) for q in mac_queries) == sorted(device_batches)
+    assert all(q["fields"] == [DeviceMACQuery.FIELDS] for q in mac_queries)
+
+
+def test_result_index():
+    pools = [
+        {"id": 1, "devices": [{"id": 1}, {"id": 2}, {"id": 1}]},
+        {"id": 2, "devices": [{"id": 2}]},
+    ]
+    index = ResultIndex(
+        pools, key=lambda p: [pd["id"] for pd in p["devices"]], multi=True
+    )
+    assert [p["id"] for p in index.all(2)] == [1, 2]
+    assert [p["id"] for p in index.all(1)] == [1]  # once, even if listed twice
+    assert index.first(3) is None and index.last(2)["id"] == 2
+
+
+def tobago_termination(termination_type: str, id: int, device_id=None) -> dict:
+    termination: dict = {"id": id}
+    if device_id is not None:
+        termination["device"] = {"id": device_id}
+    return {"termination_type": termination_type, "termination": termination}
+
+
+def test_indexed_merges(mocker):
+    def data():
+        return {
+            "device_list": [
+                {"id": "1", "interfaces": [{"id": "10"}, {"id": "11"}]},
+                {"id": "2", "interfaces": [{"id": "20"}]},
+            ]
+        }
+
+    def merge(query, query_result):
+        promise = mocker.Mock(get=lambda: query_result)
+        return query.merge_into(promise, data())
+
+    merged = merge(
+        DeviceMACQuery(None),
+        [
+            {
+                "id": 11,
+                "device": {"id": 1},
+                "primary_mac_address": {"mac_address": "00:00:5e:00:53:01"},
+            }
+        ],
+    )
+    assert [
+        i["mac_address"] for d in merged["device_list"] for i in d["interfaces"]
+    ] == [
+        None,
+        "00:00:5e:00:53:01",
+        None,
+    ]
+
+    pool_query = IPPoolDataQuery(None)
+    pools = [{"id": 5, "devices": [{"id": 2}]}]
+    merged = merge(pool_query, pools)
+    assert [len(d["pool_set"]) for d in merged["device_list"]] == [0, 1]
+    # the result is indexed once, not once per merged batch of devices
+    index = mocker.spy(pool_query, "_index")
+    merge(pool_query, pools)
+    assert index.call_count == 0
+
+    merged = merge(
+        TobagoLineMembersDataQuery(None),
+        [
+            {
+                "line": "l1",
+                "terminations": [tobago_termination("dcim.interface", 10, 1)],
+            },
+            {
+                "line": "l2",
+                "terminations": [tobago_termination("dcim.interface", 20, 2)],
+            },
+            # only interfaces of the device itself are attached
+            {
+                "line": "l3",
+                "terminations": [tobago_termination("dcim.interface", 11, 2)],
+            },
+            {
+                "line": "l4",
+                "terminations": [
+                    tobago_termination("circuits.circuittermination", 11),
+                    tobago_termination("dcim.frontport", 11, 1),
+                ],
+            },
+        ],
+    )
+    assert [
+        (i["attached_tobago_line"] or {}).get("line")
+        for d in merged["device_list"]
+        for i in d["interfaces"]
+    ] == ["l1", None, "l2"]
+
+
+@with_feature(features, "interface-auto-descriptions")
+def test_tobago_line_members_are_fetched_in_bulk(mocker):
+    devices = [f"router{i}" for i in range(60)]
+    [getMock, _] = utils.RequestResponseMock().patchNetboxClient(mocker)
+    NetboxClient(TEST_URL, TEST_TOKEN).get_data({"router": devices, "switch": []})
+
+    tobago_urls = [c.args[0] for c in getMock.mock_calls if "tobago" in c.args[0]]
+    assert len(tobago_urls) == 1  # a single page in this mock
+    assert urlsplit(tobago_urls[0]).path == "/api/plugins/tobago/line-members/"
+
+
+def test_batch_sizer_stays_within_budget():
+    sizer = AdaptiveBatchSizer(
+        size=10, max_size=500, response_budget_bytes=100_000, latency_budget=2.0
+    )
+    assert sizer.nextSize() == 10
+    # 10 devices answered with 50 kB in 0.1 s: bytes are the constraint
+    sizer.record(10, 50_000, 0.1)
+    assert sizer.nextSize() == 20
+    assert AdaptiveBatchSizer(size=3, auto_tune=False).nextSize() == 3
+    assert chunked([1, 2, 3, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+
+
+def test_back_to_back_runs_use_disk_cache(mocker, tmp_path):
+    devices = [
+        {"__typename": "DeviceType", "id": "1", "name": "router1", "interfaces": []}
+    ]
+    [_, postMock] = utils.RequestResponseMock().patchNetboxClient(
+        mocker, device_list=devices
+    )
+    device_cfg = {"router": ["router1"], "switch": []}
+
+    first = NetboxClient(TEST_URL, TEST_TOKEN, cache_dir=tmp_path).get_data(device_cfg)
+    posts_after_first_run = postMock.call_count
+    assert posts_after_first_run > 0
+
+    second = NetboxClient(TEST_URL, TEST_TOKEN, cache_dir=tmp_path).get_data(device_cfg)
+    assert second == first
+    assert postMock.call_count == posts_after_first_run
+
+
+class LastUpdatedResponseMock(utils.RequestResponseMock):
+    def __init__(self, last_updated: dict[str, str]):
+        self.last_updated = last_updated
+
+    def get_callback(self, k: str, v: utils.ResponseMock):
+        if "ordering=-last_updated" not in k:
+            return
+        path = urlsplit(k).path
+        v.obj = {
+            "count": 1,
+            "next": None,
+            "results": [{"last_updated": self.last_updated.get(path, "2025-01-01")}],
+        }
+        v.text = json.dumps(v.obj)
+        v.content = v.text.encode()
+
+
+def test_mac_address_change_invalidates_disk_cache(mocker, tmp_path):
+    devices = [
+        {"__typename": "DeviceType", "id": "1", "name": "router1", "interfaces": []}
+    ]
+    last_updated: dict[str, str] = dict()
+    [_, postMock] = LastUpdatedResponseMock(last_updated).patchNetboxClient(
+        mocker, device_list=devices
+    )
+    device_cfg = {"router": ["router1"], "switch": []}
+
+    NetboxClient(TEST_URL, TEST_TOKEN, cache_dir=tmp_path).get_data(device_cfg)
+    posts_after_first_run = postMock.call_count
+    NetboxClient(TEST_URL, TEST_TOKEN, cache_dir=tmp_path).get_data(device_cfg)
+    assert postMock.call_count == posts_after_first_run
+
+    last_updated["/api/dcim/mac-addresses/"] = "2025-02-01"
+    NetboxClient(TEST_URL, TEST_TOKEN, cache_dir=tmp_path).get_data(device_cfg)
+    assert postMock.call_count == 2 * posts_after_first_run
+
+
+def test_record_and_replay_snapshot(mocker, tmp_path):
+    devices = [
+        {"__typename": "DeviceType", "id": "1", "name": "router1", "interfaces": []}
+    ]
+    [getMock, postMock] = utils.RequestResponseMock().patchNetboxClient(
+        mocker, device_list=devices
+    )
+    device_cfg = {"router": ["router1"], "switch": []}
+    snapshot = tmp_path.joinpath("snapshot.tar.gz")
+
+    recorded = NetboxClient(TEST_URL, TEST_TOKEN, record=snapshot).get_data(device_cfg)
+    assert snapshot.exists()
+    calls = getMock.call_count + postMock.call_count
+
+    replayed = NetboxClient(None, None, replay=snapshot).get_data(device_cfg)
+    assert replayed == recorded
+    assert getMock.call_count + postMock.call_count == calls
+
+    with pytest.raises(Exception, match="not found in snapshot"):
+        NetboxClient(None, None, replay=snapshot).get_data(
+            {"router": ["router2"], "switch": []}
+        )
+
+
+def test_replay_snapshot_of_several_batches(mocker, tmp_path):
+    devices = [
+        {
+            "__typename": "DeviceType",
+            "id": str(i),
+            "name": f"router{i}",
+            "interfaces": [],
+        }
+        for i in range(8)
+    ]
+    # auto-tuned, batches would grow with the lower latency of the replay
+    device_batch = {"size": 2, "max_size": 8, "latency_budget": 0.2}
+    device_cfg = {"router": [d["name"] for d in devices], "switch": []}
+    snapshot = tmp_path.joinpath("snapshot.tar.gz")
+
+    SlowDeviceQueryMock().patchNetboxClient(mocker, device_list=devices)
+    recorded = NetboxClient(
+        TEST_URL, TEST_TOKEN, device_batch=device_batch, record=snapshot
+    ).get_data(device_cfg)
+    assert len(recorded["device_list"]) == 8
+
+    replayed = NetboxClient(
+        None, None, device_batch=device_batch, replay=snapshot
+    ).get_data(device_cfg)
+    assert replayed == recorded
+
+
+def test_memory_cache_eviction_and_counters():
+    cache = MemoryResponseCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")  # over budget, b was used least recently
+    assert cache.get("b") is None
+    assert cache.get("c") == b"cccc"
+    cache.put("d", b"d" * 11)  # larger than the whole cache
+    assert cache.get("d") is None
+    assert (cache.hits, cache.misses, cache.bytes, cache.evictions) == (2, 2, 8, 1)
+
+
+def test_disk_cache_revalidation_and_eviction(tmp_path):
+    cache = DiskResponseCache(tmp_path, max_bytes=400)
+    cache.put("a", b"not stored, nothing to revalidate against")
+    assert cache.get("a") is None
+
+    cache.revalidate("fingerprint-1")
+    cache.put("a", b"A")
+    assert cache.get("a") == b"A"
+
+    cache.revalidate("fingerprint-2")  # netbox data changed in between
+    assert cache.get("a") is None
+
+    for key in ["b", "c", "d"]:
+        cache.put(key, key.encode() * 50)
+    cache.get("c")
+    cache.put("e", b"E" * 50)
+    assert cache.get("b") is None  # least recently used went first
+    assert cache.get("e") == b"E" * 50
+    assert sum(f.stat().st_size for f in tmp_path.glob("*.json")) <= 400
+
+
+class ChangelogResponseMock(utils.RequestResponseMock):
+    def __init__(self, changes: list[dict]):
+        self.changes = changes
+
+    def get_callback(self, k: str, v: utils.ResponseMock):
+        if "object-changes" not in k:
+            return
+        queries = {q: v[0] for q, v in parse_qs(urlsplit(k).query).items()}
+        results = sorted(self.changes, key=lambda c: c["id"])
+        if "id" in queries:
+            results = [c for c in results if c["id"] == int(queries["id"])]
+        if "id__gt" in queries:
+            results = [c for c in results if c["id"] > int(queries["id__gt"])]
+        if "id__lte" in queries:
+            results = [c for c in results if c["id"] <= int(queries["id__lte"])]
+        if queries.get("ordering") == "-id":
+            results.reverse()
+        v.obj = {"count": len(results), "next": None, "results": results}
+        v.text = json.dumps(v.obj)
+        v.content = v.text.encode()
+
+
+def test_change_impact_resolver():
+    resolver = ChangeImpactResolver(
+        {
+            "device_list": [
+                {
+                    "__typename": "DeviceType",
+                    "id": "1",
+                    "name": "router1",
+                    "interfaces": [{"__typename": "InterfaceType", "id": "10"}],
+                },
+                {"__typename": "DeviceType", "id": "2", "name": "router2"},
+            ]
+        }
+    )
+    assert resolver.affectedDevices("dcim.interface", 10, []) == {"router1"}
+    assert resolver.affectedDevices("dcim.interface", 11, [{"device": 2}]) == {
+        "router2"
+    }
+    assert resolver.affectedDevices("dcim.site", 1, []) == set()
+    assert resolver.affectedDevices("dcim.platform", 1, []) is None
+    # models cosmo fetches but the resolver does not know are unresolvable
+    assert resolver.affectedDevices("dcim.cable", 1, [{"status": "planned"}]) is None
+    assert resolver.affectedDevices("circuits.circuit", 1, []) is None
+
+    mac = {"assigned_object_type": "dcim.interface", "assigned_object_id": 10}
+    assert resolver.affectedDevices("dcim.macaddress", 3, [None, mac]) == {"router1"}
+    pool = {"name": "pool1", "devices": [2]}
+    assert resolver.affectedDevices(
+        "netbox_plugin_ip_pools.ippool", 4, [pool, pool | {"devices": [1, 2]}]
+    ) == {"router1", "router2"}
+
+    # remote endpoints are fetched with their ids
+    remote = ChangeImpactResolver(
+        {
+            "device_list": [
+                {
+                    "__typename": "DeviceType",
+                    "id": "1",
+                    "name": "router1",
+                    "interfaces": [
+                        {
+                            "__typename": "InterfaceType",
+                            "id": "10",
+                            "connected_endpoints": [
+                                {
+                                    "__typename": "InterfaceType",
+                                    "id": "30",
+                                    "name": "eth0",
+                                    "device": {
+                                        "__typename": "DeviceType",
+                                        "id": "3",
+                                        "name": "cpe1",
+                                    },
+                                }
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+    )
+    assert remote.affectedDevices("dcim.interface", 30, []) == {"router1"}
+    assert remote.affectedDevices("dcim.device", 3, []) == {"router1"}
+
+    webhook = {"event": "updated", "model": "ipaddress", "data": {"id": 5}}
+    webhook["data"] |= {"assigned_object_type": "dcim.interface"}
+    webhook["data"] |= {"assigned_object_id": 10}
+    assert resolver.affectedDevicesByWebhook(webhook) == {"router1"}
+    assert resolver.affectedDevicesByWebhook(
+        {
+            "event": "deleted",
+            "model": "interface",
+            "data": {"id": 12, "device": {"id": 2, "name": "router2"}},
+            "snapshots": {"prechange": {"device": 2}, "postchange": None},
+        }
+    ) == {"router2"}
+    assert resolver.affectedDevicesByWebhook({"model": "site", "data": {}}) == set()
+    assert resolver.affectedDevicesByWebhook({"model": "platform", "data": {}}) is None
+    assert resolver.affectedDevicesByWebhook({"model": "cable", "data": {}}) is None
+    assert resolver.affectedDevicesByWebhook({"model": "unknown", "data": {}}) is None
+    assert resolver.affectedDevicesByWebhook(
+        {"model": "macaddress", "data": {"id": 3} | mac}
+    ) == {"router1"}
+    assert resolver.affectedDevicesByWebhook(
+        {"model": "ippool", "data": {"id": 4, "devices": [{"id": 2, "name": "x"}]}}
+    ) == {"router2"}
+
+
+def test_incremental_run_only_refetches_changed_devices(mocker, tmp_path):
+    devices = [
+        {
+            "__typename": "DeviceType",
+            "id": str(i),
+            "name": f"router{i}",
+            "interfaces": [{"__typename": "InterfaceType", "id": str(10 + i)}],
+        }
+        for i in range(3)
+    ]
+    changes = [{"id": 1, "changed_object_type": "dcim.site", "changed_object_id": 1}]
+    [_, postMock] = ChangelogResponseMock(changes).patchNetboxClient(
+        mocker, device_list=devices
+    )
+    device_cfg = {"router": [d["name"] for d in devices], "switch": []}
+    state_file = tmp_path.joinpath("state.json")
+
+    first = NetboxClient(TEST_URL, TEST_TOKEN, incremental_state=state_file).get_data(
+        device_cfg
+    )
+    assert state_file.exists()
+
+    changes.append(
+        {"id": 2, "changed_object_type": "dcim.interface", "changed_object_id": 11}
+    )
+    postMock.reset_mock()
+    second = NetboxClient(TEST_URL, TEST_TOKEN, incremental_state=state_file).get_data(
+        device_cfg
+    )
+
+    assert second["device_list"] == first["device_list"]
+    device_queries = [
+        c.kwargs["json"]["query"]
+        for c in postMock.mock_calls
+        if "DeviceFields" in c.kwargs["json"]["query"]
+    ]
+    assert len(device_queries) == 1
+    assert '"router1"' in device_queries[0]
+    assert '"router0"' not in device_queries[0]
+
+
+class PaginatedResponseMock(utils.RequestResponseMock):
+    def __init__(self, objects: list[dict]):
+        self.objects = objects
+
+    def get_callback(self, k: str, v: utils.ResponseMock):
+        queries = {q: v[0] for q, v in parse_qs(urlsplit(k).query).items()}
+        offset, limit = int(queries.get("offset", 0)), int(queries.get("limit", 2))
+        has_next = offset + limit < len(self.objects)
+        v.obj = {
+            "count": len(self.objects),
+            "next": f"{k}&offset={offset + limit}" if has_next else None,
+            "results": self.objects[offset : offset + limit],
+        }
+        v.text = json.dumps(v.obj)
+        v.content = v.text.encode()
+
+
+def test_query_rest_fetches_pages_concurrently(mocker):
+    objects = [{"id": i} for i in range(10)]
+    [getMock, _] = PaginatedResponseMock(objects).patchNetboxClient(mocker)
+    client = NetboxAPIClient(
+        TEST_URL,
+        NetboxSessionPool(TEST_TOKEN),
+        MemoryResponseCache(),
+        page_sizes={"/api/dcim/interfaces/": 3},
+        max_inflight_pages=2,
+    )
+    with ThreadPoolFetchExecutor(4) as pool:
+        result = client.query_rest("api/dcim/interfaces/", {"device": ["a"]}, pool)
+
+    assert result == objects
+    urls = [c.args[0] for c in getMock.mock_calls]
+    assert len(urls) == 4
+    assert all("limit=3" in u and "device=a" in u for u in urls)
+    # without page size setting, netbox picks it (2 in this mock)
+    assert client.query_rest("api/dcim/devices/", {}) == objects
+
+
+def test_fetch_metrics_are_attributed_to_query_scope(mocker):
+    objects = [{"id": i} for i in range(10)]
+    PaginatedResponseMock(objects).patchNetboxClient(mocker)
+    metrics = FetchMetrics()
+    client = NetboxAPIClient(
+        TEST_URL, NetboxSessionPool(TEST_TOKEN), MemoryResponseCache(), metrics=metrics
+    )
+    with ThreadPoolFetchExecutor(4) as pool:
+        with query_scope(metrics, "SomeQuery"):
+            promise = pool.apply_async(
+                client.query_rest, args=("api/dcim/interfaces/", {}, pool)
+            )
+        promise.get()
+        # served from the memory cache, outside of any scope
+        client.query_rest("api/dcim/interfaces/", {}, pool)
+
+    report = metrics.toDict()
+    assert list(report["queries"].keys()) == ["SomeQuery"]
+    some_query = report["queries"]["SomeQuery"]
+    assert some_query["requests"] == 5
+    assert some_query["pages"] == 5
+    assert some_query["memory_cache_hits"] == 0
+    assert some_query["tasks"] == 5  # query_rest and its 4 offset pages
+    assert some_query["response_bytes"] > 0
+    assert report["total"]["requests"] == 5
+
+
+def test_fetch_report(mocker, tmp_path):
+    devices = [
+        {"__typename": "DeviceType", "id": "1", "name": "router1", "interfaces": []}
+    ]
+    utils.RequestResponseMock().patchNetboxClient(mocker, device_list=devices)
+    report_file = tmp_path.joinpath("report.json")
+    NetboxClient(TEST_URL, TEST_TOKEN, fetch_report=report_file).get_data(
+        {"router": ["router1"], "switch": []}
+    )
+
+    with open(report_file) as f:
+        report = json.load(f)
+    assert report["queries"]["DeviceDataQuery"]["requests"] >= 1
+    assert report["queries"]["DeviceMACQuery"]["pages"] == 1
+    assert report["total"]["tasks"] >= len(report["queries"])
@@ -5,10 +5,18 @@ import pytest
 import copy
 
 from cosmo.common import DeviceSerializationError
+from cosmo.compact_types import disable_compact_types, enable_compact_types
 from cosmo.config.cosmo_config import CosmoConfig
 from cosmo.features import with_feature, features, without_feature
+from cosmo.l2vpns import L2VPNGraph
 from cosmo.manufacturers import ManufacturerFactoryFromDevice
-from cosmo.netbox_types import DeviceType, VRFType
+from cosmo.netbox_types import (
+    AbstractNetboxType,
+    DeviceType,
+    InterfaceType,
+    VLANType,
+    VRFType,
+)
 
 from coverage.html import os
 
@@ -1108,3 +1116,186 @@ def test_switch_interface_fec(capsys):
     assert sd["cumulus__device_interfaces"]["swp1"]["fec"] == "rs"
     assert sd["cumulus__device_interfaces"]["swp2"]["fec"] == "baser"
     assert sd["cumulus__device_interfaces"]["swp3"]["fec"] == "off"
+
+
+def test_netbox_type_registry():
+    class IndirectVRFType(VRFType):
+        # not a direct subclass of AbstractNetboxType
+        pass
+
+    try:
+        device = DeviceType(
+            {
+                "__typename": "DeviceType",
+                "name": "router1",
+                "interfaces": [
+                    {
+                        "__typename": "InterfaceType",
+                        "name": "et-0/0/0",
+                        "vrf": {"__typename": "IndirectVRFType", "name": "vrf1"},
+                    }
+                ],
+            }
+        )
+        assert type(device["interfaces"][0]["vrf"]) is IndirectVRFType
+    finally:
+        # registered for good by defining it, other tests must not see it
+        del AbstractNetboxType._typename_to_class["IndirectVRFType"]
+
+    with pytest.raises(Exception, match="unknown type NoSuchType"):
+        DeviceType({"interfaces": [{"__typename": "NoSuchType"}]})
+    with pytest.raises(Exception, match="unknown type IndirectVRFType"):
+        DeviceType({"interfaces": [{"__typename": "IndirectVRFType"}]})
+
+
+@pytest.mark.parametrize(
+    "router_case,switch_case",
+    [
+        ("test_case_l3vpn.yml", "test_case_switch_vlan.yaml"),
+        ("test_case_vpws.yaml", "test_case_switch_lag.yaml"),
+        ("test_case_auto_descriptions.yaml", "test_case_switch_auto_description.yaml"),
+    ],
+)
+def test_compact_types_serialize_like_dicts(router_case, switch_case):
+    expected = get_router_sd_from_path(router_case), get_switch_sd_from_path(
+        switch_case
+    )
+    enable_compact_types()
+    try:
+        device = DeviceType(_yaml_load(router_case)["device_list"][0])
+        assert type(device._store).__name__ == "CompactDeviceTypeStore"
+        assert [i.getName() for i in device.getInterfaces()] == [
+            i["name"] for i in _yaml_load(router_case)["device_list"][0]["interfaces"]
+        ]
+        assert (
+            get_router_sd_from_path(router_case),
+            get_switch_sd_from_path(switch_case),
+        ) == expected
+    finally:
+        disable_compact_types()
+
+
+def test_conversion_reuses_converted_nodes():
+    device = DeviceType(
+        {
+            "__typename": "DeviceType",
+            "name": "router1",
+            "interfaces": [{"__typename": "InterfaceType", "name": "et-0/0/0"}],
+        }
+    )
+    interface = device["interfaces"][0]
+    counts_before = DeviceType.conversionCounts()
+    rewrapped = DeviceType(device, l2vpn_list=[{"__typename": "L2VPNType"}])
+    counts = DeviceType.conversionCounts()
+
+    # only the new device and the L2VPN are materialized
+    assert counts["materialized"] - counts_before["materialized"] == 2
+    assert counts["reused"] - counts_before["reused"] == 1
+    assert rewrapped["interfaces"][0] is interface
+    assert interface.getParent(DeviceType) is rewrapped
+    assert rewrapped["l2vpn_list"][0]["__parent"] is rewrapped
+
+    # converted nodes merely referenced keep their parent
+    vrf = VRFType({"interfaces": [interface]})
+    assert vrf["interfaces"][0] is interface
+    assert interface.getParent(DeviceType) is rewrapped
+
+
+def test_routers_share_l2vpn_graph():
+    test_data = _yaml_load("./test_case_vpws.yaml")
+    elsewhere = copy.deepcopy(test_data["l2vpn_list"][0])
+    elsewhere["id"] = "99999"
+    for termination in elsewhere["terminations"]:
+        termination["assigned_object"]["id"] = "99999"
+    l2vpn_list = test_data["l2vpn_list"] + [elsewhere]
+
+    def serializer(device, l2vpns):
+        return RouterSerializer(
+            device=copy.deepcopy(device),
+            l2vpn_list=l2vpns,
+            loopbacks=test_data["loopbacks"],
+            cosmo_config=mock_cosmo_config(),
+        )
+
+    expected = [serializer(d, l2vpn_list).serialize() for d in test_data["device_list"]]
+    graph = L2VPNGraph(l2vpn_list)
+    for device, expected_config in zip(test_data["device_list"], expected):
+        # routers sharing the graph are serialized one after the other
+        assert graph.viewFor(device) == graph.l2vpns[:1]
+        rs = serializer(device, graph)
+        assert rs.device["l2vpn_list"][0] is graph.l2vpns[0]
+        assert graph.l2vpns[0].getParent(DeviceType) is rs.device
+        assert rs.serialize() == expected_config
+
+
+def test_get_parent_uses_ancestor_maps():
+    device = DeviceType(
+        {
+            "__typename": "DeviceType",
+            "name": "router1",
+            "interfaces": [
+                {
+                    "__typename": "InterfaceType",
+                    "name": "et-0/0/0",
+                    "vrf": {"__typename": "VRFType", "name": "vrf1"},
+                }
+            ],
+        }
+    )
+    interface = device["interfaces"][0]
+    vrf = interface["vrf"]
+    assert vrf.getParent(InterfaceType) is interface
+    assert vrf.getParent(DeviceType) is device
+    with pytest.raises(KeyError, match="above VRFType which is of type VLANType"):
+        vrf.getParent(VLANType)
+    with pytest.raises(KeyError, match="above DeviceType which is of type DeviceType"):
+        device.getParent(DeviceType)
+
+    # maps computed before a node is moved below another parent are not used
+    other = DeviceType({"__typename": "DeviceType", "name": "router2"})
+    interface["__parent"] = other
+    assert vrf.getParent(DeviceType) is other
+    del interface["__parent"]
+    with pytest.raises(KeyError):
+        vrf.getParent(DeviceType)
+
+
+def test_device_interface_indexes():
+    def interface(i, name, **fields):
+        return {"__typename": "InterfaceType", "id": str(i), "name": name, **fields}
+
+    vrf = {"__typename": "VRFType", "id": "7", "name": "vrf1"}
+    device = DeviceType(
+        {
+            "__typename": "DeviceType",
+            "name": "router1",
+            "interfaces": [
+                interface(1, "et-0/0/1"),
+                interface(2, "et-0/0/1.100"),
+                interface(3, "et-0/0/10.100"),
+                interface(4, "ae0", type="lag"),
+                interface(5, "et-0/0/2", lag=interface(4, "ae0")),
+                interface(6, "lo-0/0/0.0"),
+                interface(7, "lo-0/0/0.1", vrf=vrf),
+                interface(8, "lo-0/0/0.2", vrf=vrf),
+            ],
+        }
+    )
+    et1, et1_100, et10_100, ae0, et2, lo0, lo1, lo2 = device.getInterfaces()
+
+    assert device.getInterfaceByName("et-0/0/1") is et1
+    assert device.getInterfaceByName("et-0/0/3") is None
+    assert et1_100.getPhysicalInterfaceByFilter() is et1
+    assert device.getInterfaceByID("5") is et2
+    assert device.hasInterface(InterfaceType({"id": "5"}))
+    assert not device.hasInterface(InterfaceType({"name": "et-0/0/2"}))
+    # sub-units of et-0/0/10 are not sub-units of et-0/0/1
+    assert device.getSubInterfaces("et-0/0/1") == [et1_100]
+    assert ae0.getAllLagMembers() == [et2]
+    assert device.getLoopbackUnitsByVRF(None) == [lo0]
+    assert device.getLoopbackUnitsByVRF(lo1.getVRF()) == [lo1, lo2]
+
+    # replaced interfaces are indexed again
+    device["interfaces"] = device.convert([interface(9, "et-0/0/3")])
+    assert device.getInterfaceByName("et-0/0/1") is None
+    assert device.getInterfaceByName("et-0/0/3").getID() == "9"
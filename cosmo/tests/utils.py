@@ -1,12 +1,5 @@
 import json
-import multiprocessing
-
-
-def override_get_client_mp_context(method=None):
-    def overriden_get_client_mp_context():
-        return multiprocessing.get_context(method=method)
-
-    return overriden_get_client_mp_context
+import re
 
 
 class CommonSetup:
@@ -25,15 +18,6 @@ class CommonSetup:
         self.patches.append(self.mocker.patch.dict("os.environ", environ))
         # patch args, since current ones are from pytest call
         self.patches.append(self.mocker.patch("sys.argv", args))
-        # patch netbox client default mp context for the time of the tests
-        # patch may be ineffective since not in correct namespace(?)
-        self.patches.append(
-            self.mocker.patch(
-                "cosmo.clients.netbox_v4.get_client_mp_context",
-                new=override_get_client_mp_context("fork"),
-            )
-        )
-
         # patch configuration file lookup if requested
 
         # Note: If there is no configuration file given, we still need to patch this.
@@ -62,6 +46,7 @@ class ResponseMock:
     def __init__(self, status_code, obj):
         self.status_code = status_code
         self.text = json.dumps(obj)
+        self.content = self.text.encode()
         self.obj = obj
 
     def json(self):
@@ -90,6 +75,18 @@ class RequestResponseMock:
                         ],
                     },
                 )
+            elif "/api/vpn/l2vpn-terminations/" in url:
+                # one termination per L2VPN, Netbox would filter them
+                r = ResponseMock(
+                    200,
+                    {
+                        "next": None,
+                        "results": [
+                            {"id": i, "l2vpn": {"id": l2vpn.get("id", i)}}
+                            for i, l2vpn in enumerate(patchKwArgs.get("l2vpn_list", []))
+                        ],
+                    },
+                )
             else:
                 r = ResponseMock(
                     200,
@@ -110,6 +107,17 @@ class RequestResponseMock:
             ]
             retVal = dict()
 
+            # batched device queries are aliased, one sub-query per device
+            for alias, device in re.findall(
+                r'(\w+): device_list\(filters: \{ name: \{ i_exact: "(.*?)" \} \}\)',
+                q,
+            ):
+                retVal[alias] = [
+                    d
+                    for d in patchKwArgs.get("device_list", [])
+                    if str(d.get("name")).lower() == device.lower()
+                ]
+
             for rl in request_lists:
                 if "bgp_cpe" in q:
                     retVal["interface_list"] = patchKwArgs.get(
@@ -127,8 +135,8 @@ class RequestResponseMock:
             self.post_callback(q, r)
             return r
 
-        getMock = mocker.patch("requests.get", side_effect=patchGetFunc)
-        postMock = mocker.patch("requests.post", side_effect=patchPostFunc)
+        getMock = mocker.patch("requests.Session.get", side_effect=patchGetFunc)
+        postMock = mocker.patch("requests.Session.post", side_effect=patchPostFunc)
         return [getMock, postMock]
 
 
@@ -0,0 +1,258 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.request import Request, urlopen
+
+from cosmo import log
+from cosmo.clients.incremental import ChangeImpactResolver
+from cosmo.clients.netbox import NetboxClient
+from cosmo.common import DeviceSerializationError
+from cosmo.generator import (
+    get_device_fqdn,
+    is_device_allowed,
+    serialize_device,
+    write_device_output,
+)
+
+
+class ChangeDebouncer:
+    # collects affected devices of bursts of changes, and hands them over
+    # once no change came in for quiet_period seconds, or max_delay seconds
+    # after the first change of the burst. None stands for all devices.
+    DEFAULT_QUIET_PERIOD = 2.0
+    DEFAULT_MAX_DELAY = 30.0
+
+    def __init__(
+        self,
+        callback: Callable[[set[str] | None], None],
+        quiet_period: float = DEFAULT_QUIET_PERIOD,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ):
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.max_delay = max(max_delay, quiet_period)
+        self._condition = threading.Condition()
+        self._pending: set[str] | None = set()
+        self._first_change: float | None = None
+        self._last_change = 0.0
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="cosmo-debouncer", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, devices: set[str] | None):
+        with self._condition:
+            if devices is not None and not devices:
+                return
+            if devices is None or self._pending is None:
+                self._pending = None
+            else:
+                self._pending |= devices
+            now = time.monotonic()
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+            self._condition.notify_all()
+
+    def _due(self) -> float | None:
+        # seconds until the pending changes are handed over
+        if self._first_change is None:
+            return None
+        return (
+            min(
+                self._last_change + self.quiet_period,
+                self._first_change + self.max_delay,
+            )
+            - time.monotonic()
+        )
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due = self._due()
+                while not self._stopped and (due is None or due > 0):
+                    self._condition.wait(due)
+                    due = self._due()
+                if self._stopped:
+                    return
+                pending, self._pending = self._pending, set()
+                self._first_change = None
+            try:
+                self.callback(pending)
+            except Exception as e:
+                log.error(f"Regenerating after Netbox changes failed: {e}", None)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+
+class WebhookRegenerator:
+    # regenerates the devices affected by the object changes Netbox reports
+    # through webhooks. affected devices are found in the data of the
+    # previous generation (see ChangeImpactResolver), then refetched alone.
+    def __init__(
+        self,
+        netbox_client: NetboxClient,
+        cosmo_configuration,
+        allowed_hosts=None,
+        secret: str | None = None,
+        quiet_period: float = ChangeDebouncer.DEFAULT_QUIET_PERIOD,
+        max_delay: float = ChangeDebouncer.DEFAULT_MAX_DELAY,
+    ):
+        self.netbox_client = netbox_client
+        self.cosmo_configuration = cosmo_configuration
+        self.allowed_hosts = allowed_hosts
+        self.secret = secret
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.data: dict = {"device_list": [], "l2vpn_list": [], "loopbacks": {}}
+        self.regenerations = 0
+        self._resolver = ChangeImpactResolver(self.data)
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self._debouncer: ChangeDebouncer | None = None
+
+    def _deviceConfig(self, changed: set[str] | None) -> dict:
+        devices = self.cosmo_configuration["devices"]
+        if changed is None:
+            return {role: list(devices[role]) for role in ["router", "switch"]}
+        # names from Netbox data and from the configuration may differ in case
+        changed = {c.lower() for c in changed}
+        return {
+            role: [d for d in devices[role] if d.lower() in changed]
+            for role in ["router", "switch"]
+        }
+
+    def _mergeData(self, fetched: dict):
+        fetched_names = {d["name"] for d in fetched["device_list"]}
+        fetched_l2vpns = {str(l["id"]) for l in fetched["l2vpn_list"]}
+        self.data = {
+            "device_list": [
+                d for d in self.data["device_list"] if d["name"] not in fetched_names
+            ]
+            + fetched["device_list"],
+            "l2vpn_list": [
+                l for l in self.data["l2vpn_list"] if str(l["id"]) not in fetched_l2vpns
+            ]
+            + fetched["l2vpn_list"],
+            "loopbacks": {**self.data["loopbacks"], **fetched["loopbacks"]},
+        }
+
+    def regenerate(self, changed: set[str] | None):
+        # changed is None when every device has to be regenerated
+        device_config = self._deviceConfig(changed)
+        if not device_config["router"] and not device_config["switch"]:
+            return
+        fetched = self.netbox_client.get_data(device_config)
+        with self._lock:
+            self._mergeData(fetched)
+            self._resolver = ChangeImpactResolver(self.data)
+
+        for device in fetched["device_list"]:
+            device_fqdn = get_device_fqdn(device, self.cosmo_configuration)
+            if not is_device_allowed(device, device_fqdn, self.allowed_hosts):
+                continue
+            log.info(f"generating...", device_fqdn)
+            try:
+                content = serialize_device(
+                    dict(device), fetched, self.cosmo_configuration
+                )
+            except DeviceSerializationError as dse:
+                log.error(
+                    f"Device will not be generated, {type(dse).__name__}"
+                    f'("{dse}") was encountered while processing.',
+                    dse.associated_object,
+                )
+                continue
+            write_device_output(
+                device_fqdn, content, self.cosmo_configuration["output_format"]
+            )
+        self.regenerations += 1
+
+    def isAuthentic(self, body: bytes, signature: str | None) -> bool:
+        # Netbox signs the body with the webhook's secret (HMAC-SHA512)
+        if self.secret is None:
+            return True
+        expected = hmac.new(self.secret.encode(), body, hashlib.sha512).hexdigest()
+        return signature is not None and hmac.compare_digest(expected, signature)
+
+    def handleWebhook(self, payload: dict) -> set[str] | None:
+        with self._lock:
+            affected = self._resolver.affectedDevicesByWebhook(payload)
+        log.debug(
+            f"Netbox {payload.get('event')} {payload.get('model')} "
+            f"{(payload.get('data') or {}).get('id')}: "
+            f"{'all devices' if affected is None else sorted(affected)} affected"
+        )
+        if self._debouncer is not None:
+            self._debouncer.add(affected)
+        return affected
+
+    def listen(self, host: str, port: int):
+        # the first generation covers every device, and yields the data
+        # later changes are resolved against
+        self.regenerate(None)
+        debouncer = ChangeDebouncer(self.regenerate, self.quiet_period, self.max_delay)
+        self._debouncer = debouncer
+        regenerator = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not regenerator.isAuthentic(
+                    body, self.headers.get("X-Hook-Signature")
+                ):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    payload = None
+                # Netbox sends an object, anything else is not a webhook of it
+                if not isinstance(payload, dict):
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                regenerator.handleWebhook(payload)
+                self.send_response(202)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), WebhookRequestHandler)
+        log.info(f"Listening for Netbox webhooks on {host}:{self.port}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            debouncer.stop()
+
+    @property
+    def port(self) -> int | None:
+        return self._server.server_address[1] if self._server else None
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def send_webhook(url: str, payload: dict, secret: str | None = None) -> int:
+    # stands in for Netbox, e.g. to try out a listener by hand
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Hook-Signature"] = hmac.new(
+            secret.encode(), body, hashlib.sha512
+        ).hexdigest()
+    with urlopen(Request(url, data=body, headers=headers, method="POST")) as r:
+        return r.status